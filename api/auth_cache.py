@@ -0,0 +1,101 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Small in-process TTL + LRU caches for the lookups every upload makes before
+# doing real work: token -> user id, user id -> plan, and the free-plan
+# lifetime analysis count. Plan changes (Stripe verify/cancel) invalidate the
+# user's entries; inserting an analysis bumps the cached count in place. The
+# Stripe customer id of a user never changes once created, so it lives longer.
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", "60"))
+PLAN_CACHE_TTL = float(os.environ.get("PLAN_CACHE_TTL", "300"))
+CUSTOMER_CACHE_TTL = float(os.environ.get("CUSTOMER_CACHE_TTL", "3600"))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] <= time.monotonic():
+                if item is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float | None = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def incr(self, key, delta: int = 1):
+        """Adjust a cached counter in place; no-op if the key is not cached."""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and item[0] > time.monotonic():
+                self._data[key] = (item[0], item[1] + delta)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+token_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL)
+plan_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, PLAN_CACHE_TTL)
+quota_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, PLAN_CACHE_TTL)
+customer_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, CUSTOMER_CACHE_TTL)
+
+
+def token_key(token: str) -> str:
+    # Never keep raw bearer tokens in memory longer than the request.
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def record_analysis_inserted(user_id: str, count: int = 1):
+    quota_cache.incr(user_id, count)
+
+
+def record_analysis_failed(user_id: str):
+    quota_cache.incr(user_id, -1)
+
+
+def invalidate_user(user_id: str):
+    """Call whenever a user's plan changes."""
+    plan_cache.invalidate(user_id)
+    quota_cache.invalidate(user_id)
+
+
+def stats() -> dict:
+    return {"token": token_cache.stats(), "plan": plan_cache.stats(), "quota": quota_cache.stats(),
+            "customer": customer_cache.stats()}
@@ -0,0 +1,69 @@
+"""Fill risk_alerts for analyses saved before alerts were written at save time.
+
+    python backfill_risk_alerts.py                  # only analyses without alerts
+    python backfill_risk_alerts.py --rebuild        # rewrite every analysis' alerts (e.g. new risk types)
+    python backfill_risk_alerts.py --dry-run
+
+Walks completed analyses in id order, a page at a time: one query for the
+page, one to see which already have alerts, one bulk insert.
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+from risk_alerts import build_alerts
+
+
+def backfill(client, batch_size: int = 200, rebuild: bool = False, dry_run: bool = False) -> dict:
+    totals = {"analyses": 0, "skipped": 0, "alerts": 0}
+    last_id = None
+    while True:
+        query = client.table("analyses").select("id, user_id, risk_analysis").eq("status", "completed")
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(batch_size).execute().data or []
+        if not rows:
+            return totals
+        last_id = rows[-1]["id"]
+        ids = [row["id"] for row in rows]
+
+        if rebuild:
+            done = set()
+        else:
+            existing = client.table("risk_alerts").select("analysis_id").in_("analysis_id", ids).execute()
+            done = {row["analysis_id"] for row in existing.data or []}
+        pending = [row for row in rows if row["id"] not in done]
+        alerts = [alert for row in pending for alert in build_alerts(row["id"], row["user_id"], row.get("risk_analysis"))]
+
+        if not dry_run:
+            if rebuild:
+                client.table("risk_alerts").delete().in_("analysis_id", ids).execute()
+            if alerts:
+                client.table("risk_alerts").insert(alerts).execute()
+        totals["analyses"] += len(pending)
+        totals["skipped"] += len(done)
+        totals["alerts"] += len(alerts)
+        print(f"... up to {last_id}: {totals}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--rebuild", action="store_true", help="replace existing alerts too")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    load_dotenv()
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_SERVICE_KEY")
+    if not url or not key:
+        raise SystemExit("SUPABASE_URL and SUPABASE_SERVICE_KEY are required")
+    totals = backfill(create_client(url, key), args.batch_size, args.rebuild, args.dry_run)
+    print(f"{'Would insert' if args.dry_run else 'Inserted'} {totals['alerts']} alerts for "
+          f"{totals['analyses']} analyses ({totals['skipped']} already had alerts)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import hashlib
+import hmac
+import json
+import os
+import time
+
+# Stripe webhooks are the source of truth for users.plan: checkout completion
+# and subscription created/updated/deleted events set the plan, so request
+# handlers never wait on Stripe to learn whether a user is premium. Signatures
+# use Stripe's scheme (Stripe-Signature: t=<unix>,v1=<hex HMAC-SHA256 of
+# "<t>.<raw body>" with the endpoint secret>) and are checked here without the
+# SDK, which keeps the endpoint fast and testable against recorded payloads.
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
+STRIPE_WEBHOOK_TOLERANCE = int(os.environ.get("STRIPE_WEBHOOK_TOLERANCE", "300"))
+
+# past_due keeps premium while Stripe retries the payment; Stripe moves the
+# subscription to unpaid/canceled (and sends another event) if it gives up.
+PREMIUM_STATUSES = ("active", "trialing", "past_due")
+SUBSCRIPTION_EVENTS = ("customer.subscription.created", "customer.subscription.updated",
+                       "customer.subscription.deleted")
+
+
+class InvalidSignature(ValueError):
+    pass
+
+
+def sign_payload(payload: bytes, secret: str, timestamp: int | None = None) -> str:
+    """Stripe-Signature header for ``payload`` (what Stripe sends; used to replay recorded events)."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_event(payload: bytes, header: str | None, secret: str, tolerance: int = STRIPE_WEBHOOK_TOLERANCE,
+                 now: float | None = None) -> dict:
+    """The parsed event if ``header`` is a valid, recent signature of ``payload``; raises InvalidSignature."""
+    if not header:
+        raise InvalidSignature("Missing Stripe-Signature header")
+    timestamp, signatures = None, []
+    for item in header.split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        raise InvalidSignature("Malformed Stripe-Signature header")
+    expected = sign_payload(payload, secret, int(timestamp)).rpartition("v1=")[2]
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise InvalidSignature("Signature does not match payload")
+    if tolerance and abs((time.time() if now is None else now) - int(timestamp)) > tolerance:
+        raise InvalidSignature("Signature timestamp outside tolerance")
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        raise InvalidSignature("Payload is not JSON")
+    if not isinstance(event, dict) or not event.get("id") or not event.get("type"):
+        raise InvalidSignature("Payload is not a Stripe event")
+    return event
+
+
+def plan_update(event: dict) -> dict | None:
+    """What an event means for users.plan: {plan, user_id, customer_id, created}, or None if nothing."""
+    obj = (event.get("data") or {}).get("object") or {}
+    kind = event["type"]
+    user_id = (obj.get("metadata") or {}).get("user_id")
+    if kind == "checkout.session.completed":
+        if obj.get("mode") != "subscription" or obj.get("payment_status") not in ("paid", "no_payment_required"):
+            return None
+        plan = "premium"
+        user_id = obj.get("client_reference_id") or user_id
+    elif kind in SUBSCRIPTION_EVENTS:
+        active = kind != "customer.subscription.deleted" and obj.get("status") in PREMIUM_STATUSES
+        plan = "premium" if active else "free"
+    else:
+        return None
+    customer = obj.get("customer")
+    if isinstance(customer, dict):
+        customer = customer.get("id")
+    if not user_id and not customer:
+        return None
+    return {"plan": plan, "user_id": user_id, "customer_id": customer, "created": int(event.get("created") or 0)}
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import os
+from collections import Counter
+
+from llm import LLMClient
+from model_output import parse_section, parse_summary
+from observability import log
+from util import normalize_text
+
+# Map-reduce analysis for COFs longer than the single-prompt window. The text
+# is split into overlapping sections, each section is analyzed concurrently
+# against a per-section extraction schema (bounded by CHUNK_CONCURRENCY and the
+# LLM client's rate limiter), and the partial results are merged locally; one
+# small final call turns the merged findings into score/summary/recommendations.
+CHUNK_CHARS = int(os.environ.get("CHUNK_CHARS", "40000"))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "2000"))
+CHUNK_CONCURRENCY = int(os.environ.get("CHUNK_CONCURRENCY", "4"))
+
+# Items required by Lei 13.966/2019 that the analysis reports as missing.
+REQUIRED_ITEMS = {
+    "balancos": "Balanços financeiros dos últimos 2 exercícios",
+    "pendencias_judiciais": "Pendências judiciais da franqueadora",
+    "relacao_franqueados": "Relação de franqueados (ativos e desligados)",
+    "marca_inpi": "Situação da marca no INPI",
+}
+
+FINANCIAL_FIELDS = ("initial_investment", "franchise_fee", "royalties", "advertising_fund",
+                    "payback_period", "profitability")
+
+SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2, "critical": 3}
+
+SECTION_PROMPT_TEMPLATE = """
+Você é um advogado especialista em franchising brasileiro (Lei 13.966/2019) e analista financeiro sênior.
+Você está analisando a PARTE {index} de {total} de uma Circular de Oferta de Franquia (COF).
+Extraia SOMENTE o que estiver presente neste trecho. Use null para o que não aparecer.
+
+FORMATO DE SAÍDA (JSON):
+{{
+    "franchise_name": "Nome Fantasia (Razão Social) ou null",
+    "cnpj": "00.000.000/0000-00 ou null",
+    "score": <inteiro 0-100 avaliando apenas este trecho, ou null>,
+    "financials": {{
+        "initial_investment": "R$ X a R$ Y ou null",
+        "franchise_fee": "R$ X ou null",
+        "royalties": "X% sobre Faturamento Bruto ou null",
+        "advertising_fund": "X% sobre Faturamento Bruto ou null",
+        "payback_period": "X a Y meses ou null",
+        "profitability": "X% a Y% a.m. ou null"
+    }},
+    "risks": [
+        {{"severity": "high|medium|low", "title": "Título do Risco", "description": "Explicação"}}
+    ],
+    "found_items": [<quais destes itens aparecem neste trecho: "balancos", "pendencias_judiciais", "relacao_franqueados", "marca_inpi">],
+    "recommendations": ["Ação prática recomendada"]
+}}
+
+Trecho da COF (parte {index} de {total}):
+{text}
+"""
+
+REDUCE_PROMPT_TEMPLATE = """
+Você é um advogado especialista em franchising brasileiro (Lei 13.966/2019) e analista financeiro sênior.
+Abaixo estão os achados consolidados da análise de TODAS as partes de uma Circular de Oferta de Franquia (COF).
+Com base neles, produza a avaliação final.
+
+FORMATO DE SAÍDA (JSON):
+{{
+    "score": <inteiro 0-100 baseada na segurança jurídica e atratividade financeira>,
+    "summary": "Resumo executivo profissional começando com 'Análise da COF da franquia [NOME]...'. Destaque os pontos fortes e os alertas críticos em 2-3 parágrafos.",
+    "recommendations": ["Ação prática recomendada 1", "Ação prática recomendada 2"]
+}}
+
+Achados consolidados:
+{findings}
+"""
+
+
+def split_sections(text: str, chunk_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> list[str]:
+    """Split into sections of at most ``chunk_chars``, overlapping by ``overlap``, cut at line breaks."""
+    if len(text) <= chunk_chars:
+        return [text]
+    sections = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            cut = text.rfind("\n", start + chunk_chars // 2, end)
+            if cut != -1:
+                end = cut + 1
+        sections.append(text[start:end])
+        if end >= len(text):
+            break
+        next_start = end - overlap
+        newline = text.find("\n", next_start, end)
+        start = newline + 1 if newline != -1 else next_start
+    return sections
+
+
+def _present(value) -> bool:
+    return value not in (None, "", "null") and normalize_text(str(value)) not in ("nao informado", "n/a", "null")
+
+
+def merge_sections(partials: list[dict]) -> dict:
+    """Reduce step: combine per-section results into one analysis (minus score/summary)."""
+    names = Counter(p["franchise_name"] for p in partials if _present(p.get("franchise_name")))
+    cnpjs = Counter(p["cnpj"] for p in partials if _present(p.get("cnpj")))
+
+    financials = {}
+    for field in FINANCIAL_FIELDS:
+        # Earliest section wins: COFs state the headline figures before the detailed tables.
+        financials[field] = next(
+            (p["financials"][field] for p in partials
+             if isinstance(p.get("financials"), dict) and _present(p["financials"].get(field))),
+            "Não informado",
+        )
+
+    risks: dict[str, dict] = {}
+    for partial in partials:
+        for risk in partial.get("risks") or []:
+            if not isinstance(risk, dict) or not _present(risk.get("title")):
+                continue
+            key = normalize_text(risk["title"])
+            current = risks.get(key)
+            if current is None or SEVERITY_RANK.get(risk.get("severity"), 0) > SEVERITY_RANK.get(current.get("severity"), 0):
+                risks[key] = risk
+
+    found = {item for p in partials for item in (p.get("found_items") or [])}
+    recommendations = list(dict.fromkeys(
+        r for p in partials for r in (p.get("recommendations") or []) if _present(r)
+    ))
+    scores = [p["score"] for p in partials if isinstance(p.get("score"), (int, float))]
+
+    return {
+        "franchise_name": names.most_common(1)[0][0] if names else "Desconhecida",
+        "cnpj": cnpjs.most_common(1)[0][0] if cnpjs else None,
+        "score": round(sum(scores) / len(scores)) if scores else 0,
+        "financials": financials,
+        "risks": sorted(risks.values(), key=lambda r: -SEVERITY_RANK.get(r.get("severity"), 0)),
+        "missingClauses": [label for item, label in REQUIRED_ITEMS.items() if item not in found],
+        "recommendations": recommendations,
+    }
+
+
+async def analyze_chunked(llm: LLMClient, text: str, chunk_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP,
+                          concurrency: int = CHUNK_CONCURRENCY) -> tuple[dict, str]:
+    """Returns (analysis, model name of the final call). Raises if every section fails."""
+    sections = split_sections(text, chunk_chars, overlap)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze_section(index: int, section: str):
+        prompt = SECTION_PROMPT_TEMPLATE.format(index=index + 1, total=len(sections), text=section)
+        async with semaphore:
+            try:
+                partial, _ = await llm.generate(prompt, parse=parse_section)
+                return partial
+            except Exception as section_err:
+                log(f"Section {index + 1}/{len(sections)} analysis failed: {section_err}", level="error")
+                return None
+
+    results = await asyncio.gather(*(analyze_section(i, s) for i, s in enumerate(sections)))
+    partials = [r for r in results if r is not None]
+    if not partials:
+        raise RuntimeError("All COF sections failed to analyze")
+
+    analysis = merge_sections(partials)
+    failed_sections = [i + 1 for i, r in enumerate(results) if r is None]
+    analysis["sections_analyzed"] = len(partials)
+    if failed_sections:
+        analysis["sections_failed"] = failed_sections
+
+    model_name = llm.primary_model
+    findings = json.dumps({k: analysis[k] for k in ("franchise_name", "cnpj", "financials", "risks",
+                                                   "missingClauses", "recommendations")},
+                          ensure_ascii=False, indent=2)
+    try:
+        final, model_name = await llm.generate(REDUCE_PROMPT_TEMPLATE.format(findings=findings), parse=parse_summary)
+        for field in ("score", "summary", "recommendations"):
+            if final.get(field):
+                analysis[field] = final[field]
+    except Exception as reduce_err:
+        # Keep the locally merged result; the mean section score stands in for the final one.
+        log(f"Final summary call failed, using merged sections only: {reduce_err}", level="error")
+    analysis.setdefault("summary", f"Análise da COF da franquia {analysis['franchise_name']} "
+                                   f"consolidada a partir de {len(partials)} seções do documento.")
+    return analysis, model_name
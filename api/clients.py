@@ -0,0 +1,48 @@
+import importlib
+import threading
+from typing import Any, Callable
+
+# SDK clients are built on first use instead of at import. A cold start that
+# only serves /health, a job poll or a Stripe call then never pays for importing
+# the Supabase, Stripe, Gemini or PDF stacks it does not touch; once built, a
+# client lives for the rest of the process, so warm invocations reuse it.
+
+
+class Lazy:
+    """Proxy that builds its target on first attribute access.
+
+    Truthiness reports whether the target *can* be built (i.e. is configured),
+    without building it, so ``if not supabase:`` guards keep working.
+    """
+
+    def __init__(self, factory: Callable[[], Any], configured: Callable[[], bool] = lambda: True):
+        self._factory = factory
+        self._configured = configured
+        self._target = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._target is not None
+
+    def get(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    def __bool__(self) -> bool:
+        return self._target is not None or bool(self._configured())
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def lazy_module(name: str, setup: Callable[[Any], None] | None = None) -> Lazy:
+    def load():
+        module = importlib.import_module(name)
+        if setup:
+            setup(module)
+        return module
+    return Lazy(load)
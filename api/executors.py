@@ -0,0 +1,102 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from observability import log
+
+# Blocking work (Supabase/Gemini/Stripe SDK calls, disk I/O) must never run on the
+# event loop, otherwise a single 30-60s model call freezes every other request on
+# the worker (including /health). Both pools are bounded and sized via env vars.
+IO_POOL_SIZE = int(os.environ.get("IO_POOL_SIZE", "32"))
+CPU_POOL_SIZE = int(os.environ.get("CPU_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+# "process" gives real parallelism for PyPDF2; "thread" is the safe choice on
+# runtimes without /dev/shm (e.g. AWS Lambda / Vercel), where process pools fail.
+CPU_POOL_KIND = os.environ.get("CPU_POOL_KIND", "process")
+# OCR of scanned COFs gets its own small pool (same kind as the CPU pool), with
+# workers at lower priority and single-threaded Tesseract, so it cannot starve
+# text extraction or the event loop.
+OCR_POOL_SIZE = int(os.environ.get("OCR_POOL_SIZE", "1"))
+OCR_NICE = int(os.environ.get("OCR_NICE", "10"))
+
+_io_pool: Executor | None = None
+_cpu_pool: Executor | None = None
+_ocr_pool: Executor | None = None
+
+
+def get_io_pool() -> Executor:
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="io")
+    return _io_pool
+
+
+def get_cpu_pool() -> Executor:
+    global _cpu_pool
+    if _cpu_pool is None:
+        if CPU_POOL_KIND == "process":
+            try:
+                _cpu_pool = ProcessPoolExecutor(max_workers=CPU_POOL_SIZE)
+            except (OSError, NotImplementedError) as pool_err:
+                log(f"Process pool unavailable ({pool_err}), falling back to threads.", level="warning")
+        if _cpu_pool is None:
+            _cpu_pool = ThreadPoolExecutor(max_workers=CPU_POOL_SIZE, thread_name_prefix="cpu")
+    return _cpu_pool
+
+
+def cpu_pool_is_process() -> bool:
+    """Whether run_cpu arguments are pickled to another process (rather than shared with a thread)."""
+    return isinstance(get_cpu_pool(), ProcessPoolExecutor)
+
+
+def _init_ocr_worker():
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")  # inherited by the tesseract subprocess
+    try:
+        os.nice(OCR_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+def get_ocr_pool() -> Executor:
+    global _ocr_pool
+    if _ocr_pool is None:
+        if CPU_POOL_KIND == "process":
+            try:
+                _ocr_pool = ProcessPoolExecutor(max_workers=OCR_POOL_SIZE, initializer=_init_ocr_worker)
+            except (OSError, NotImplementedError) as pool_err:
+                log(f"Process pool unavailable for OCR ({pool_err}), falling back to threads.", level="warning")
+        if _ocr_pool is None:
+            # os.nice would apply to the whole process here, so threads only get the thread limit.
+            os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+            _ocr_pool = ThreadPoolExecutor(max_workers=OCR_POOL_SIZE, thread_name_prefix="ocr")
+    return _ocr_pool
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run a blocking I/O-bound callable on the bounded thread pool (in the caller's context, so logs keep the request id)."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_io_pool(), functools.partial(context.run, fn, *args, **kwargs))
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a CPU-bound callable on the CPU pool (callable and args must be picklable)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_pool(), functools.partial(fn, *args, **kwargs))
+
+
+async def run_ocr(fn, *args, **kwargs):
+    """Run an OCR callable on the OCR pool (callable and args must be picklable)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_ocr_pool(), functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_pools():
+    global _io_pool, _cpu_pool, _ocr_pool
+    for pool in (_io_pool, _cpu_pool, _ocr_pool):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    _io_pool = None
+    _cpu_pool = None
+    _ocr_pool = None
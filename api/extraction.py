@@ -0,0 +1,236 @@
+import asyncio
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+
+from executors import CPU_POOL_SIZE, run_cpu
+from observability import log
+
+# Page-range PDF text extraction. The page range is split into batches that run
+# on the CPU pool; results are stitched back in page order and no further
+# batches are scheduled once the char budget is reached.
+# Optimize: Only read first MAX_PAGES pages or until we have enough text
+MAX_PAGES = int(os.environ.get("EXTRACTION_MAX_PAGES", "50"))
+MAX_CHARS = int(os.environ.get("EXTRACTION_MAX_CHARS", "60000"))
+BATCH_PAGES = int(os.environ.get("EXTRACTION_BATCH_PAGES", "8"))
+# Below this many chars the PDF is most likely scanned (image-only).
+MIN_TEXT_CHARS = 100
+
+
+@dataclass
+class PageText:
+    index: int
+    text: str
+    seconds: float
+
+
+@dataclass
+class ExtractionResult:
+    text: str
+    page_count: int
+    pages: list[PageText] = field(default_factory=list)
+    truncated: bool = False
+    seconds: float = 0.0
+    ocr_pages: int = 0  # pages whose text came from OCR
+    ocr_attempted: bool = False  # OCR already ran, even if it recognized nothing
+
+    @property
+    def pages_extracted(self) -> int:
+        return len(self.pages)
+
+    @property
+    def likely_scanned(self) -> bool:
+        return len(self.text.strip()) < MIN_TEXT_CHARS
+
+    def page_offsets(self) -> list[int]:
+        """Char offset of each extracted page inside ``text``."""
+        offsets, pos = [], 0
+        for page in self.pages:
+            offsets.append(pos)
+            pos += len(page.text) + 1 if page.text else 0
+        return offsets
+
+    def timings(self) -> list[dict]:
+        return [{"page": p.index + 1, "chars": len(p.text), "seconds": round(p.seconds, 4)} for p in self.pages]
+
+    def to_dict(self) -> dict:
+        return {
+            "page_count": self.page_count,
+            "pages": [[p.index, p.text, p.seconds] for p in self.pages],
+            "truncated": self.truncated,
+            "seconds": self.seconds,
+            "ocr_pages": self.ocr_pages,
+            "ocr_attempted": self.ocr_attempted,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ExtractionResult":
+        pages = [PageText(index, text, seconds) for index, text, seconds in data["pages"]]
+        text = "".join(p.text + "\n" for p in pages if p.text)
+        return cls(text, data["page_count"], pages, data["truncated"], data["seconds"], data.get("ocr_pages", 0),
+                   data.get("ocr_attempted", bool(data.get("ocr_pages"))))
+
+
+def _open(source: bytes | str):
+    # BytesIO over bytes shares the upload buffer instead of copying it.
+    return io.BytesIO(source) if isinstance(source, bytes) else open(source, "rb")
+
+
+# Parsing the xref/page tree costs tens of ms on large COFs, so each pool worker
+# keeps the reader for the document it is working on, one per thread because
+# PdfReader is not safe to share between threads. Between batches a cached reader
+# holds no file handle or upload buffer (the stream is reattached for each batch
+# and closed after it), and release_readers() drops them when the document is done.
+_readers: dict[int, tuple[str, object]] = {}
+_readers_lock = threading.Lock()
+
+
+@contextmanager
+def _reader(source: bytes | str, key: str | None):
+    thread = threading.get_ident()
+    with _readers_lock:
+        cached = _readers.get(thread)
+    if key is not None and cached is not None and cached[0] == key:
+        reader = cached[1]
+        reader.stream = _open(source)
+    else:
+        import PyPDF2  # deferred: only jobs that extract text need it
+        reader = PyPDF2.PdfReader(_open(source))
+        with _readers_lock:
+            if key is not None:
+                _readers[thread] = (key, reader)
+            else:
+                _readers.pop(thread, None)
+    try:
+        yield reader
+    finally:
+        reader.stream.close()
+
+
+def release_readers(key: str):
+    """Drop the cached readers of a finished document (this process's workers)."""
+    with _readers_lock:
+        for thread in [t for t, (cached_key, _) in _readers.items() if cached_key == key]:
+            del _readers[thread]
+
+
+def count_pages(source: bytes | str, key: str | None = None) -> int:
+    with _reader(source, key) as reader:
+        return len(reader.pages)
+
+
+def extract_page_range(source: bytes | str, start: int, stop: int, key: str | None = None) -> list[PageText]:
+    # Runs on the CPU pool, so it must stay a picklable module-level function.
+    pages = []
+    with _reader(source, key) as reader:
+        for i in range(start, min(stop, len(reader.pages))):
+            began = time.perf_counter()
+            try:
+                extracted = reader.pages[i].extract_text() or ""
+            except Exception as page_err:
+                log(f"PDF extraction error on page {i + 1}: {page_err}", level="error")
+                extracted = ""
+            pages.append(PageText(i, extracted, time.perf_counter() - began))
+    return pages
+
+
+def _assemble(pages: list[PageText], page_count: int, max_chars: int, seconds: float) -> ExtractionResult:
+    # Same budget semantics as the old serial loop: keep the page that crosses max_chars, drop the rest.
+    parts, kept, total = [], [], 0
+    for page in pages:
+        if page.text:
+            parts.append(page.text)
+            parts.append("\n")
+            total += len(page.text) + 1
+        kept.append(page)
+        if total > max_chars:
+            break
+    truncated = len(kept) < page_count
+    return ExtractionResult("".join(parts), page_count, kept, truncated, seconds)
+
+
+def extract_text(source: bytes | str, max_pages: int = MAX_PAGES, max_chars: int = MAX_CHARS) -> ExtractionResult:
+    """Serial extraction in the calling thread/process."""
+    import PyPDF2
+    began = time.perf_counter()
+    pages, total, page_count = [], 0, 0
+    try:
+        with _open(source) as pdf_file:
+            reader = PyPDF2.PdfReader(pdf_file)
+            page_count = len(reader.pages)
+            for i in range(min(page_count, max_pages)):
+                page_began = time.perf_counter()
+                extracted = reader.pages[i].extract_text() or ""
+                pages.append(PageText(i, extracted, time.perf_counter() - page_began))
+                total += len(extracted) + 1 if extracted else 0
+                if total > max_chars:
+                    break
+    except Exception as pdf_err:
+        log(f"PDF extraction error: {pdf_err}", level="error")
+    return _assemble(pages, page_count, max_chars, time.perf_counter() - began)
+
+
+async def extract_text_parallel(source: bytes | str, max_pages: int = MAX_PAGES, max_chars: int = MAX_CHARS,
+                                batch_pages: int = BATCH_PAGES, max_in_flight: int = CPU_POOL_SIZE,
+                                key: str | None = None) -> ExtractionResult:
+    """Extract page batches concurrently on the CPU pool, stopping once the char budget is met.
+
+    ``key`` (the file hash) lets pool workers reuse an already parsed reader across batches.
+    """
+    try:
+        return await _extract_batches(source, max_pages, max_chars, batch_pages, max_in_flight, key)
+    finally:
+        if key is not None:
+            release_readers(key)
+
+
+async def _extract_batches(source: bytes | str, max_pages: int, max_chars: int, batch_pages: int,
+                           max_in_flight: int, key: str | None) -> ExtractionResult:
+    began = time.perf_counter()
+    try:
+        page_count = await run_cpu(count_pages, source, key)
+    except Exception as pdf_err:
+        log(f"PDF extraction error: {pdf_err}", level="error")
+        return ExtractionResult("", 0, seconds=time.perf_counter() - began)
+
+    limit = min(page_count, max_pages)
+    ranges = [(start, min(start + batch_pages, limit)) for start in range(0, limit, batch_pages)]
+    results: dict[int, list[PageText]] = {}
+    in_flight: dict[asyncio.Future, int] = {}
+    next_range = 0
+    done_prefix = 0  # number of leading batches already received
+    prefix_chars = 0
+
+    def schedule():
+        nonlocal next_range
+        while next_range < len(ranges) and len(in_flight) < max_in_flight and prefix_chars <= max_chars:
+            start, stop = ranges[next_range]
+            in_flight[asyncio.ensure_future(run_cpu(extract_page_range, source, start, stop, key))] = next_range
+            next_range += 1
+
+    try:
+        schedule()
+        while in_flight:
+            finished, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                results[in_flight.pop(future)] = future.result()
+            while done_prefix in results:
+                prefix_chars += sum(len(p.text) + 1 for p in results[done_prefix] if p.text)
+                done_prefix += 1
+            if prefix_chars > max_chars:
+                # Budget reached: drop work that has not started yet, let running batches finish.
+                for future in in_flight:
+                    future.cancel()
+                break
+            schedule()
+    except Exception as pdf_err:
+        log(f"PDF extraction error: {pdf_err}", level="error")
+        for future in in_flight:
+            future.cancel()
+
+    pages = [page for i in range(done_prefix) for page in results[i]]
+    return _assemble(pages, page_count, max_chars, time.perf_counter() - began)
@@ -0,0 +1,124 @@
+import re
+
+from util import normalize_text
+
+# Numeric view of an analysis, stored in analyses.financial_analysis when the
+# analysis is saved. The model reports financials as free text ("R$ 150.000 a
+# R$ 250.000", "6% sobre Faturamento Bruto", "18 a 24 meses"); they are parsed
+# here once into min/max numbers so comparisons can sort and rank without
+# re-reading (or re-parsing) the risk_analysis blob.
+FINANCIAL_VERSION = 1
+
+_MONEY_FIELDS = ("initial_investment", "franchise_fee")
+_PERCENT_FIELDS = ("royalties", "advertising_fund", "profitability")
+
+# 1.234.567,89 | 150.000 | 40000 | 1,5 -- optionally followed by a multiplier word.
+_NUMBER = re.compile(r"(\d{1,3}(?:\.\d{3})+(?:,\d+)?|\d+(?:,\d+)?)\s*(milhoes|milhao|mil|mi|mm|k)?\b")
+_PERCENT = re.compile(r"(\d+(?:[.,]\d+)?)\s*%")
+_MULTIPLIERS = {"mil": 1e3, "k": 1e3, "milhao": 1e6, "milhoes": 1e6, "mi": 1e6, "mm": 1e6}
+_DURATION = re.compile(r"(\d+(?:[.,]\d+)?)\s*(?:a|-|–|ate)?\s*(\d+(?:[.,]\d+)?)?\s*(meses|mes|anos|ano)\b")
+
+
+def _to_float(raw: str) -> float:
+    return float(raw.replace(".", "").replace(",", "."))
+
+
+def _range(values: list[float]) -> tuple[float, float] | None:
+    return (min(values), max(values)) if values else None
+
+
+def parse_money(text) -> tuple[float, float] | None:
+    """(min, max) in reais from text like "R$ 150.000 a R$ 250.000" or "R$ 1,2 milhão"."""
+    if not isinstance(text, str):
+        return None
+    values = []
+    normalized = normalize_text(text)
+    # Percentages ("6% sobre...") are not amounts.
+    for number, multiplier in _NUMBER.findall(_PERCENT.sub(" ", normalized)):
+        value = _to_float(number) * _MULTIPLIERS.get(multiplier, 1)
+        # A bare "1" or "2" is a count or an item number, not an amount in reais.
+        if value >= 100:
+            values.append(value)
+    return _range(values)
+
+
+def parse_percent(text) -> tuple[float, float] | None:
+    if not isinstance(text, str):
+        return None
+    return _range([float(v.replace(",", ".")) for v in _PERCENT.findall(text)])
+
+
+def parse_months(text) -> tuple[float, float] | None:
+    """(min, max) in months from text like "18 a 24 meses" or "2 anos"."""
+    if not isinstance(text, str):
+        return None
+    match = _DURATION.search(normalize_text(text))
+    if not match:
+        return None
+    low, high, unit = match.groups()
+    factor = 12 if unit.startswith("ano") else 1
+    low = float(low.replace(",", ".")) * factor
+    high = float(high.replace(",", ".")) * factor if high else low
+    return min(low, high), max(low, high)
+
+
+def _put(out: dict, name: str, parsed: tuple[float, float] | None):
+    out[f"{name}_min"], out[f"{name}_max"] = parsed if parsed else (None, None)
+
+
+def normalize_financials(analysis: dict) -> dict:
+    """Flat numeric summary of an analysis for analyses.financial_analysis."""
+    financials = analysis.get("financials") if isinstance(analysis.get("financials"), dict) else {}
+    out = {"version": FINANCIAL_VERSION}
+    for field in _MONEY_FIELDS:
+        _put(out, field, parse_money(financials.get(field)))
+    for field in _PERCENT_FIELDS:
+        _put(out, f"{field}_pct", parse_percent(financials.get(field)))
+    _put(out, "payback_months", parse_months(financials.get("payback_period")))
+
+    counts = {"critical": 0, "high": 0, "medium": 0, "low": 0}
+    for risk in analysis.get("risks") or []:
+        if isinstance(risk, dict) and risk.get("severity") in counts:
+            counts[risk["severity"]] += 1
+    out["risk_counts"] = counts
+    return out
+
+
+def midpoint(numbers: dict, name: str) -> float | None:
+    low, high = numbers.get(f"{name}_min"), numbers.get(f"{name}_max")
+    if low is None or high is None:
+        return None
+    return (low + high) / 2
+
+
+def _risk_weight(numbers: dict) -> tuple:
+    counts = numbers.get("risk_counts") or {}
+    return tuple(counts.get(s, 0) for s in ("critical", "high", "medium", "low"))
+
+
+# Ranking -> (value of an item, higher is better). Items without a value rank last.
+RANKINGS = {
+    "score": (lambda item: item.get("score"), True),
+    "investment": (lambda item: midpoint(item["financials"], "initial_investment"), False),
+    "payback": (lambda item: midpoint(item["financials"], "payback_months"), False),
+    "risks": (lambda item: _risk_weight(item["financials"]), False),
+}
+
+
+def rank(items: list[dict]) -> dict[str, list[str]]:
+    """Adds ``ranks`` (1 = best, None = no data) to every item; returns ranking -> ids best first."""
+    orders = {}
+    for name, (value_of, higher_is_better) in RANKINGS.items():
+        valued = [(value_of(item), item) for item in items]
+        present = sorted(((v, i) for v, i in valued if v is not None), key=lambda pair: pair[0],
+                         reverse=higher_is_better)
+        previous, position = object(), 0
+        for index, (value, item) in enumerate(present):
+            if value != previous:
+                position, previous = index + 1, value
+            item.setdefault("ranks", {})[name] = position
+        for value, item in valued:
+            if value is None:
+                item.setdefault("ranks", {})[name] = None
+        orders[name] = [item["id"] for _, item in present] + [i["id"] for v, i in valued if v is None]
+    return orders
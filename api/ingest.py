@@ -0,0 +1,132 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+
+# Single-pass upload ingest: the upload is read once in large chunks, hashed
+# while reading, kept in memory when small and spilled to a *unique* temp file
+# only above INGEST_SPOOL_THRESHOLD. Replaces the old copy-to-/tmp, re-read to
+# hash, re-open for PyPDF2 round trip (and its same-filename collisions).
+INGEST_CHUNK_SIZE = int(os.environ.get("INGEST_CHUNK_SIZE", str(1024 * 1024)))
+INGEST_SPOOL_THRESHOLD = int(os.environ.get("INGEST_SPOOL_THRESHOLD", str(16 * 1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+UPLOAD_DIR = Path(tempfile.gettempdir())
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit: int = MAX_UPLOAD_BYTES):
+        super().__init__(f"Upload exceeds the {limit // (1024 * 1024)} MB limit")
+        self.limit = limit
+
+
+class IngestedFile:
+    """An uploaded PDF held either in memory (``data``) or in a spill file (``path``)."""
+
+    def __init__(self, filename: str, sha256: str, size: int, data: bytes | None = None,
+                 path: Path | None = None):
+        self.filename = filename
+        self.sha256 = sha256
+        self.size = size
+        self.data = data
+        self.path = path
+
+    @property
+    def in_memory(self) -> bool:
+        return self.data is not None
+
+    def source(self) -> bytes | str:
+        """What to hand to the (picklable) PDF extraction functions."""
+        return self.data if self.data is not None else str(self.path)
+
+    def spill(self) -> Path:
+        """Move an in-memory upload to a unique temp file, for a worker in another process."""
+        if self.path is None:
+            spill = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, prefix="cof-", suffix=".pdf", delete=False)
+            try:
+                with spill:
+                    spill.write(self.data)
+            except BaseException:
+                Path(spill.name).unlink(missing_ok=True)
+                raise
+            self.path = Path(spill.name)
+            self.data = None
+        return self.path
+
+    def cleanup(self):
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+            self.path = None
+        self.data = None
+
+
+def ingest_upload(src, filename: str, max_bytes: int = MAX_UPLOAD_BYTES,
+                  spool_threshold: int = INGEST_SPOOL_THRESHOLD,
+                  chunk_size: int = INGEST_CHUNK_SIZE) -> IngestedFile:
+    """Read ``src`` once, hashing as we go. Raises UploadTooLarge as soon as the limit is crossed."""
+    sha256_hash = hashlib.sha256()
+    chunks: list[bytes] = []
+    size = 0
+    spill = None
+    try:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            sha256_hash.update(chunk)
+            if spill is None and size > spool_threshold:
+                spill = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, prefix="cof-", suffix=".pdf", delete=False)
+                spill.writelines(chunks)
+                chunks = []
+            if spill is not None:
+                spill.write(chunk)
+            else:
+                chunks.append(chunk)
+    except BaseException:
+        if spill is not None:
+            spill.close()
+            Path(spill.name).unlink(missing_ok=True)
+        raise
+
+    if spill is not None:
+        spill.close()
+        return IngestedFile(filename, sha256_hash.hexdigest(), size, path=Path(spill.name))
+    return IngestedFile(filename, sha256_hash.hexdigest(), size, data=b"".join(chunks))
+
+
+def ingest_zip(src, filename: str, max_files: int,
+               max_bytes: int = MAX_UPLOAD_BYTES) -> tuple[list[IngestedFile], list[tuple[str, str]]]:
+    """Ingest every PDF inside a ZIP upload. Returns (files, [(name, reason) rejected])."""
+    files: list[IngestedFile] = []
+    rejected: list[tuple[str, str]] = []
+    try:
+        archive = zipfile.ZipFile(src)
+    except zipfile.BadZipFile:
+        return files, [(filename, "Invalid ZIP archive")]
+    with archive:
+        for member in archive.infolist():
+            name = Path(member.filename).name
+            if member.is_dir() or member.filename.startswith("__MACOSX/") or name.startswith("."):
+                continue
+            if not name.endswith(".pdf"):
+                rejected.append((name, "Only PDF files are allowed"))
+                continue
+            if len(files) >= max_files:
+                rejected.append((name, f"Batch limit of {max_files} files reached"))
+                continue
+            # The declared size is only a hint; ingest_upload enforces the limit while reading.
+            if member.file_size > max_bytes:
+                rejected.append((name, str(UploadTooLarge(max_bytes))))
+                continue
+            try:
+                with archive.open(member) as member_file:
+                    files.append(ingest_upload(member_file, name, max_bytes))
+            except UploadTooLarge as too_large:
+                rejected.append((name, str(too_large)))
+            except (zipfile.BadZipFile, OSError) as zip_err:
+                rejected.append((name, f"Could not read file from archive: {zip_err}"))
+    return files, rejected
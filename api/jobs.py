@@ -0,0 +1,374 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable
+
+from executors import run_io
+from observability import log
+from util import env_flag
+
+# Analysis job queue. POST /api/cof/upload enqueues a job and returns at once;
+# a small pool of worker tasks drains the queue and reports progress per stage,
+# which GET /api/cof/jobs/{id} (and its SSE variant) expose to the frontend.
+# Backends are pluggable: "memory" for a single process, "sqlite" to survive
+# restarts and share the queue between processes on one host.
+# The workers are tasks of the API process, started by the ASGI lifespan, and
+# they outlive the request that enqueued the job. Serverless functions (Vercel)
+# give neither guarantee, so there JOB_INLINE makes the upload wait for its job.
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "memory")
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "0.5"))
+# A processing job whose worker shows no sign of life (claim or stage change) for
+# this long is taken to be orphaned by a dead process and queued again.
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "900"))
+JOB_INLINE = env_flag("JOB_INLINE", "1" if os.environ.get("VERCEL") else "0")
+
+# Job statuses mirror the analyses.status CHECK constraint (+ "queued").
+QUEUED = "queued"
+PROCESSING = "processing"
+COMPLETED = "completed"
+FAILED = "failed"
+FINISHED = (COMPLETED, FAILED)
+
+
+def _new_job(job_id: str, user_id: str, payload: dict) -> dict:
+    now = time.time()
+    return {
+        "id": job_id,
+        "user_id": user_id,
+        "status": QUEUED,
+        "stage": QUEUED,
+        "stages": [],
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class JobBackend:
+    """Storage + queue contract. Methods are synchronous and thread-safe."""
+
+    # Whether another process may claim the jobs (so payloads must not point at this process's memory).
+    shared = False
+
+    def put(self, job: dict) -> None:
+        raise NotImplementedError
+
+    def claim(self) -> dict | None:
+        """Atomically move the oldest queued job to processing and return it."""
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields) -> dict | None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def requeue_stale(self, lease: float = JOB_LEASE_SECONDS) -> int:
+        """Put jobs left in processing by a dead worker (claim older than ``lease``) back in the queue."""
+        return 0
+
+
+class InMemoryJobBackend(JobBackend):
+    def __init__(self, max_finished: int = 1000):
+        self._lock = threading.Lock()
+        self._jobs: dict[str, dict] = {}
+        self._queue: list[str] = []
+        self._max_finished = max_finished
+
+    def put(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._queue.append(job["id"])
+
+    def claim(self):
+        with self._lock:
+            while self._queue:
+                job = self._jobs.get(self._queue.pop(0))
+                if job and job["status"] == QUEUED:
+                    job.update(status=PROCESSING, updated_at=time.time())
+                    return dict(job)
+        return None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields, updated_at=time.time())
+            if job["status"] in FINISHED:
+                self._evict_finished()
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _evict_finished(self):
+        finished = [j for j in self._jobs.values() if j["status"] in FINISHED]
+        if len(finished) > self._max_finished:
+            finished.sort(key=lambda j: j["updated_at"])
+            for job in finished[: len(finished) - self._max_finished]:
+                del self._jobs[job["id"]]
+
+
+class SQLiteJobBackend(JobBackend):
+    _JSON_FIELDS = ("stages", "payload", "result")
+    shared = True
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT,
+                status TEXT NOT NULL,
+                stage TEXT,
+                stages TEXT,
+                payload TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL,
+                claimed_at REAL
+            )
+        """)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "claimed_at" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN claimed_at REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)")
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        for field in self._JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        return job
+
+    def put(self, job):
+        values = {k: (json.dumps(v) if k in self._JSON_FIELDS else v) for k, v in job.items()}
+        columns = ", ".join(values)
+        placeholders = ", ".join(f":{k}" for k in values)
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO jobs ({columns}) VALUES ({placeholders})", values)
+
+    def claim(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                now = time.time()
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ?, claimed_at = ? WHERE id = ?",
+                    (PROCESSING, now, now, row["id"]),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        job = self._row_to_job(row)
+        job["status"] = PROCESSING
+        return job
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        values = {k: (json.dumps(v) if k in self._JSON_FIELDS else v) for k, v in fields.items()}
+        assignments = ", ".join(f"{k} = :{k}" for k in values)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = :_id", {**values, "_id": job_id})
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def requeue_stale(self, lease=JOB_LEASE_SECONDS):
+        # Jobs another live process is running keep moving through stages (updated_at);
+        # only claims with no progress for a whole lease are taken back.
+        cutoff = time.time() - lease
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, claimed_at = NULL "
+                "WHERE status = ? AND COALESCE(claimed_at, 0) < ? AND COALESCE(updated_at, 0) < ?",
+                (QUEUED, QUEUED, PROCESSING, cutoff, cutoff),
+            )
+        return cursor.rowcount
+
+
+def create_backend(kind: str = JOB_BACKEND) -> JobBackend:
+    if kind == "sqlite":
+        return SQLiteJobBackend(JOB_DB_PATH)
+    if kind == "memory":
+        return InMemoryJobBackend()
+    raise ValueError(f"Unknown JOB_BACKEND: {kind}")
+
+
+class JobContext:
+    """Handed to the job handler so it can report stage progress."""
+
+    def __init__(self, queue: "JobQueue", job: dict):
+        self.queue = queue
+        self.job = job
+        self.payload = job["payload"]
+
+    async def stage(self, name: str):
+        now = time.time()
+        stages = self.job["stages"]
+        if stages and stages[-1].get("finished_at") is None:
+            stages[-1]["finished_at"] = now
+        stages.append({"name": name, "started_at": now, "finished_at": None})
+        self.job = await run_io(self.queue.backend.update, self.job["id"], stage=name, stages=stages) or self.job
+        self.queue.notify()
+
+
+class JobFailed(Exception):
+    """Raised by a handler to fail a job while still attaching a result."""
+
+    def __init__(self, message: str, result: dict | None = None):
+        super().__init__(message)
+        self.result = result
+
+
+JobHandler = Callable[[JobContext], Awaitable[dict]]
+
+
+class JobQueue:
+    def __init__(self, backend: JobBackend, handler: JobHandler, workers: int = JOB_WORKERS,
+                 poll_interval: float = JOB_POLL_INTERVAL, lease: float = JOB_LEASE_SECONDS):
+        self.backend = backend
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._tasks: list[asyncio.Task] = []
+        self._pending: asyncio.Semaphore | None = None
+        self._changed = asyncio.Event()
+        self._stopping = False
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._pending = asyncio.Semaphore(0)
+        self._changed = asyncio.Event()
+        self._stopping = False
+        await self._requeue_stale()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.backend.shared:
+            # Claims of a process that died while this one runs expire too, not only at startup.
+            self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def _requeue_stale(self):
+        requeued = await run_io(self.backend.requeue_stale, self.lease)
+        if requeued:
+            log(f"Requeued {requeued} interrupted analysis job(s).", level="warning")
+
+    async def _reaper(self):
+        while not self._stopping:
+            await asyncio.sleep(max(self.lease / 4, self.poll_interval))
+            try:
+                await self._requeue_stale()
+            except Exception as reap_err:
+                log(f"Requeueing stale jobs failed: {reap_err}", level="error")
+
+    async def stop(self):
+        # The flag matters: asyncio.wait_for can swallow a cancel that races with acquire().
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job_id: str, user_id: str, payload: dict) -> dict:
+        if not self._tasks:
+            # No lifespan startup (serverless runners): start the workers on first use.
+            await self.start()
+        job = _new_job(job_id, user_id, payload)
+        await run_io(self.backend.put, job)
+        if self._pending is not None:
+            self._pending.release()
+        return job
+
+    async def get(self, job_id: str) -> dict | None:
+        return await run_io(self.backend.get, job_id)
+
+    def notify(self):
+        """Wake everyone in wait_for_change (a job of this process moved on)."""
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, timeout: float | None = None):
+        """Until a job run by this process changes stage or finishes; ``timeout`` bounds the wait
+        for jobs other processes run, which can only be polled."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), self.poll_interval if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def wait(self, job_id: str) -> dict | None:
+        """The job once it has finished (None if the backend lost it)."""
+        while True:
+            job = await self.get(job_id)
+            if job is None or job["status"] in FINISHED:
+                return job
+            await self.wait_for_change()
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._pending.acquire(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return
+            job = await run_io(self.backend.claim)
+            if job is None:
+                continue
+            await self._run(job)
+
+    async def _run(self, job: dict):
+        ctx = JobContext(self, job)
+        status, result, error = COMPLETED, None, None
+        try:
+            result = await self.handler(ctx)
+        except JobFailed as job_err:
+            status, result, error = FAILED, job_err.result, str(job_err)
+        except Exception as job_err:
+            log(f"Analysis job {job['id']} failed: {job_err}", level="error")
+            status, error = FAILED, str(job_err)
+        stages = ctx.job["stages"]
+        if stages and stages[-1].get("finished_at") is None:
+            stages[-1]["finished_at"] = time.time()
+        await run_io(self.backend.update, job["id"], status=status, stage=status, stages=stages,
+                     result=result, error=error)
+        self.notify()
+
+
+def public_view(job: dict) -> dict:
+    """Job fields safe to return to the client (no internal payload)."""
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "stages": job["stages"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
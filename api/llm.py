@@ -0,0 +1,301 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable
+
+from executors import run_io
+from observability import log
+from util import env_flag
+
+# Model access for the analysis pipeline. Model objects are created on first
+# use and reused; every call goes through a token-bucket limiter sized to our TPM quota,
+# gets a timeout, is retried with jittered backoff on 429s, and falls back to a
+# second model -- sequentially, or hedged (fallback fired after LLM_HEDGE_DELAY
+# seconds, first success wins).
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "gemini")
+# Trying a lighter/preview model to avoid rate limits
+# Fallback list: gemini-2.0-flash-lite-preview-02-05 -> gemini-flash-latest
+PRIMARY_MODEL = os.environ.get("LLM_PRIMARY_MODEL", "gemini-2.0-flash-lite-preview-02-05")
+FALLBACK_MODEL = os.environ.get("LLM_FALLBACK_MODEL", "gemini-flash-latest")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "120"))
+LLM_TPM_LIMIT = int(os.environ.get("LLM_TPM_LIMIT", "1000000"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "1.0"))
+# Seconds before the fallback model is fired in parallel; unset/0 = sequential fallback.
+LLM_HEDGE_DELAY = float(os.environ.get("LLM_HEDGE_DELAY", "0"))
+# Ask Gemini for JSON-mode output (response_mime_type=application/json).
+LLM_JSON_MODE = env_flag("LLM_JSON_MODE")
+# Model calls in flight at once across all jobs, batches and chunked sections.
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+
+# Rough chars-per-token ratio used to size requests against the TPM budget.
+CHARS_PER_TOKEN = 4
+
+
+class RateLimited(Exception):
+    """The provider answered 429 / resource exhausted."""
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at ``rate_per_minute``."""
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.tokens = float(rate_per_minute)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: int):
+        # A request bigger than the whole bucket waits for a full bucket instead of forever.
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class LLMBackend:
+    """Blocking text-generation backend; called from the I/O pool."""
+
+    name = "base"
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def generate(self, model_name: str, prompt: str, timeout: float) -> str:
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str | None, model_names: tuple[str, ...]):
+        self.api_key = api_key
+        self.model_names = model_names
+        self._models: dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._configured = False
+
+    @property
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def _model(self, model_name: str):
+        # The SDK is imported and configured on the first call, not at startup.
+        with self._lock:
+            if model_name not in self._models:
+                import google.generativeai as genai
+                if not self._configured:
+                    genai.configure(api_key=self.api_key)
+                    self._configured = True
+                self._models[model_name] = genai.GenerativeModel(model_name)
+            return self._models[model_name]
+
+    def generate(self, model_name, prompt, timeout):
+        from google.api_core import exceptions as google_exceptions
+        generation_config = {"response_mime_type": "application/json"} if LLM_JSON_MODE else None
+        try:
+            response = self._model(model_name).generate_content(
+                prompt, generation_config=generation_config, request_options={"timeout": timeout}
+            )
+        except google_exceptions.ResourceExhausted as quota_err:
+            raise RateLimited(str(quota_err)) from quota_err
+        return response.text
+
+
+FAKE_ANALYSIS = {
+    "franchise_name": "Franquia Exemplo (Exemplo Franchising Ltda.)",
+    "cnpj": "12.345.678/0001-90",
+    "score": 72,
+    "summary": "Análise da COF da franquia Franquia Exemplo. Resposta gerada pelo backend local de testes.",
+    "financials": {
+        "initial_investment": "R$ 150.000 a R$ 250.000",
+        "franchise_fee": "R$ 40.000",
+        "royalties": "6% sobre Faturamento Bruto",
+        "advertising_fund": "2% sobre Faturamento Bruto",
+        "payback_period": "18 a 24 meses",
+        "profitability": "10% a 15% a.m."
+    },
+    "risks": [
+        {"severity": "high", "title": "Multa Rescisória", "description": "Multa elevada em caso de rescisão antecipada."},
+        {"severity": "low", "title": "Taxa de Renovação", "description": "Taxa de renovação não fixada em valor."}
+    ],
+    "missingClauses": ["Balanços financeiros dos últimos 2 exercícios"],
+    "recommendations": ["Negociar a redução da multa rescisória."]
+}
+
+
+class FakeBackend(LLMBackend):
+    """Offline backend for load tests: configurable latency, jitter, 429s, errors and malformed output.
+
+    ``distribution="uniform"`` spreads latency evenly over latency ± jitter; ``"lognormal"``
+    uses latency as the median and jitter as sigma, which gives the long tail real models have.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0, rate_limit_rate: float = 0.0,
+                 error_rate: float = 0.0, malformed_rate: float = 0.0, response: dict | None = None,
+                 seed: int | None = None, distribution: str = "uniform"):
+        if distribution not in ("uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.response = response or FAKE_ANALYSIS
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.calls_by_model: dict[str, int] = {}
+
+    def generate(self, model_name, prompt, timeout):
+        with self._lock:
+            self.calls += 1
+            self.calls_by_model[model_name] = self.calls_by_model.get(model_name, 0) + 1
+            roll = self._random.random()
+            defect = self._random.random()
+            if self.distribution == "lognormal":
+                delay = self.latency * self._random.lognormvariate(0.0, self.jitter)
+            else:
+                delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        time.sleep(min(delay, timeout))
+        if delay > timeout:
+            raise TimeoutError(f"fake {model_name} timed out")
+        if roll < self.rate_limit_rate:
+            raise RateLimited(f"fake {model_name}: 429 quota exceeded")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise RuntimeError(f"fake {model_name}: internal error")
+        text = json.dumps(self.response, ensure_ascii=False)
+        if defect < self.malformed_rate / 2:
+            # Cut off mid-object, like a response that hit max tokens: fields are missing.
+            return "Segue a análise solicitada:\n" + text[: len(text) * 3 // 4]
+        if defect < self.malformed_rate:
+            # Chatty preamble and a trailing comma: repairable locally.
+            return "Segue a análise solicitada:\n" + text[:-1] + ",}\nEspero ter ajudado."
+        return "```json\n" + text + "\n```"
+
+
+class LLMClient:
+    def __init__(self, backend: LLMBackend, primary_model: str = PRIMARY_MODEL,
+                 fallback_model: str | None = FALLBACK_MODEL, timeout: float = LLM_TIMEOUT,
+                 tpm_limit: int = LLM_TPM_LIMIT, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE, hedge_delay: float = LLM_HEDGE_DELAY,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.backend = backend
+        self.primary_model = primary_model
+        self.fallback_model = fallback_model
+        self.timeout = timeout
+        self.limiter = TokenBucket(tpm_limit)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.hedge_delay = hedge_delay
+        self.concurrency = asyncio.Semaphore(max_concurrency)
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "timeouts": 0, "failures": 0,
+                      "fallbacks": 0, "hedges": 0, "hedge_wins": 0}
+
+    @property
+    def available(self) -> bool:
+        return self.backend.available
+
+    @property
+    def models(self) -> list[str]:
+        """Models whose answers are current: a fallback answer is as good as a primary one."""
+        return [self.primary_model] + ([self.fallback_model] if self.fallback_model else [])
+
+    async def _attempt(self, model_name: str, prompt: str, parse: Callable[[str], Any] | None):
+        """One model, with rate/concurrency limits, timeout and jittered backoff on 429s."""
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(estimate_tokens(prompt))
+            try:
+                async with self.concurrency:
+                    self.stats["calls"] += 1
+                    text = await asyncio.wait_for(
+                        run_io(self.backend.generate, model_name, prompt, self.timeout), self.timeout
+                    )
+                return parse(text) if parse else text
+            except RateLimited:
+                self.stats["rate_limited"] += 1
+                if attempt == self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                delay = self.backoff_base * (2 ** attempt)
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                raise TimeoutError(f"{model_name} did not answer within {self.timeout:g}s")
+
+    async def generate(self, prompt: str, parse: Callable[[str], Any] | None = None) -> tuple[Any, str]:
+        """Returns (parsed result, model name). ``parse`` errors count as a failed attempt."""
+        if self.fallback_model and self.hedge_delay > 0:
+            return await self._generate_hedged(prompt, parse)
+        models = [self.primary_model] + ([self.fallback_model] if self.fallback_model else [])
+        last_error = None
+        for model_name in models:
+            if model_name != self.primary_model:
+                self.stats["fallbacks"] += 1
+                log(f"Retrying with {model_name}...", level="warning")
+            try:
+                return await self._attempt(model_name, prompt, parse), model_name
+            except Exception as ai_error:
+                self.stats["failures"] += 1
+                log(f"AI Analysis failed with {model_name}: {str(ai_error)}", level="error")
+                last_error = ai_error
+        raise last_error
+
+    async def _generate_hedged(self, prompt, parse):
+        tasks = {asyncio.create_task(self._attempt(self.primary_model, prompt, parse)): self.primary_model}
+        done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+        if not done:
+            self.stats["hedges"] += 1
+            log(f"{self.primary_model} slower than {self.hedge_delay}s, hedging with {self.fallback_model}", level="warning")
+            tasks[asyncio.create_task(self._attempt(self.fallback_model, prompt, parse))] = self.fallback_model
+        last_error = None
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    model_name = tasks[task]
+                    if task.exception() is None:
+                        if model_name != self.primary_model:
+                            self.stats["hedge_wins"] += 1
+                        return task.result(), model_name
+                    self.stats["failures"] += 1
+                    last_error = task.exception()
+                    log(f"AI Analysis failed with {model_name}: {str(last_error)}", level="error")
+                    if model_name == self.primary_model and len(tasks) == 1:
+                        # Primary failed before the hedge fired: fall back right away.
+                        self.stats["fallbacks"] += 1
+                        fallback = asyncio.create_task(self._attempt(self.fallback_model, prompt, parse))
+                        tasks[fallback] = self.fallback_model
+                        pending.add(fallback)
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+
+def create_llm_client(api_key: str | None = None) -> LLMClient:
+    if LLM_BACKEND == "fake":
+        return LLMClient(FakeBackend())
+    return LLMClient(GeminiBackend(api_key, (PRIMARY_MODEL, FALLBACK_MODEL)))
@@ -1,42 +1,79 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
-import shutil
-import PyPDF2
 from pathlib import Path
-from supabase import create_client, Client
-import google.generativeai as genai
 import json
-import stripe
 from pydantic import BaseModel
-import tempfile
+import hashlib
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+import asyncio
+import uuid
+import base64
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from executors import cpu_pool_is_process, run_io, run_cpu, shutdown_pools
+from extraction import ExtractionResult, extract_text_parallel, MAX_PAGES, MAX_CHARS
+from text_cache import text_cache
+import auth_cache
+from auth_cache import token_cache, plan_cache, quota_cache, customer_cache, token_key, record_analysis_inserted, record_analysis_failed, invalidate_user
+from singleflight import SingleFlight
+from llm import LLM_BACKEND, create_llm_client, estimate_tokens
+from chunking import REDUCE_PROMPT_TEMPLATE, SECTION_PROMPT_TEMPLATE, analyze_chunked
+import model_output
+from model_output import parse_analysis, parse_changes
+import relevance
+from relevance import RELEVANCE_FILTER, prefilter
+from financials import RANKINGS, normalize_financials, rank
+from risk_alerts import RISK_TYPES, OTHER, SEVERITIES, build_alerts
+from billing import STRIPE_WEBHOOK_SECRET, InvalidSignature, plan_update, verify_event
+from ocr import ocr_available, ocr_extraction
+from versioning import (CHANGE_PROMPT_TEMPLATE, INCREMENTAL_ANALYSIS, INCREMENTAL_MAX_CHANGED, build_change_prompt,
+                        diff_pages, franchise_key, franchisor_cnpj, merge_changes)
+from ingest import IngestedFile, UploadTooLarge, ingest_upload, ingest_zip, MAX_UPLOAD_BYTES
+from jobs import JobContext, JobFailed, JobQueue, create_backend, public_view, FINISHED, JOB_INLINE
+import observability
+from clients import Lazy, lazy_module
+from observability import (log, stage, start_trace, trace_summary, RequestTracing, Callback, REGISTRY,
+                           UPLOAD_BYTES, PAGES_EXTRACTED, PROMPT_CHARS)
 
 load_dotenv()
 
-# Stripe Configuration
-stripe.api_key = os.environ.get("STRIPE_SECRET_KEY")
+# Stripe Configuration (the SDK is imported on the first Stripe call)
+stripe = lazy_module("stripe", lambda module: setattr(module, "api_key", os.environ.get("STRIPE_SECRET_KEY")))
 
-# Initialize Supabase Client
+# Initialize Supabase Client (built on first use, then reused)
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_SERVICE_KEY") or os.environ.get("SUPABASE_ANON_KEY")
 
 if not url or not key:
-    print("Warning: SUPABASE_URL or SUPABASE_KEY not found in environment variables.")
+    log("SUPABASE_URL or SUPABASE_KEY not found in environment variables.", level="warning")
+
+
+def create_supabase_client():
+    from supabase import create_client
+    return create_client(url, key)
+
 
-supabase: Client = create_client(url, key) if url and key else None
+supabase = Lazy(create_supabase_client, lambda: bool(url and key))
 
-# Initialize Gemini
+# Initialize Gemini (models are created once and reused by the LLM client)
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-else:
-    print("Warning: GOOGLE_API_KEY not found in environment variables.")
+if not GOOGLE_API_KEY and LLM_BACKEND == "gemini":
+    log("GOOGLE_API_KEY not found in environment variables.", level="warning")
+llm = create_llm_client(GOOGLE_API_KEY)
 
 # Frontend URL for Redirects
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:5173")
 
-app = FastAPI(title="Expert COF API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    shutdown_pools()
+
+app = FastAPI(title="Expert COF API", version="1.0.0", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -45,18 +82,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+app.add_middleware(RequestTracing)
 
-# Use system temp directory for uploads (works on Vercel)
-UPLOAD_DIR = Path(tempfile.gettempdir())
-# UPLOAD_DIR.mkdir(exist_ok=True) # /tmp always exists
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Expert COF API"}
 
-@app.get("/health")
-async def health_check():
+def check_database() -> str:
     # Verify Supabase connection
     db_status = "disconnected"
     if supabase:
@@ -67,167 +102,46 @@ async def health_check():
             db_status = "connected"
         except Exception as e:
             db_status = f"error: {str(e)}"
-    
+    return db_status
+
+@app.get("/health")
+async def health_check():
+    db_status = await run_io(check_database)
     return {"status": "healthy", "database": db_status}
 
-import hashlib
-from datetime import datetime, timezone, timedelta
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {"text_cache": text_cache.stats(), "auth_cache": auth_cache.stats(), "prompt": relevance.stats(),
+            "model_output": model_output.stats(), "llm": llm.stats,
+            "results": {"prompt_version": PROMPT_VERSION, "models": llm.models}}
 
-# ... (imports)
 
-@app.post("/api/cof/upload")
-async def upload_cof(
-    file: UploadFile = File(...),
-    authorization: str = Header(None)
-):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing Authorization header")
-    
-    token = authorization.replace("Bearer ", "")
-    user_id = None
-    
-    # Validate User
-    if supabase:
-        try:
-            user_response = supabase.auth.get_user(token)
-            if user_response and user_response.user:
-                user_id = user_response.user.id
-        except Exception as auth_err:
-            print(f"Auth validation failed: {auth_err}")
-            raise HTTPException(status_code=401, detail="Invalid token")
+def _cache_counters(field: str) -> dict[tuple, float]:
+    caches = {"text": text_cache.stats(), **auth_cache.stats()}
+    return {(name,): stats[field] for name, stats in caches.items()}
 
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User not found")
 
-    # CHECK USER PLAN AND LIMITS
-    if supabase:
-        try:
-            # 1. Get User Plan
-            user_data = supabase.table("users").select("plan").eq("id", user_id).execute()
-            
-            # Default to free if user record not found or plan not set
-            plan = 'free'
-            if user_data.data and len(user_data.data) > 0:
-                plan = user_data.data[0].get("plan", "free")
-            
-            if plan == 'free':
-                # 2. Check Daily Limit (1 per day)
-                # Calculate start of day (UTC)
-                now_utc = datetime.now(timezone.utc)
-                start_of_day = now_utc.replace(hour=0, minute=0, second=0, microsecond=0)
-                
-                # Query ALL analyses created by this user (Total Lifetime Count)
-                lifetime_count = supabase.table("analyses") \
-                    .select("id", count="exact") \
-                    .eq("user_id", user_id) \
-                    .execute()
-                
-                count = lifetime_count.count if lifetime_count.count is not None else len(lifetime_count.data)
-                
-                if count >= 3:
-                    print(f"User {user_id} reached lifetime limit (Free). Count: {count}")
-                    raise HTTPException(
-                        status_code=403, 
-                        detail="Limite de 3 análises gratuitas atingido. Assine o plano Profissional para continuar."
-                    )
-        except HTTPException as he:
-            raise he
-        except Exception as limit_err:
-            print(f"Error checking limits: {limit_err}")
-            # Fail safe: allow if check fails to avoid blocking users due to bugs
-            pass
+REGISTRY.register(Callback("cof_cache_hits_total", "counter", "Cache hits.", ("cache",),
+                           lambda: _cache_counters("hits")))
+REGISTRY.register(Callback("cof_cache_misses_total", "counter", "Cache misses.", ("cache",),
+                           lambda: _cache_counters("misses")))
+REGISTRY.register(Callback("cof_cache_hit_ratio", "gauge", "Cache hit ratio since start.", ("cache",),
+                           lambda: _cache_counters("hit_ratio")))
+REGISTRY.register(Callback("cof_llm_events_total", "counter",
+                           "LLM client events (calls, retries, rate_limited, timeouts, failures, fallbacks, hedges).",
+                           ("event",), lambda: {(event,): count for event, count in llm.stats.items()}))
+REGISTRY.register(Callback("cof_model_output_total", "counter", "Model responses by parse outcome.", ("outcome",),
+                           lambda: {(k,): model_output.stats()[k] for k in ("clean", "repaired", "invalid")}))
+REGISTRY.register(Callback("cof_prompt_tokens_total", "counter", "Estimated prompt tokens before/after the pre-filter.",
+                           ("phase",), lambda: {("before",): relevance.stats()["tokens_before"],
+                                                ("after",): relevance.stats()["tokens_after"]}))
 
-    if not file.filename.endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
-    file_path = UPLOAD_DIR / file.filename
-    
-    try:
-        # Save uploaded file temporarily
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Calculate SHA-256 Hash
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        file_hash = sha256_hash.hexdigest()
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
-        # Check if this file hash already exists in Supabase
-        if supabase:
-            try:
-                # Check if THIS user already analyzed this file (or if we want global deduplication?)
-                # For now, global deduplication is better for performance, but we must re-insert for this user if they haven't done it.
-                # Let's check if there is ANY analysis with this hash.
-                existing_analysis = supabase.table("analyses").select("*").eq("file_hash", file_hash).execute()
-                
-                if existing_analysis.data and len(existing_analysis.data) > 0:
-                    # Found a cached analysis!
-                    cached_record = existing_analysis.data[0]
-                    print(f"File already analyzed globally. Hash: {file_hash}")
-                    
-                    result = cached_record.get("risk_analysis")
-                    
-                    # Now check if THIS user already has it. If not, link it to them.
-                    user_analysis = supabase.table("analyses").select("id").eq("file_hash", file_hash).eq("user_id", user_id).execute()
-                    
-                    if not user_analysis.data:
-                        # User hasn't analyzed this yet, but we have the data. 
-                        # Insert a new record for this user with the CACHED data (no AI cost).
-                        new_record = {
-                            "user_id": user_id,
-                            "franchise_name": cached_record.get("franchise_name"),
-                            "file_path": str(file_path),
-                            "file_hash": file_hash,
-                            "risk_analysis": result,
-                            "status": "completed",
-                            "extracted_data": cached_record.get("extracted_data")
-                        }
-                        supabase.table("analyses").insert(new_record).execute()
-                        print("Saved cached analysis for new user.")
-                    
-                    if result:
-                        result["from_cache"] = True
-                        result["franchise_name"] = cached_record.get("franchise_name")
-                        return result
-            except Exception as db_err:
-                print(f"Database check failed: {db_err}")
-
-        # Extract text from PDF
-        text = ""
-        try:
-            with open(file_path, 'rb') as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                # Optimize: Only read first 50 pages or until we have enough text
-                MAX_PAGES = 50
-                MAX_CHARS = 60000
-                
-                for i, page in enumerate(pdf_reader.pages):
-                    if i >= MAX_PAGES:
-                        break
-                    extracted = page.extract_text()
-                    if extracted:
-                        text += extracted + "\n"
-                    if len(text) > MAX_CHARS:
-                        break
-            
-            if len(text.strip()) < 100:
-                print("Warning: Text too short, potential scanned PDF.")
-                # We removed OCR for now to improve performance stability.
-                # AI will receive empty text and likely return an error/warning analysis.
-        except Exception as pdf_err:
-            print(f"PDF extraction error: {pdf_err}")
-        
-        # Analyze with Gemini if Key is available
-        if GOOGLE_API_KEY:
-            try:
-                # Trying a lighter/preview model to avoid rate limits
-                # Fallback list: gemini-2.0-flash-lite-preview-02-05 -> gemini-flash-latest
-                model_name = 'gemini-2.0-flash-lite-preview-02-05'
-                model = genai.GenerativeModel(model_name)
-                
-                prompt = f"""
+ANALYSIS_PROMPT_TEMPLATE = """
                 Você é um advogado especialista em franchising brasileiro (Lei 13.966/2019) e analista financeiro sênior. 
                 Sua tarefa é analisar a Circular de Oferta de Franquia (COF) fornecida e extrair informações críticas com alta precisão.
 
@@ -285,120 +199,1066 @@ async def upload_cof(
                     ]
                 }}
 
-                Texto da COF para análise (Primeiros 50k caracteres):
-                {text[:50000]} 
+                Texto da COF para análise (documento completo ou seus trechos relevantes; "[...]" marca partes omitidas):
+                {text} 
                 """
-                # Reduced to 50k chars to avoid Free Tier TPM limits
 
-                response = model.generate_content(prompt)
-                
-                # Extract JSON from response
-                response_text = response.text.replace('```json', '').replace('```', '').strip()
-                analysis_result = json.loads(response_text)
-                
-                # Add metadata
-                analysis_result["filename"] = file.filename
-                analysis_result["uploadDate"] = datetime.now().isoformat()
-                
-                # Save to Supabase (User ID is now guaranteed)
-                if supabase:
-                    try:
-                        new_record = {
-                            "user_id": user_id,
-                            "franchise_name": analysis_result.get("franchise_name", "Desconhecida"),
-                            "file_path": str(file_path),
-                            "file_hash": file_hash,
-                            "risk_analysis": analysis_result,
-                            "status": "completed",
-                            "extracted_data": {"cnpj": analysis_result.get("cnpj")}
-                        }
-                        supabase.table("analyses").insert(new_record).execute()
-                        print("Analysis saved to database.")
-                    except Exception as save_err:
-                        print(f"Failed to save to database: {save_err}")
-                
-                return analysis_result
-
-            except Exception as ai_error:
-                print(f"AI Analysis failed with {model_name}: {str(ai_error)}")
-                # Try fallback model if first one fails
-                try:
-                    print("Retrying with gemini-flash-latest...")
-                    model = genai.GenerativeModel('gemini-flash-latest')
-                    response = model.generate_content(prompt)
-                    response_text = response.text.replace('```json', '').replace('```', '').strip()
-                    analysis_result = json.loads(response_text)
-                    analysis_result["filename"] = file.filename
-                    analysis_result["uploadDate"] = datetime.now().isoformat()
-                    
-                    # Save fallback result to DB too!
-                    if supabase:
-                        try:
-                            new_record = {
-                                "user_id": user_id,
-                                "franchise_name": analysis_result.get("franchise_name", "Desconhecida"),
-                                "file_path": str(file_path),
-                                "file_hash": file_hash,
-                                "risk_analysis": analysis_result,
-                                "status": "completed",
-                                "extracted_data": {"cnpj": analysis_result.get("cnpj")}
-                            }
-                            supabase.table("analyses").insert(new_record).execute()
-                            print("Analysis saved to database (fallback model).")
-                        except Exception as save_err:
-                            print(f"Failed to save to database: {save_err}")
-
-                    return analysis_result
-                except Exception as retry_error:
-                     print(f"Retry failed: {str(retry_error)}")
-                     pass
-
-
-
-        # MOCK ANALYSIS (Fallback)
-        # This simulates what the AI would return
-        mock_analysis = {
-            "filename": file.filename,
-            "uploadDate": "2024-01-06",
-            "score": 0,
-            "summary": "ERRO NA ANÁLISE AUTOMÁTICA (FALLBACK). Não foi possível conectar com a Inteligência Artificial neste momento. Os dados abaixo são apenas um exemplo ilustrativo e NÃO correspondem ao documento enviado. Por favor, verifique a chave de API ou tente novamente mais tarde.",
-            "franchise_name": "ERRO - DADOS SIMULADOS",
-            "cnpj": "00.000.000/0000-00",
-            "risks": [
-                {
-                    "severity": "high",
-                    "title": "Multa Rescisória",
-                    "description": "A multa por rescisão antecipada é de 50% do valor total do contrato restante, o que é considerado abusivo pela jurisprudência recente."
-                },
-                {
-                    "severity": "medium",
-                    "title": "Território Não Exclusivo",
-                    "description": "A franqueadora se reserva o direito de abrir unidades próprias ou licenciar outras franquias na mesma zona de influência primária."
-                },
-                {
-                    "severity": "low",
-                    "title": "Taxa de Renovação",
-                    "description": "A taxa de renovação não está fixada em valor, sendo definida a critério da franqueadora no momento da renovação."
-                }
-            ],
-            "missingClauses": [
-                "Balanços financeiros dos últimos 2 exercícios",
-                "Situação da marca no INPI (apenas protocolo informado)",
-                "Perfil do franqueado ideal detalhado"
-            ],
-            "recommendations": [
-                "Negociar a redução da multa rescisória para um patamar de 20%.",
-                "Solicitar cláusula de preferência para novas unidades no território.",
-                "Exigir a apresentação dos balanços auditados antes da assinatura."
-            ]
+# Reduced to 50k chars to avoid Free Tier TPM limits
+PROMPT_MAX_CHARS = 50000
+
+# "single": one prompt over the first PROMPT_MAX_CHARS chars.
+# "chunked": extract up to CHUNKED_MAX_PAGES / CHUNKED_MAX_CHARS and map-reduce
+# documents longer than the prompt window (see chunking.py).
+ANALYSIS_MODE = os.environ.get("ANALYSIS_MODE", "single")
+CHUNKED_MAX_PAGES = int(os.environ.get("CHUNKED_MAX_PAGES", "400"))
+CHUNKED_MAX_CHARS = int(os.environ.get("CHUNKED_MAX_CHARS", "800000"))
+# Stored results are reused (dedup, cache hits) only under the same prompt version
+# and model. Editing any template, or how much of the document the prompt sees,
+# starts a new version; older results are refreshed with reanalyze.py.
+PROMPT_VERSION = hashlib.sha256(json.dumps([
+    ANALYSIS_MODE, PROMPT_MAX_CHARS, RELEVANCE_FILTER, ANALYSIS_PROMPT_TEMPLATE, SECTION_PROMPT_TEMPLATE,
+    REDUCE_PROMPT_TEMPLATE, CHANGE_PROMPT_TEMPLATE,
+]).encode()).hexdigest()[:12]
+# Most PDFs accepted by one POST /api/cof/batch (ZIP contents included).
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "50"))
+# Page size of GET /api/analyses (default and upper bound).
+ANALYSES_PAGE_SIZE = int(os.environ.get("ANALYSES_PAGE_SIZE", "20"))
+ANALYSES_PAGE_MAX = int(os.environ.get("ANALYSES_PAGE_MAX", "100"))
+# Most analyses one POST /api/compare accepts.
+COMPARE_MAX_IDS = int(os.environ.get("COMPARE_MAX_IDS", "50"))
+# Most risk_alerts rows one GET /api/risks/search reads.
+RISK_SEARCH_MAX = int(os.environ.get("RISK_SEARCH_MAX", "500"))
+
+# MOCK ANALYSIS (Fallback)
+# This simulates what the AI would return
+MOCK_ANALYSIS = {
+    "uploadDate": "2024-01-06",
+    "score": 0,
+    "summary": "ERRO NA ANÁLISE AUTOMÁTICA (FALLBACK). Não foi possível conectar com a Inteligência Artificial neste momento. Os dados abaixo são apenas um exemplo ilustrativo e NÃO correspondem ao documento enviado. Por favor, verifique a chave de API ou tente novamente mais tarde.",
+    "franchise_name": "ERRO - DADOS SIMULADOS",
+    "cnpj": "00.000.000/0000-00",
+    "risks": [
+        {
+            "severity": "high",
+            "title": "Multa Rescisória",
+            "description": "A multa por rescisão antecipada é de 50% do valor total do contrato restante, o que é considerado abusivo pela jurisprudência recente."
+        },
+        {
+            "severity": "medium",
+            "title": "Território Não Exclusivo",
+            "description": "A franqueadora se reserva o direito de abrir unidades próprias ou licenciar outras franquias na mesma zona de influência primária."
+        },
+        {
+            "severity": "low",
+            "title": "Taxa de Renovação",
+            "description": "A taxa de renovação não está fixada em valor, sendo definida a critério da franqueadora no momento da renovação."
         }
+    ],
+    "missingClauses": [
+        "Balanços financeiros dos últimos 2 exercícios",
+        "Situação da marca no INPI (apenas protocolo informado)",
+        "Perfil do franqueado ideal detalhado"
+    ],
+    "recommendations": [
+        "Negociar a redução da multa rescisória para um patamar de 20%.",
+        "Solicitar cláusula de preferência para novas unidades no território.",
+        "Exigir a apresentação dos balanços auditados antes da assinatura."
+    ]
+}
+
+
+# --- Blocking pipeline steps ---
+# Everything below talks to synchronous SDKs (supabase-py, PyPDF2, google-generativeai)
+# and is dispatched to the bounded pools in executors.py by the async handlers.
+
+def resolve_user_id(token: str):
+    user_id = None
+    if supabase:
+        cache_key = token_key(token)
+        user_id = token_cache.get(cache_key)
+        if user_id:
+            return user_id
+        try:
+            user_response = supabase.auth.get_user(token)
+            if user_response and user_response.user:
+                user_id = user_response.user.id
+                token_cache.set(cache_key, user_id)
+        except Exception as auth_err:
+            log(f"Auth validation failed: {auth_err}", level="error")
+            raise HTTPException(status_code=401, detail="Invalid token")
+    return user_id
+
+
+def check_plan_limits(user_id: str, requested: int = 1):
+    if not supabase:
+        return
+    try:
+        # 1. Get User Plan
+        plan = plan_cache.get(user_id)
+        if plan is None:
+            user_data = supabase.table("users").select("plan").eq("id", user_id).execute()
+            
+            # Default to free if user record not found or plan not set
+            plan = 'free'
+            if user_data.data and len(user_data.data) > 0:
+                plan = user_data.data[0].get("plan", "free")
+            plan_cache.set(user_id, plan)
         
-        return mock_analysis
-        
+        if plan == 'free':
+            # 2. Query ALL analyses created by this user (Total Lifetime Count)
+            count = quota_cache.get(user_id)
+            if count is None:
+                # Failed analyses (AI unavailable) do not consume the free quota
+                lifetime_count = supabase.table("analyses") \
+                    .select("id", count="exact") \
+                    .eq("user_id", user_id) \
+                    .neq("status", "failed") \
+                    .execute()
+                
+                count = lifetime_count.count if lifetime_count.count is not None else len(lifetime_count.data)
+                quota_cache.set(user_id, count)
+            
+            if count + requested > 3:
+                log(f"User {user_id} reached lifetime limit (Free). Count: {count}, requested: {requested}", level="warning")
+                raise HTTPException(
+                    status_code=403, 
+                    detail="Limite de 3 análises gratuitas atingido. Assine o plano Profissional para continuar."
+                )
+    except HTTPException as he:
+        raise he
+    except Exception as limit_err:
+        log(f"Error checking limits: {limit_err}", level="error")
+        # Fail safe: allow if check fails to avoid blocking users due to bugs
+        pass
+
+
+def find_cached_analyses(files: dict[str, str], user_id: str) -> dict[str, dict]:
+    """Dedup many uploads at once. ``files`` maps file_hash -> filename; returns file_hash -> result."""
+    if not supabase or not files:
+        return {}
+    try:
+        # Global deduplication: ANY completed analysis of these hashes. A popular COF has one
+        # copy per user, so ids are listed first and only one payload per hash is downloaded.
+        existing_ids = supabase.table("analyses") \
+            .select("id, file_hash") \
+            .in_("file_hash", list(files)) \
+            .eq("status", "completed") \
+            .eq("prompt_version", PROMPT_VERSION) \
+            .in_("model", llm.models) \
+            .execute()
+        chosen = {}
+        for row in existing_ids.data or []:
+            chosen.setdefault(row["file_hash"], row["id"])
+        if not chosen:
+            return {}
+        existing_analysis = supabase.table("analyses") \
+            .select("file_hash, franchise_name, risk_analysis, extracted_data, financial_analysis, franchise_key, cof_version, model") \
+            .in_("id", list(chosen.values())) \
+            .execute()
+        cached_records = {record["file_hash"]: record for record in existing_analysis.data or []}
+        if not cached_records:
+            return {}
+        # The copy gets this user's filename and upload date, not those of the row it came from.
+        uploaded_at = datetime.now().isoformat()
+        for file_hash, record in cached_records.items():
+            if isinstance(record.get("risk_analysis"), dict):
+                record["risk_analysis"] = {**record["risk_analysis"], "filename": files[file_hash],
+                                           "uploadDate": uploaded_at}
+        log(f"{len(cached_records)} file(s) already analyzed globally: {', '.join(cached_records)}")
+
+        # Link them to THIS user with the CACHED data (no AI cost), in one call. The unique
+        # (user_id, file_hash) index makes this a no-op for rows they already have.
+        new_records = [{
+            "user_id": user_id,
+            "franchise_name": record.get("franchise_name"),
+            "file_path": files[file_hash],
+            "file_hash": file_hash,
+            "risk_analysis": record.get("risk_analysis"),
+            "status": "completed",
+            "extracted_data": record.get("extracted_data"),
+            "financial_analysis": record.get("financial_analysis"),
+            "franchise_key": record.get("franchise_key"),
+            "cof_version": record.get("cof_version"),
+            "prompt_version": PROMPT_VERSION,
+            "model": record.get("model")
+        } for file_hash, record in cached_records.items()]
+        inserted = supabase.table("analyses") \
+            .upsert(new_records, on_conflict="user_id,file_hash", ignore_duplicates=True) \
+            .execute()
+        if inserted.data:
+            record_analysis_inserted(user_id, len(inserted.data))
+            log(f"Saved {len(inserted.data)} cached analysis(es) for new user.")
+            write_risk_alerts([alert for row in inserted.data
+                               for alert in build_alerts(row["id"], user_id, row.get("risk_analysis"))])
+
+        results = {}
+        for file_hash, record in cached_records.items():
+            result = record.get("risk_analysis")
+            if result:
+                result["from_cache"] = True
+                result["franchise_name"] = record.get("franchise_name")
+                results[file_hash] = result
+        return results
+    except Exception as db_err:
+        log(f"Database check failed: {db_err}", level="error")
+    return {}
+
+
+def find_cached_analysis(file_hash: str, user_id: str, filename: str):
+    return find_cached_analyses({file_hash: filename}, user_id).get(file_hash)
+
+
+def build_prompt(text: str) -> str:
+    return ANALYSIS_PROMPT_TEMPLATE.format(text=text[:PROMPT_MAX_CHARS])
+
+
+def create_pending_analyses(user_id: str, files: dict[str, str]) -> dict[str, str]:
+    # Insert the rows up front with status "processing" so the ids can be returned
+    # immediately and the free-plan lifetime count already includes them. A row the
+    # user already has for the same document (unique user_id + file_hash) is reused:
+    # a failed or processing one goes back to "processing", a completed one (stale
+    # after a prompt or model change) keeps its result until the new one replaces it.
+    # ``files`` maps file_hash -> filename; returns file_hash -> analysis id.
+    if not files:
+        return {}
+    if not supabase:
+        return {file_hash: str(uuid.uuid4()) for file_hash in files}
+    existing = supabase.table("analyses").select("id, file_hash, status") \
+        .eq("user_id", user_id).in_("file_hash", list(files)).execute().data or []
+    ids = {row["file_hash"]: row["id"] for row in existing}
+    counted = 0
+    retry = [row for row in existing if row.get("status") in ("failed", "processing")]
+    if retry:
+        revived = supabase.table("analyses") \
+            .update({"status": "processing", "updated_at": datetime.now(timezone.utc).isoformat()}) \
+            .in_("id", [row["id"] for row in retry]).in_("status", ["failed", "processing"]).execute()
+        revived_ids = {row["id"] for row in revived.data or []}
+        # Failed rows were not counting against the quota; now they do again.
+        counted += sum(row["status"] == "failed" and row["id"] in revived_ids for row in retry)
+
+    new_records = [{
+        "user_id": user_id,
+        "franchise_name": filename,
+        "file_path": filename,
+        "file_hash": file_hash,
+        "status": "processing",
+    } for file_hash, filename in files.items() if file_hash not in ids]
+    if new_records:
+        inserted = supabase.table("analyses") \
+            .upsert(new_records, on_conflict="user_id,file_hash", ignore_duplicates=True).execute()
+        counted += len(inserted.data or [])
+        ids.update({row["file_hash"]: row["id"] for row in inserted.data or []})
+        raced = [file_hash for file_hash in files if file_hash not in ids]
+        if raced:
+            # A concurrent upload of the same document inserted the row first; share it.
+            rows = supabase.table("analyses").select("id, file_hash") \
+                .eq("user_id", user_id).in_("file_hash", raced).execute().data or []
+            ids.update({row["file_hash"]: row["id"] for row in rows})
+    if counted:
+        record_analysis_inserted(user_id, counted)
+    return ids
+
+
+def create_pending_analysis(user_id: str, file_hash: str, filename: str) -> str:
+    return create_pending_analyses(user_id, {file_hash: filename})[file_hash]
+
+
+def assign_cof_version(key: str | None, file_hash: str | None) -> str | None:
+    """Version number of this file among the analyzed COFs of its franchise (1, 2, ... in order of arrival)."""
+    if not key or not file_hash:
+        return None
+    # Another user's copy of the same file already has one.
+    same = supabase.table("analyses").select("cof_version") \
+        .eq("file_hash", file_hash).eq("franchise_key", key).eq("status", "completed").limit(1).execute()
+    if same.data and same.data[0].get("cof_version"):
+        return same.data[0]["cof_version"]
+    latest = supabase.table("analyses").select("cof_version") \
+        .eq("franchise_key", key).eq("status", "completed").neq("file_hash", file_hash) \
+        .order("created_at", desc=True).limit(1).execute()
+    if not latest.data:
+        return "1"
+    # Rows analyzed before versions were recorded count as version 1.
+    previous = str(latest.data[0].get("cof_version") or "1")
+    return str(int(previous) + 1) if previous.isdigit() else "1"
+
+
+def completed_fields(analysis_result: dict, file_hash: str | None) -> dict:
+    """Columns written with a completed analysis."""
+    key = franchise_key(analysis_result.get("cnpj"), analysis_result.get("franchise_name"))
+    return {
+        "franchise_name": analysis_result.get("franchise_name", "Desconhecida"),
+        "risk_analysis": analysis_result,
+        # Small enough to list without the risk_analysis blob.
+        "extracted_data": {
+            "cnpj": analysis_result.get("cnpj"),
+            "high_risks": sum(1 for r in analysis_result.get("risks") or []
+                              if isinstance(r, dict) and r.get("severity") in ("high", "critical")),
+        },
+        # Parsed once here so comparisons never re-parse the free-text financials.
+        "financial_analysis": normalize_financials(analysis_result),
+        "franchise_key": key,
+        "cof_version": assign_cof_version(key, file_hash),
+        # With file_hash, the cache key of the result: the model that actually answered,
+        # so fallback or hedge results count as stale for the primary model.
+        "prompt_version": PROMPT_VERSION,
+        "model": analysis_result.get("model") or llm.primary_model,
+    }
+
+
+def save_analysis(analysis_id: str, analysis_result: dict, status: str = "completed",
+                  file_hash: str | None = None) -> bool:
+    """Write the outcome of a job; returns whether the row was updated.
+
+    A completed row is never marked failed: a re-upload of a stale analysis that
+    fails keeps the previous result.
+    """
+    if not supabase:
+        return True
+    try:
+        update = {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}
+        query = supabase.table("analyses")
+        if status == "completed":
+            update.update(completed_fields(analysis_result, file_hash))
+            if analysis_result.get("filename"):
+                update["file_path"] = analysis_result["filename"]
+            query = query.update(update).eq("id", analysis_id)
+        else:
+            query = query.update(update).eq("id", analysis_id).neq("status", "completed")
+        response = query.execute()
+        log(f"Analysis {analysis_id} saved to database ({status}).")
+        if status == "completed" and response.data:
+            write_risk_alerts(build_alerts(analysis_id, response.data[0].get("user_id"), analysis_result),
+                              replace=[analysis_id])
+        return bool(response.data)
+    except Exception as save_err:
+        log(f"Failed to save to database: {save_err}", level="error")
+        return False
+
+
+def save_reanalysis(file_hash: str, analysis_result: dict) -> int:
+    """Replace the analysis of every completed copy of a document (all users) with a new result.
+
+    Each copy keeps its own filename and upload date.
+    """
+    copies = supabase.table("analyses").select("id, file_path, uploadDate:risk_analysis->>uploadDate") \
+        .eq("file_hash", file_hash).eq("status", "completed").execute().data or []
+    if not copies:
+        return 0
+    shared = {"status": "completed", "updated_at": datetime.now(timezone.utc).isoformat(),
+              **completed_fields(analysis_result, file_hash)}
+    rows = []
+    for copy in copies:
+        result = {**analysis_result, "filename": copy.get("file_path"), "uploadDate": copy.get("uploadDate")}
+        response = supabase.table("analyses").update({**shared, "risk_analysis": result}) \
+            .eq("id", copy["id"]).eq("status", "completed").execute()
+        rows.extend(response.data or [])
+    write_risk_alerts([alert for row in rows for alert in build_alerts(row["id"], row.get("user_id"), analysis_result)],
+                      replace=[row["id"] for row in rows])
+    return len(rows)
+
+
+def write_risk_alerts(alerts: list[dict], replace: list[str] = ()):
+    """Bulk-insert risk_alerts rows, first dropping the old ones of the ``replace`` analyses."""
+    try:
+        if replace:
+            supabase.table("risk_alerts").delete().in_("analysis_id", list(replace)).execute()
+        if alerts:
+            supabase.table("risk_alerts").insert(alerts).execute()
+    except Exception as alert_err:
+        # The analysis itself is saved; a later backfill can fill the alerts in.
+        log(f"Failed to write risk alerts: {alert_err}", level="error")
+
+
+def is_uuid(value: str) -> bool:
+    # Ids go straight into PostgREST filters, which reject anything but a UUID with a 500.
+    try:
+        uuid.UUID(value)
+        return True
+    except (ValueError, TypeError, AttributeError):
+        return False
+
+
+def fetch_analysis_status(analysis_id: str, user_id: str):
+    if not supabase or not is_uuid(analysis_id):
+        return None
+    response = supabase.table("analyses").select("id, status, risk_analysis") \
+        .eq("id", analysis_id).eq("user_id", user_id).execute()
+    return response.data[0] if response.data else None
+
+
+# History list columns: everything the list renders, nothing from the risk_analysis blob but the score.
+ANALYSIS_SUMMARY_COLUMNS = ("id, franchise_name, status, created_at, cof_version, score:risk_analysis->score, "
+                            "cnpj:extracted_data->>cnpj, high_risks:extracted_data->high_risks")
+
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    # The values end up inside a PostgREST filter: only a real timestamp and UUID may get there.
+    try:
+        created_at, analysis_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        datetime.fromisoformat(created_at)
+        analysis_id = str(uuid.UUID(analysis_id))
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, analysis_id
+
+
+def fetch_analysis_page(user_id: str, limit: int, cursor: str | None, status: str | None) -> dict:
+    """One page of a user's analyses, newest first, keyset-paginated on (created_at, id)."""
+    if not supabase:
+        return {"items": [], "next_cursor": None}
+    query = supabase.table("analyses").select(ANALYSIS_SUMMARY_COLUMNS).eq("user_id", user_id)
+    if status:
+        query = query.eq("status", status)
+    if cursor:
+        created_at, analysis_id = decode_cursor(cursor)
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{analysis_id})')
+    # One extra row tells whether there is a next page.
+    response = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
+    rows = response.data or []
+    items = rows[:limit]
+    return {"items": items, "next_cursor": encode_cursor(items[-1]) if len(rows) > limit else None}
+
+
+def fetch_analysis_detail(analysis_id: str, user_id: str):
+    if not supabase or not is_uuid(analysis_id):
+        return None
+    response = supabase.table("analyses") \
+        .select("id, franchise_name, file_path, status, cof_version, risk_analysis, extracted_data, created_at, updated_at") \
+        .eq("id", analysis_id).eq("user_id", user_id).execute()
+    return response.data[0] if response.data else None
+
+
+def fetch_comparison(user_id: str, ids: list[str], include_analysis: bool) -> list[dict]:
+    if not supabase:
+        return []
+    columns = "id, franchise_name, status, score:risk_analysis->score, financial_analysis"
+    response = supabase.table("analyses").select(columns + (", risk_analysis" if include_analysis else "")) \
+        .in_("id", ids).eq("user_id", user_id).execute()
+    rows = response.data or []
+
+    # Rows saved before financial_analysis was populated: parse them now, from one extra query.
+    stale = [row["id"] for row in rows if not row.get("financial_analysis") and not include_analysis]
+    blobs = {}
+    if stale:
+        older = supabase.table("analyses").select("id, risk_analysis").in_("id", stale).execute()
+        blobs = {row["id"]: row.get("risk_analysis") for row in older.data or []}
+
+    items = []
+    for row in rows:
+        numbers = row.get("financial_analysis") or normalize_financials(
+            row.get("risk_analysis") or blobs.get(row["id"]) or {})
+        item = {"id": row["id"], "franchise_name": row.get("franchise_name"), "status": row.get("status"),
+                "score": row.get("score"), "financials": numbers}
+        if include_analysis:
+            item["analysis"] = row.get("risk_analysis")
+        items.append(item)
+    return items
+
+
+def search_risk_alerts(user_id: str, severities: list[str], types: list[str], limit: int) -> list[dict]:
+    """Analyses with matching risks, from risk_alerts (user/severity/type index) plus one narrow analyses query."""
+    if not supabase:
+        return []
+    query = supabase.table("risk_alerts").select("analysis_id, type, severity, description, metadata, created_at") \
+        .eq("user_id", user_id)
+    if severities:
+        query = query.in_("severity", severities)
+    if types:
+        query = query.in_("type", types)
+    alerts = query.order("created_at", desc=True).limit(limit).execute().data or []
+    if not alerts:
+        return []
+
+    by_analysis: dict[str, list] = {}
+    for alert in alerts:
+        by_analysis.setdefault(alert["analysis_id"], []).append({
+            "type": alert["type"], "severity": alert["severity"],
+            "title": (alert.get("metadata") or {}).get("title"), "description": alert["description"],
+        })
+    analyses = supabase.table("analyses").select("id, franchise_name, created_at, score:risk_analysis->score") \
+        .in_("id", list(by_analysis)).eq("user_id", user_id).execute().data or []
+
+    worst = {s: i for i, s in enumerate(SEVERITIES)}
+    items = [{**row, "alerts": sorted(by_analysis[row["id"]], key=lambda a: worst[a["severity"]])} for row in analyses]
+    items.sort(key=lambda item: (worst[item["alerts"][0]["severity"]], -len(item["alerts"])))
+    return items
+
+
+# Uploads waiting for their job, keyed by analysis id. Small files only live here
+# (in memory); spilled ones also record their path in the job payload.
+staged_uploads: dict[str, IngestedFile] = {}
+
+
+def extraction_budget() -> tuple[int, int]:
+    if ANALYSIS_MODE == "chunked":
+        return CHUNKED_MAX_PAGES, CHUNKED_MAX_CHARS
+    return MAX_PAGES, MAX_CHARS
+
+
+async def load_extraction(file_hash: str, upload: IngestedFile | None) -> ExtractionResult | None:
+    # Extracted text is cached by file hash, so retries and re-analysis never re-run PyPDF2 (or OCR).
+    max_pages, max_chars = extraction_budget()
+    with stage("text_cache"):
+        extraction = await run_io(text_cache.get, file_hash, max_pages, max_chars)
+    if extraction is not None:
+        log(f"Text cache hit for {file_hash}")
+        # Entries cached before OCR was available get it now, if the upload is still here.
+        if not (extraction.likely_scanned and not extraction.ocr_attempted and upload and ocr_available()):
+            return extraction
+    else:
+        if upload is None:
+            return None
+        if upload.in_memory and cpu_pool_is_process():
+            # Every page batch would pickle the whole PDF to a pool worker; send them a path instead.
+            try:
+                await run_io(upload.spill)
+            except OSError as spill_err:
+                log(f"Could not spill upload to disk, extracting from memory: {spill_err}", level="warning")
+        with stage("pdf_extract"):
+            extraction = await extract_text_parallel(upload.source(), max_pages, max_chars, key=file_hash)
+        PAGES_EXTRACTED.observe(extraction.pages_extracted)
+        log(f"Extracted {len(extraction.text)} chars from {extraction.pages_extracted}/{extraction.page_count} pages "
+            f"in {extraction.seconds:.2f}s", pages=extraction.pages_extracted, seconds=round(extraction.seconds, 4))
+    if extraction.likely_scanned and extraction.page_count and not extraction.ocr_attempted and ocr_available():
+        log("Text too short, running OCR on the scanned pages.", level="warning")
+        with stage("ocr"):
+            extraction = await ocr_extraction(upload.source(), extraction, max_pages, max_chars)
+    if extraction.page_count:
+        # Best effort: a full disk or read-only tmp dir (serverless) must not fail an extraction that worked.
+        try:
+            await run_io(text_cache.put, file_hash, extraction, max_pages, max_chars)
+        except Exception as cache_err:
+            log(f"Could not cache extracted text for {file_hash}: {cache_err}", level="warning")
+    return extraction
+
+
+def fetch_completed_result(file_hash: str):
+    if not supabase:
+        return None
+    try:
+        response = supabase.table("analyses").select("risk_analysis") \
+            .eq("file_hash", file_hash).eq("status", "completed") \
+            .eq("prompt_version", PROMPT_VERSION).in_("model", llm.models).limit(1).execute()
+        return response.data[0]["risk_analysis"] if response.data else None
+    except Exception as db_err:
+        log(f"Database check failed: {db_err}", level="error")
+        return None
+
+
+def find_previous_version(key: str, file_hash: str):
+    """Latest completed analysis of another file of the same franchise, under the current prompt and model."""
+    if not supabase:
+        return None
+    response = supabase.table("analyses").select("id, file_hash, cof_version, risk_analysis") \
+        .eq("franchise_key", key).eq("status", "completed").neq("file_hash", file_hash) \
+        .eq("prompt_version", PROMPT_VERSION).in_("model", llm.models) \
+        .order("created_at", desc=True).limit(1).execute()
+    return response.data[0] if response.data else None
+
+
+async def analyze_incremental(report_stage, file_hash: str, extraction: ExtractionResult) -> dict | None:
+    """A new revision of an analyzed COF: only the changed pages go to the model. None means analyze it all."""
+    key = franchise_key(franchisor_cnpj(extraction.text), None)
+    if not key:
+        return None
+    with stage("version_lookup"):
+        previous = await run_io(find_previous_version, key, file_hash)
+    if not previous or not previous.get("risk_analysis"):
+        return None
+    max_pages, max_chars = extraction_budget()
+    previous_extraction = await run_io(text_cache.get, previous["file_hash"], max_pages, max_chars)
+    if previous_extraction is None:
+        log(f"Previous version {previous['id']} has no cached text, analyzing {file_hash} in full")
+        return None
+    with stage("version_diff"):
+        diff = await run_cpu(diff_pages, previous_extraction, extraction)
+    if diff.changed_ratio > INCREMENTAL_MAX_CHANGED:
+        log(f"{diff.changed_ratio:.0%} of {file_hash} changed since analysis {previous['id']}, analyzing in full")
+        return None
+
+    changes = {}
+    if diff.sections:
+        prompt = build_change_prompt(previous["risk_analysis"], previous_extraction, extraction, diff)
+        if len(prompt) > PROMPT_MAX_CHARS:
+            log(f"Changed sections of {file_hash} exceed the prompt window, analyzing in full")
+            return None
+        await report_stage("analyzing")
+        PROMPT_CHARS.observe(len(prompt))
+        with stage("model"):
+            changes, model_name = await llm.generate(prompt, parse=parse_changes)
+    analysis, summary = merge_changes(previous["risk_analysis"], changes)
+    if diff.sections:
+        analysis["model"] = model_name
+    analysis["version_changes"] = {
+        "previous_version": previous.get("cof_version"),
+        "pages_changed": diff.pages_changed,
+        "pages_removed": diff.pages_removed,
+        "pages_total": diff.pages_total,
+        "changed_ratio": round(diff.changed_ratio, 4),
+        **summary,
+    }
+    log(f"Incremental analysis of {file_hash}: {diff.pages_changed}/{diff.pages_total} pages changed since "
+        f"analysis {previous['id']}", pages_changed=diff.pages_changed, changed_ratio=round(diff.changed_ratio, 4))
+    return analysis
+
+
+async def analyze_document(ctx: JobContext, upload: IngestedFile | None) -> dict | None:
+    """Extract + model call for one document. Returns None when the AI is unavailable."""
+    file_hash = ctx.payload["file_hash"]
+
+    # A job queued behind an identical upload may find its analysis already done.
+    with stage("completed_lookup"):
+        completed = await run_io(fetch_completed_result, file_hash)
+    if completed:
+        return completed
+
+    # Extract text from PDF
+    await ctx.stage("extracting")
+    extraction = await load_extraction(file_hash, upload)
+    if extraction is None:
+        raise JobFailed("Upload no longer available, please upload the file again")
+    return await analyze_extraction(file_hash, extraction, ctx.stage)
+
+
+async def analyze_extraction(file_hash: str, extraction: ExtractionResult, report_stage) -> dict | None:
+    """Model side of an analysis (also used by reanalyze.py). Returns None when the AI is unavailable."""
+    text = extraction.text
+    if extraction.likely_scanned:
+        # Nothing readable even after OCR (or OCR is not installed): a model call could only fail.
+        reason = "OCR found no text" if ocr_available() else "OCR is not available on this server"
+        raise JobFailed(f"No text could be extracted from this PDF (scanned document; {reason})")
+
+    # Analyze with Gemini if Key is available
+    if llm.available:
+        if INCREMENTAL_ANALYSIS:
+            try:
+                incremental = await analyze_incremental(report_stage, file_hash, extraction)
+            except Exception as incremental_err:
+                log(f"Incremental analysis failed, analyzing in full: {incremental_err}", level="error")
+                incremental = None
+            if incremental is not None:
+                return incremental
+
+        tokens_in = None
+        if RELEVANCE_FILTER and extraction.pages:
+            # Chunked mode sees the whole document, so it only gets the boilerplate removed.
+            budget = None if ANALYSIS_MODE == "chunked" else PROMPT_MAX_CHARS
+            with stage("prefilter"):
+                filtered = await run_cpu(prefilter, [p.text for p in extraction.pages], budget)
+            if ANALYSIS_MODE == "chunked":
+                tokens_in = filtered.report(estimate_tokens(text), estimate_tokens(filtered.text))
+            else:
+                tokens_in = filtered.report(estimate_tokens(build_prompt(text)), estimate_tokens(build_prompt(filtered.text)))
+            text = filtered.text
+            relevance.record(tokens_in)
+            log(f"Prompt tokens for {file_hash}: {tokens_in['tokens_before']} -> {tokens_in['tokens_after']} "
+                f"({tokens_in['passages_kept']}/{tokens_in['passages_total']} passages, "
+                f"missing sections: {', '.join(tokens_in['missing_sections']) or 'none'})",
+                tokens_before=tokens_in["tokens_before"], tokens_after=tokens_in["tokens_after"])
+
+        await report_stage("analyzing")
+        try:
+            with stage("model"):
+                if ANALYSIS_MODE == "chunked" and len(text) > PROMPT_MAX_CHARS:
+                    PROMPT_CHARS.observe(len(text))
+                    analysis_result, model_name = await analyze_chunked(llm, text)
+                else:
+                    prompt = build_prompt(text)
+                    PROMPT_CHARS.observe(len(prompt))
+                    analysis_result, model_name = await llm.generate(prompt, parse=parse_analysis)
+            analysis_result["model"] = model_name
+            if tokens_in is not None:
+                analysis_result["tokens_in"] = tokens_in
+            return analysis_result
+        except Exception as ai_error:
+            log(f"AI Analysis failed: {str(ai_error)}", level="error")
+    return None
+
+
+# Concurrent jobs for the same file_hash share one extraction + model call.
+analysis_flight = SingleFlight()
+
+
+async def run_analysis_job(ctx: JobContext) -> dict:
+    payload = ctx.payload
+    # Logs from the job carry the id of the upload request that enqueued it.
+    start_trace(payload.get("request_id"))
+    status = "failed"
+    upload = staged_uploads.pop(payload["analysis_id"], None)
+    if upload is None and payload.get("file_path") and Path(payload["file_path"]).exists():
+        upload = IngestedFile(payload["filename"], payload["file_hash"], 0, path=Path(payload["file_path"]))
+    try:
+        if analysis_flight.in_flight(payload["file_hash"]):
+            await ctx.stage("analyzing")
+        shared_result, shared = await analysis_flight.do(
+            payload["file_hash"], lambda: analyze_document(ctx, upload)
+        )
+        if shared_result is None:
+            raise JobFailed("AI analysis unavailable", {"filename": payload["filename"], **MOCK_ANALYSIS})
+        if shared:
+            log(f"Reused in-flight analysis for hash {payload['file_hash']}")
+
+        # Add metadata (each job gets its own copy of the shared result)
+        analysis_result = dict(shared_result)
+        analysis_result["filename"] = payload["filename"]
+        analysis_result["uploadDate"] = datetime.now().isoformat()
+
+        await ctx.stage("saving")
+        with stage("save"):
+            await run_io(save_analysis, payload["analysis_id"], analysis_result, "completed", payload["file_hash"])
+        status = "completed"
+        return analysis_result
+    except Exception:
+        # Whatever failed (model, text cache, database, pool), the row must not stay
+        # "processing" and the upload must not keep counting against the quota.
+        if await run_io(save_analysis, payload["analysis_id"], {}, "failed"):
+            record_analysis_failed(ctx.job["user_id"])
+        raise
+    finally:
+        if upload is not None:
+            upload.cleanup()
+        log("analysis job finished", analysis_id=payload["analysis_id"], status=status, stages=trace_summary())
+
+
+job_queue = JobQueue(create_backend(), run_analysis_job)
+
+
+async def enqueue_analysis(analysis_id: str, user_id: str, upload: IngestedFile):
+    if job_queue.backend.shared:
+        # Any process may claim the job: the upload goes where all of them can read it.
+        await run_io(upload.spill)
+    else:
+        staged_uploads[analysis_id] = upload
+    await job_queue.submit(analysis_id, user_id, {
+        "analysis_id": analysis_id,
+        "file_path": str(upload.path) if upload.path else None,
+        "file_hash": upload.sha256,
+        "filename": upload.filename,
+        "request_id": observability.request_id.get(),
+    })
+
+
+@app.post("/api/cof/upload")
+async def upload_cof(
+    file: UploadFile = File(...),
+    authorization: str = Header(None)
+):
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing Authorization header")
+    
+    token = authorization.replace("Bearer ", "")
+    
+    # Validate User
+    with stage("auth"):
+        user_id = await run_io(resolve_user_id, token)
+
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    # CHECK USER PLAN AND LIMITS
+    with stage("plan_limits"):
+        await run_io(check_plan_limits, user_id)
+
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+
+    # Read, hash and size-check the upload in a single pass
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=str(UploadTooLarge()))
+    try:
+        with stage("ingest"):
+            upload = await run_io(ingest_upload, file.file, file.filename)
+    except UploadTooLarge as too_large:
+        raise HTTPException(status_code=413, detail=str(too_large))
+    UPLOAD_BYTES.observe(upload.size)
+    file_hash = upload.sha256
+    
+    try:
+        # Check if this file hash already exists in Supabase
+        with stage("dedup_lookup"):
+            cached = await run_io(find_cached_analysis, file_hash, user_id, file.filename)
+        if cached:
+            upload.cleanup()
+            cached["status"] = "completed"
+            return cached
+
+        # Hand the heavy work (extraction + Gemini) to the job queue and return at once.
+        with stage("insert"):
+            analysis_id = await run_io(create_pending_analysis, user_id, file_hash, file.filename)
+        with stage("enqueue"):
+            await enqueue_analysis(analysis_id, user_id, upload)
+        if JOB_INLINE:
+            # Same outcome the job endpoint would serve: a failed job may still carry a
+            # result (the mock analysis when the AI is unavailable).
+            job = await job_queue.wait(analysis_id)
+            if job is None or not job["result"]:
+                raise HTTPException(status_code=500, detail=(job or {}).get("error") or "Analysis failed")
+            return {**job["result"], "analysis_id": analysis_id, "status": job["status"]}
+        return JSONResponse(status_code=202, content={"analysis_id": analysis_id, "status": "processing"})
+
+    except HTTPException:
+        raise
     except Exception as e:
+        upload.cleanup()
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+
+def ingest_batch_file(src, filename: str, max_files: int) -> tuple[list[IngestedFile], list[tuple[str, str]]]:
+    if filename.endswith('.zip'):
+        return ingest_zip(src, filename, max_files)
+    if not filename.endswith('.pdf'):
+        return [], [(filename, "Only PDF files are allowed")]
+    try:
+        return [ingest_upload(src, filename)], []
+    except UploadTooLarge as too_large:
+        return [], [(filename, str(too_large))]
+
+
+def batch_line(**fields) -> str:
+    return json.dumps(fields, ensure_ascii=False) + "\n"
+
+
+@app.post("/api/cof/batch")
+async def upload_cof_batch(
+    files: list[UploadFile] = File(...),
+    authorization: str = Header(None)
+):
+    """Analyze many COFs (PDFs and/or ZIPs of PDFs) with one auth, quota check and dedup query.
+
+    Streams one NDJSON line per file as it finishes, then a final {"done": true, ...} line.
+    """
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing Authorization header")
+
+    with stage("auth"):
+        user_id = await run_io(resolve_user_id, authorization.replace("Bearer ", ""))
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    # Read and hash every file in parallel on the I/O pool
+    with stage("ingest"):
+        ingested = await asyncio.gather(*(run_io(ingest_batch_file, f.file, f.filename, BATCH_MAX_FILES) for f in files))
+    uploads: list[IngestedFile] = []
+    rejected: list[tuple[str, str]] = []
+    for batch_files, batch_rejected in ingested:
+        rejected.extend(batch_rejected)
+        for upload in batch_files:
+            if len(uploads) < BATCH_MAX_FILES:
+                UPLOAD_BYTES.observe(upload.size)
+                uploads.append(upload)
+            else:
+                upload.cleanup()
+                rejected.append((upload.filename, f"Batch limit of {BATCH_MAX_FILES} files reached"))
+
+    # Identical files inside the batch are analyzed once
+    unique: dict[str, IngestedFile] = {}
+    for upload in uploads:
+        unique.setdefault(upload.sha256, upload)
+    staged: set[str] = set()
+
+    try:
+        # CHECK USER PLAN AND LIMITS (once, for the whole batch)
+        with stage("plan_limits"):
+            await run_io(check_plan_limits, user_id, len(unique))
+
+        filenames = {file_hash: upload.filename for file_hash, upload in unique.items()}
+        with stage("dedup_lookup"):
+            cached = await run_io(find_cached_analyses, filenames, user_id)
+        with stage("insert"):
+            analysis_ids = await run_io(create_pending_analyses, user_id,
+                                        {h: name for h, name in filenames.items() if h not in cached})
+        for file_hash, analysis_id in analysis_ids.items():
+            staged.add(file_hash)
+            await enqueue_analysis(analysis_id, user_id, unique[file_hash])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing batch: {str(e)}")
+    finally:
+        # Whatever was not handed to a job (cache hits, in-batch duplicates, errors) is done now
+        for upload in uploads:
+            if upload.sha256 not in staged or unique[upload.sha256] is not upload:
+                upload.cleanup()
+
+    async def results():
+        counts = {"completed": 0, "failed": 0, "rejected": 0}
+        for filename, reason in rejected:
+            counts["rejected"] += 1
+            yield batch_line(filename=filename, status="rejected", error=reason)
+
+        pending: dict[str, list[IngestedFile]] = {}
+        for upload in uploads:
+            if upload.sha256 in cached:
+                counts["completed"] += 1
+                yield batch_line(filename=upload.filename, file_hash=upload.sha256, status="completed",
+                                 from_cache=True, result=cached[upload.sha256])
+            elif upload.sha256 in analysis_ids:
+                pending.setdefault(analysis_ids[upload.sha256], []).append(upload)
+
+        # Jobs run on the shared queue workers (model calls under the LLM concurrency limit);
+        # report each file as soon as its job finishes.
+        while pending:
+            for analysis_id in list(pending):
+                job = await job_queue.get(analysis_id)
+                if job is None:
+                    # Job no longer in the queue backend: fall back to the row.
+                    row = await run_io(fetch_analysis_status, analysis_id, user_id)
+                    if row is None:
+                        status, result, error = "failed", None, "Job not found"
+                    elif row["status"] in FINISHED:
+                        status, result, error = row["status"], row.get("risk_analysis"), None
+                    else:
+                        continue
+                elif job["status"] in FINISHED:
+                    status, result, error = job["status"], job["result"], job["error"]
+                else:
+                    continue
+                for upload in pending.pop(analysis_id):
+                    counts[status] += 1
+                    yield batch_line(filename=upload.filename, file_hash=upload.sha256, analysis_id=analysis_id,
+                                     status=status, from_cache=False, result=result, error=error)
+            if pending:
+                await job_queue.wait_for_change()
+
+        yield batch_line(done=True, total=sum(counts.values()), **counts)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+async def authenticate(authorization: str) -> str:
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing Authorization header")
+    with stage("auth"):
+        user_id = await run_io(resolve_user_id, authorization.replace("Bearer ", ""))
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user_id
+
+
+async def get_authorized_job(job_id: str, authorization: str):
+    user_id = await authenticate(authorization)
+
+    job = await job_queue.get(job_id)
+    if job:
+        if job["user_id"] != user_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return public_view(job)
+
+    # Job no longer in the queue backend (e.g. restart with the memory backend): fall back to the row.
+    row = await run_io(fetch_analysis_status, job_id, user_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"id": row["id"], "status": row["status"], "stage": row["status"], "stages": [],
+            "result": row.get("risk_analysis"), "error": None}
+
+
+@app.get("/api/cof/jobs/{job_id}")
+async def get_job(job_id: str, authorization: str = Header(None)):
+    return await get_authorized_job(job_id, authorization)
+
+
+@app.get("/api/cof/jobs/{job_id}/events")
+async def stream_job(job_id: str, authorization: str = Header(None), token: str = None):
+    # EventSource cannot send headers, so the token may also come as a query param.
+    if not authorization and token:
+        authorization = f"Bearer {token}"
+    job = await get_authorized_job(job_id, authorization)
+
+    async def events():
+        current = job
+        last_sent = None
+        while True:
+            snapshot = (current["status"], current["stage"], len(current["stages"]))
+            if snapshot != last_sent:
+                last_sent = snapshot
+                yield f"event: {current['status']}\ndata: {json.dumps(current)}\n\n"
+            if current["status"] in FINISHED:
+                return
+            await job_queue.wait_for_change()
+            latest = await job_queue.get(job_id)
+            if latest is None:
+                return
+            current = public_view(latest)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/api/analyses")
+async def list_analyses(authorization: str = Header(None), limit: int = ANALYSES_PAGE_SIZE,
+                        cursor: str = None, status: str = None):
+    """Lightweight history list. Pass the returned ``next_cursor`` back to get the next page."""
+    user_id = await authenticate(authorization)
+    if status and status not in ("processing", "completed", "failed"):
+        raise HTTPException(status_code=400, detail="Invalid status")
+    limit = max(1, min(limit, ANALYSES_PAGE_MAX))
+    with stage("db_history"):
+        return await run_io(fetch_analysis_page, user_id, limit, cursor, status)
+
+
+@app.get("/api/analyses/{analysis_id}")
+async def get_analysis(analysis_id: str, authorization: str = Header(None)):
+    user_id = await authenticate(authorization)
+    with stage("db_history"):
+        row = await run_io(fetch_analysis_detail, analysis_id, user_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return row
+
+
+class CompareRequest(BaseModel):
+    ids: list[uuid.UUID]
+    sort_by: str = "score"
+    include_analysis: bool = False
+
+
+@app.post("/api/compare")
+async def compare_analyses(request: CompareRequest, authorization: str = Header(None)):
+    """Rank the given analyses by score, investment, payback and risk counts."""
+    user_id = await authenticate(authorization)
+    ids = list(dict.fromkeys(str(analysis_id) for analysis_id in request.ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No analyses to compare")
+    if len(ids) > COMPARE_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {COMPARE_MAX_IDS} analyses per comparison")
+    if request.sort_by not in RANKINGS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of: {', '.join(RANKINGS)}")
+    with stage("db_compare"):
+        items = await run_io(fetch_comparison, user_id, ids, request.include_analysis)
+    rankings = rank(items)
+    position = {analysis_id: i for i, analysis_id in enumerate(rankings[request.sort_by])}
+    items.sort(key=lambda item: position[item["id"]])
+    found = {item["id"] for item in items}
+    return {"items": items, "rankings": rankings, "missing": [i for i in ids if i not in found]}
+
+
+@app.get("/api/risks/search")
+async def search_risks(authorization: str = Header(None), severity: str = None, type: str = None,
+                       limit: int = RISK_SEARCH_MAX):
+    """Analyses with risks of the given severities/types (comma-separated), worst first."""
+    user_id = await authenticate(authorization)
+    severities = [s for s in (severity or "").split(",") if s]
+    types = [t for t in (type or "").split(",") if t]
+    if any(s not in SEVERITIES for s in severities):
+        raise HTTPException(status_code=400, detail=f"severity must be among: {', '.join(SEVERITIES)}")
+    if any(t not in RISK_TYPES and t != OTHER for t in types):
+        raise HTTPException(status_code=400, detail=f"type must be among: {', '.join([*RISK_TYPES, OTHER])}")
+    limit = max(1, min(limit, RISK_SEARCH_MAX))
+    with stage("db_risk_search"):
+        items = await run_io(search_risk_alerts, user_id, severities, types, limit)
+    return {"items": items}
+
 # STRIPE ENDPOINTS
+#
+# users.plan follows Stripe through POST /api/stripe/webhook. The handlers below
+# only create sessions; every Stripe and Supabase call runs on the I/O pool, and
+# the customer id is cached so repeated checkouts skip the lookup and never
+# create a second customer.
 
 class CheckoutRequest(BaseModel):
     user_id: str
@@ -407,64 +1267,73 @@ class CheckoutRequest(BaseModel):
 class PortalRequest(BaseModel):
     user_id: str
 
+customer_flight = SingleFlight()
+
+def get_stripe_customer_id(user_id: str, create: bool = True) -> str | None:
+    customer_id = customer_cache.get(user_id)
+    if customer_id:
+        return customer_id
+    with stage("db_user_lookup"):
+        user_data = supabase.table("users").select("stripe_customer_id, email").eq("id", user_id).single().execute()
+    customer_id = (user_data.data or {}).get("stripe_customer_id")
+    if not customer_id and not create:
+        return None
+    if not customer_id:
+        with stage("stripe_customer_create"):
+            # The idempotency key makes a retried create return the same customer.
+            customer = stripe.Customer.create(email=(user_data.data or {}).get("email"),
+                                              metadata={"user_id": user_id}, idempotency_key=f"customer-{user_id}")
+        customer_id = customer.id
+        with stage("db_user_update"):
+            supabase.table("users").update({"stripe_customer_id": customer_id}).eq("id", user_id).execute()
+    customer_cache.set(user_id, customer_id)
+    return customer_id
+
+async def stripe_customer(user_id: str) -> str:
+    # Concurrent checkouts for one user share a single lookup/create.
+    customer_id, _ = await customer_flight.do(user_id, lambda: run_io(get_stripe_customer_id, user_id))
+    return customer_id
+
 @app.post("/api/create-checkout-session")
 async def create_checkout_session(request: CheckoutRequest):
     try:
-        user_data = supabase.table("users").select("stripe_customer_id, email").eq("id", request.user_id).single().execute()
-        customer_id = None
-        email = None
-        if user_data.data:
-            customer_id = user_data.data.get("stripe_customer_id")
-            email = user_data.data.get("email")
-
-        if not customer_id:
-            # Create Customer
-            customer = stripe.Customer.create(email=email, metadata={"user_id": request.user_id})
-            customer_id = customer.id
-            # Save to Supabase
-            supabase.table("users").update({"stripe_customer_id": customer_id}).eq("id", request.user_id).execute()
-
-        checkout_session = stripe.checkout.Session.create(
-            customer=customer_id,
-            line_items=[
-                {
-                    'price': request.price_id,
-                    'quantity': 1,
-                },
-            ],
-            mode='subscription',
-            success_url=f'{FRONTEND_URL}/dashboard?session_id={{CHECKOUT_SESSION_ID}}',
-            cancel_url=f'{FRONTEND_URL}/profile',
-        )
+        customer_id = await stripe_customer(request.user_id)
+        with stage("stripe_checkout_session"):
+            # user_id travels on the session and the subscription so webhook events map back without a lookup.
+            checkout_session = await run_io(
+                stripe.checkout.Session.create,
+                customer=customer_id,
+                client_reference_id=request.user_id,
+                metadata={"user_id": request.user_id},
+                subscription_data={"metadata": {"user_id": request.user_id}},
+                line_items=[
+                    {
+                        'price': request.price_id,
+                        'quantity': 1,
+                    },
+                ],
+                mode='subscription',
+                success_url=f'{FRONTEND_URL}/dashboard?session_id={{CHECKOUT_SESSION_ID}}',
+                cancel_url=f'{FRONTEND_URL}/profile',
+            )
         return {"url": checkout_session.url}
     except Exception as e:
-        print(f"Stripe Checkout Error: {str(e)}")
+        log(f"Stripe Checkout Error: {str(e)}", level="error")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/create-portal-session")
 async def create_portal_session(request: PortalRequest):
     try:
-        user_data = supabase.table("users").select("stripe_customer_id, email").eq("id", request.user_id).single().execute()
-        customer_id = None
-        email = None
-        if user_data.data:
-            customer_id = user_data.data.get("stripe_customer_id")
-            email = user_data.data.get("email")
-
-        if not customer_id:
-             # Create Customer if missing
-             customer = stripe.Customer.create(email=email, metadata={"user_id": request.user_id})
-             customer_id = customer.id
-             # Save to Supabase
-             supabase.table("users").update({"stripe_customer_id": customer_id}).eq("id", request.user_id).execute()
-
-        portal_session = stripe.billing_portal.Session.create(
-            customer=customer_id,
-            return_url=f'{FRONTEND_URL}/profile',
-        )
+        customer_id = await stripe_customer(request.user_id)
+        with stage("stripe_portal_session"):
+            portal_session = await run_io(
+                stripe.billing_portal.Session.create,
+                customer=customer_id,
+                return_url=f'{FRONTEND_URL}/profile',
+            )
         return {"url": portal_session.url}
     except Exception as e:
-        print(f"Stripe Portal Error: {str(e)}")
+        log(f"Stripe Portal Error: {str(e)}", level="error")
         raise HTTPException(status_code=500, detail=str(e))
 
 class VerifySessionRequest(BaseModel):
@@ -474,50 +1343,124 @@ class VerifySessionRequest(BaseModel):
 class CancelSubscriptionRequest(BaseModel):
     user_id: str
 
+def set_user_plan(user_id: str, plan: str, event_at: int | None = None) -> bool:
+    """Update users.plan; with ``event_at``, only if no newer Stripe event already set it."""
+    update = {"plan": plan}
+    query = supabase.table("users")
+    if event_at is None:
+        query = query.update(update).eq("id", user_id)
+    else:
+        # Stripe does not guarantee delivery order: a late "updated" must not undo a "deleted".
+        update["plan_event_at"] = event_at
+        query = query.update(update).eq("id", user_id).or_(f"plan_event_at.is.null,plan_event_at.lte.{event_at}")
+    updated = bool(query.execute().data)
+    invalidate_user(user_id)
+    return updated
+
 @app.post("/api/verify-checkout-session")
 async def verify_checkout_session(request: VerifySessionRequest):
+    # The success page calls this right after the redirect, which can beat the
+    # webhook; both paths set the same plan, so whichever lands first wins.
     try:
-        session = stripe.checkout.Session.retrieve(request.session_id)
-        
+        with stage("stripe_session_retrieve"):
+            session = await run_io(stripe.checkout.Session.retrieve, request.session_id)
+        reference = getattr(session, "client_reference_id", None)
+        if reference and reference != request.user_id:
+            raise HTTPException(status_code=403, detail="Checkout session belongs to another user")
+
         if session.payment_status == 'paid':
             # Update User Plan to Premium
-            supabase.table("users").update({"plan": "premium"}).eq("id", request.user_id).execute()
+            with stage("db_plan_update"):
+                await run_io(set_user_plan, request.user_id, "premium")
             return {"status": "success", "plan": "premium"}
         else:
             return {"status": "pending", "plan": "free"}
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Verification Error: {str(e)}")
+        log(f"Verification Error: {str(e)}", level="error")
         raise HTTPException(status_code=500, detail=str(e))
 
+def cancel_stripe_subscription(user_id: str):
+    """Best effort: the local downgrade happens even if Stripe fails."""
+    try:
+        customer_id = get_stripe_customer_id(user_id, create=False)
+        if not customer_id:
+            return
+        log(f"Found Stripe Customer ID: {customer_id}")
+        # Find active subscriptions
+        with stage("stripe_subscription_list"):
+            subscriptions = stripe.Subscription.list(customer=customer_id, status='active', limit=1)
+        if subscriptions.data:
+            sub_id = subscriptions.data[0].id
+            with stage("stripe_subscription_cancel"):
+                stripe.Subscription.delete(sub_id)
+            log(f"Stripe subscription {sub_id} cancelled.")
+        else:
+            log("No active Stripe subscription found.")
+    except Exception as stripe_err:
+        log(f"Stripe cancellation failed (ignoring to allow local downgrade): {stripe_err}", level="warning")
+
 @app.post("/api/cancel-subscription")
 async def cancel_subscription(request: CancelSubscriptionRequest):
     try:
-        print(f"Cancelling subscription for user: {request.user_id}")
-        
-        # 1. Try to cancel Stripe Subscription (Best Effort)
-        try:
-            user_data = supabase.table("users").select("stripe_customer_id").eq("id", request.user_id).single().execute()
-            customer_id = user_data.data.get("stripe_customer_id") if user_data.data else None
-
-            if customer_id:
-                print(f"Found Stripe Customer ID: {customer_id}")
-                # Find active subscriptions
-                subscriptions = stripe.Subscription.list(customer=customer_id, status='active', limit=1)
-                if subscriptions.data:
-                    sub_id = subscriptions.data[0].id
-                    stripe.Subscription.delete(sub_id)
-                    print(f"Stripe subscription {sub_id} cancelled.")
-                else:
-                    print("No active Stripe subscription found.")
-        except Exception as stripe_err:
-            print(f"Stripe cancellation failed (ignoring to allow local downgrade): {stripe_err}")
+        log(f"Cancelling subscription for user: {request.user_id}")
+        await run_io(cancel_stripe_subscription, request.user_id)
 
-        # 2. Always downgrade locally in Supabase
-        supabase.table("users").update({"plan": "free"}).eq("id", request.user_id).execute()
-        print("Local plan downgraded to 'free'.")
+        # Always downgrade locally; stamped so an older "active" event arriving later is ignored.
+        with stage("db_plan_update"):
+            await run_io(set_user_plan, request.user_id, "free", int(datetime.now(timezone.utc).timestamp()))
+        log("Local plan downgraded to 'free'.")
         
         return {"status": "success", "message": "Subscription cancelled and plan downgraded."}
     except Exception as e:
-        print(f"Cancellation Error: {str(e)}")
+        log(f"Cancellation Error: {str(e)}", level="error")
         raise HTTPException(status_code=500, detail=str(e))
 
+def apply_stripe_event(event: dict, update: dict) -> dict:
+    """Apply a verified event once: the stripe_events row claims it, and is released if applying fails."""
+    with stage("db_stripe_event_claim"):
+        claimed = supabase.table("stripe_events").upsert({"id": event["id"], "type": event["type"]},
+                                                          on_conflict="id", ignore_duplicates=True).execute()
+    if not claimed.data:
+        return {"duplicate": True}
+    try:
+        user_id = update["user_id"]
+        if not user_id and update["customer_id"]:
+            with stage("db_user_lookup"):
+                rows = supabase.table("users").select("id").eq("stripe_customer_id", update["customer_id"]).limit(1).execute().data
+            user_id = rows[0]["id"] if rows else None
+        if not user_id:
+            log(f"Stripe event {event['id']} ({event['type']}) matches no user", level="warning")
+            return {"handled": False}
+        with stage("db_plan_update"):
+            applied = set_user_plan(user_id, update["plan"], update["created"])
+        if update["customer_id"]:
+            customer_cache.set(user_id, update["customer_id"])
+    except Exception:
+        supabase.table("stripe_events").delete().eq("id", event["id"]).execute()
+        raise
+    log(f"Stripe event {event['id']} ({event['type']}): plan={update['plan']} applied={applied}", user_id=user_id)
+    return {"handled": True, "plan": update["plan"], "applied": applied}
+
+@app.post("/api/stripe/webhook")
+async def stripe_webhook(request: Request, stripe_signature: str = Header(None)):
+    if not STRIPE_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Stripe webhook is not configured")
+    payload = await request.body()
+    try:
+        event = verify_event(payload, stripe_signature, STRIPE_WEBHOOK_SECRET)
+    except InvalidSignature as signature_err:
+        raise HTTPException(status_code=400, detail=str(signature_err))
+
+    update = plan_update(event)
+    if update is None:
+        return {"received": True, "handled": False}
+    try:
+        result = await run_io(apply_stripe_event, event, update)
+    except Exception as e:
+        # 500 makes Stripe retry the delivery later.
+        log(f"Stripe webhook error on {event['id']}: {e}", level="error")
+        raise HTTPException(status_code=500, detail="Could not apply Stripe event")
+    return {"received": True, **result}
+
@@ -0,0 +1,358 @@
+import json
+import re
+import threading
+from typing import Any, Literal
+
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+
+# Model response handling. The backend asks for JSON-mode output; whatever comes
+# back is validated against the analysis schema below, and minor defects (code
+# fences, prose around the object, trailing commas, output cut off mid-array)
+# are repaired locally instead of paying for a second model call. Only output
+# that cannot be repaired raises, which makes the LLM client fall back.
+
+NOT_INFORMED = "Não informado"
+
+
+class InvalidModelOutput(ValueError):
+    """The response could not be parsed or repaired into the expected schema."""
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class Financials(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    initial_investment: str = NOT_INFORMED
+    franchise_fee: str = NOT_INFORMED
+    royalties: str = NOT_INFORMED
+    advertising_fund: str = NOT_INFORMED
+    payback_period: str = NOT_INFORMED
+    profitability: str = NOT_INFORMED
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def _to_text(cls, value):
+        if value is None or value == "":
+            return NOT_INFORMED
+        return value if isinstance(value, str) else str(value)
+
+
+SEVERITY_ALIASES = {"alta": "high", "alto": "high", "media": "medium", "média": "medium", "medio": "medium",
+                    "médio": "medium", "baixa": "low", "baixo": "low", "critica": "critical", "crítica": "critical"}
+
+
+class Risk(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    severity: Literal["critical", "high", "medium", "low"] = "medium"
+    title: str
+    description: str = ""
+
+    @field_validator("severity", mode="before")
+    @classmethod
+    def _severity(cls, value):
+        value = str(value or "medium").strip().lower()
+        value = SEVERITY_ALIASES.get(value, value)
+        return value if value in ("critical", "high", "medium", "low") else "medium"
+
+
+def _coerce_risks(value) -> list:
+    risks = []
+    for item in _as_list(value):
+        if isinstance(item, str):
+            item = {"title": item}
+        if isinstance(item, dict) and item.get("title"):
+            risks.append(item)
+    return risks
+
+
+def _coerce_strings(value) -> list:
+    return [str(item) for item in _as_list(value) if item not in (None, "")]
+
+
+def _coerce_score(value):
+    if value is None or value == "":
+        return None
+    try:
+        return max(0, min(100, round(float(str(value).split("/")[0].strip()))))
+    except ValueError:
+        return None
+
+
+class Analysis(BaseModel):
+    """Full single-prompt analysis, as stored in analyses.risk_analysis.
+
+    Every field the prompt asks for except cnpj is required: a response without
+    one (an empty object, or output cut off before it and repaired by cutting back)
+    would be saved as "no risks" or "no missing clauses" and served to everyone
+    who uploads the same file.
+    """
+
+    model_config = ConfigDict(extra="allow")
+
+    franchise_name: str = "Desconhecida"
+    cnpj: str | None = None
+    score: int
+    summary: str
+    financials: Financials
+    risks: list[Risk]
+    missingClauses: list[str]
+    recommendations: list[str]
+
+    @field_validator("risks", mode="before")
+    @classmethod
+    def _risks(cls, value):
+        return _coerce_risks(value)
+
+    @field_validator("missingClauses", "recommendations", mode="before")
+    @classmethod
+    def _lists(cls, value):
+        return _coerce_strings(value)
+
+    @field_validator("score", mode="before")
+    @classmethod
+    def _score(cls, value):
+        score = _coerce_score(value)
+        return 0 if score is None else score
+
+    @field_validator("franchise_name", mode="before")
+    @classmethod
+    def _name(cls, value):
+        return str(value) if value else "Desconhecida"
+
+    @field_validator("summary", mode="before")
+    @classmethod
+    def _summary(cls, value):
+        return "" if value is None else str(value)
+
+    @field_validator("financials", mode="before")
+    @classmethod
+    def _financials(cls, value):
+        return value if isinstance(value, dict) else {}
+
+
+class SectionAnalysis(BaseModel):
+    """One section of a chunked analysis; anything absent stays null."""
+
+    model_config = ConfigDict(extra="allow")
+
+    franchise_name: str | None = None
+    cnpj: str | None = None
+    score: int | None = None
+    financials: dict[str, Any] = {}
+    risks: list[Risk] = []
+    found_items: list[str] = []
+    recommendations: list[str] = []
+
+    @field_validator("risks", mode="before")
+    @classmethod
+    def _risks(cls, value):
+        return _coerce_risks(value)
+
+    @field_validator("found_items", "recommendations", mode="before")
+    @classmethod
+    def _lists(cls, value):
+        return _coerce_strings(value)
+
+    @field_validator("score", mode="before")
+    @classmethod
+    def _score(cls, value):
+        return _coerce_score(value)
+
+    @field_validator("financials", mode="before")
+    @classmethod
+    def _financials(cls, value):
+        return value if isinstance(value, dict) else {}
+
+
+class FinalSummary(BaseModel):
+    """Reduce step of a chunked analysis."""
+
+    model_config = ConfigDict(extra="allow")
+
+    score: int | None = None
+    summary: str = ""
+    recommendations: list[str] = []
+
+    @field_validator("recommendations", mode="before")
+    @classmethod
+    def _lists(cls, value):
+        return _coerce_strings(value)
+
+    @field_validator("score", mode="before")
+    @classmethod
+    def _score(cls, value):
+        return _coerce_score(value)
+
+
+class ChangeAnalysis(BaseModel):
+    """What changed between two versions of a COF; anything unchanged stays null/empty."""
+
+    model_config = ConfigDict(extra="allow")
+
+    changes: list[str] = []
+    financials: dict[str, Any] = {}
+    risks_added: list[Risk] = []
+    risks_removed: list[str] = []
+    found_items: list[str] = []
+    missing_items: list[str] = []
+    score: int | None = None
+    summary: str | None = None
+
+    @field_validator("risks_added", mode="before")
+    @classmethod
+    def _risks(cls, value):
+        return _coerce_risks(value)
+
+    @field_validator("changes", "risks_removed", "found_items", "missing_items", mode="before")
+    @classmethod
+    def _lists(cls, value):
+        return _coerce_strings(value)
+
+    @field_validator("score", mode="before")
+    @classmethod
+    def _score(cls, value):
+        return _coerce_score(value)
+
+    @field_validator("financials", mode="before")
+    @classmethod
+    def _financials(cls, value):
+        return value if isinstance(value, dict) else {}
+
+
+# --- Local JSON repair ---
+
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _scan(text: str, start: int):
+    """Walk a JSON object from ``start``. Returns (end index or None, comma cut points with their open stacks)."""
+    stack: list[str] = []
+    cuts: list[tuple[int, str]] = []
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return i, cuts
+        elif ch == ",":
+            cuts.append((i, "".join(_CLOSERS[c] for c in reversed(stack))))
+    return None, cuts
+
+
+def extract_json(text: str) -> tuple[Any, bool]:
+    """Parse the model's JSON, repairing it if needed. Returns (value, repaired)."""
+    if not isinstance(text, str):
+        raise InvalidModelOutput("Model response is not text")
+    # Markdown fences are the normal shape outside JSON mode, not a defect.
+    cleaned = _FENCE.sub("", text).strip()
+    try:
+        return json.loads(cleaned), False
+    except json.JSONDecodeError:
+        pass
+
+    start = cleaned.find("{")
+    if start == -1:
+        raise InvalidModelOutput("No JSON object in model response")
+    end, cuts = _scan(cleaned, start)
+
+    if end is not None:
+        # Complete object, possibly wrapped in prose or with trailing commas.
+        candidate = cleaned[start:end + 1]
+        for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                return json.loads(attempt), True
+            except json.JSONDecodeError:
+                continue
+
+    # Truncated (or broken near the end): cut back to the last element that parses and close what is open.
+    for cut, closers in reversed(cuts[-200:]):
+        candidate = _TRAILING_COMMA.sub(r"\1", cleaned[start:cut] + closers)
+        try:
+            return json.loads(candidate), True
+        except json.JSONDecodeError:
+            continue
+    raise InvalidModelOutput("Model response is not valid JSON and could not be repaired")
+
+
+# --- Metrics ---
+
+_lock = threading.Lock()
+_counts = {"responses": 0, "clean": 0, "repaired": 0, "invalid": 0}
+
+
+def _record(outcome: str):
+    with _lock:
+        _counts["responses"] += 1
+        _counts[outcome] += 1
+
+
+def stats() -> dict:
+    """Repair rate, and re-query rate (responses that had to be asked again from the model)."""
+    with _lock:
+        responses = _counts["responses"]
+        return {
+            **_counts,
+            "repair_rate": round(_counts["repaired"] / responses, 4) if responses else 0.0,
+            "requery_rate": round(_counts["invalid"] / responses, 4) if responses else 0.0,
+        }
+
+
+def parse_model_output(text: str, schema: type[BaseModel]) -> dict:
+    """Validate ``text`` against ``schema``; raises InvalidModelOutput if it cannot be salvaged."""
+    try:
+        value, repaired = extract_json(text)
+        if isinstance(value, list):
+            # Some responses wrap the object in a one-element array.
+            value = next((item for item in value if isinstance(item, dict)), None)
+            repaired = True
+        if not isinstance(value, dict):
+            raise InvalidModelOutput("Model response is not a JSON object")
+        model = schema.model_validate(value)
+    except (InvalidModelOutput, ValidationError) as parse_err:
+        _record("invalid")
+        raise InvalidModelOutput(str(parse_err)) from parse_err
+    result = model.model_dump()
+    # Defaults filled in for optional fields the model left out are a repair too
+    # (a missing required field already failed validation above).
+    optional = {name for name, field in schema.model_fields.items() if not field.is_required()}
+    repaired = repaired or bool(optional - set(value))
+    _record("repaired" if repaired else "clean")
+    return result
+
+
+def parse_analysis(text: str) -> dict:
+    return parse_model_output(text, Analysis)
+
+
+def parse_section(text: str) -> dict:
+    return parse_model_output(text, SectionAnalysis)
+
+
+def parse_summary(text: str) -> dict:
+    return parse_model_output(text, FinalSummary)
+
+
+def parse_changes(text: str) -> dict:
+    return parse_model_output(text, ChangeAnalysis)
@@ -0,0 +1,245 @@
+import bisect
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable
+
+# Built-in instrumentation: a request id carried through logs via contextvars,
+# per-stage timers, and a small in-process metrics registry rendered in the
+# Prometheus text format at GET /metrics. No client library or collector is
+# needed; observing a sample is a dict lookup and a bisect under a lock.
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # "json" or "text"
+
+request_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+_trace: contextvars.ContextVar[list | None] = contextvars.ContextVar("trace", default=None)
+
+
+def log(message: str, level: str = "info", **fields):
+    """One log line; JSON (with the current request id) unless LOG_FORMAT=text."""
+    rid = request_id.get()
+    if LOG_FORMAT != "json":
+        print(f"[{rid}] {message}" if rid else message)
+        return
+    record = {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), "level": level, "msg": message}
+    if rid:
+        record["request_id"] = rid
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+# --- Metrics registry ---
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...], labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._values.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                out.append((f"{self.name}_bucket", key, cumulative, f'le="{_number(bound)}"'))
+            out.append((f"{self.name}_sum", key, series[-2]))
+            out.append((f"{self.name}_count", key, series[-1]))
+        return out
+
+
+class Callback:
+    """Metric read at scrape time from existing stats (caches, LLM client)."""
+
+    def __init__(self, name: str, kind: str, help_text: str, labels: tuple[str, ...],
+                 read: Callable[[], dict[tuple, float]]):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labels = labels
+        self.read = read
+
+    def samples(self):
+        try:
+            return [(self.name, key, value) for key, value in self.read().items()]
+        except Exception as read_err:
+            log(f"Metric {self.name} unavailable: {read_err}", level="warning")
+            return []
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample in metric.samples():
+                name, key, value = sample[:3]
+                extra = sample[3] if len(sample) > 3 else ""
+                lines.append(f"{name}{_label_text(metric.labels, key, extra)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "cof_stage_seconds", "Time spent per pipeline stage.", LATENCY_BUCKETS, ("stage",)))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "cof_http_request_seconds", "HTTP request latency until the response starts.", LATENCY_BUCKETS,
+    ("method", "route", "status")))
+UPLOAD_BYTES = REGISTRY.register(Histogram(
+    "cof_upload_bytes", "Size of uploaded PDFs.",
+    tuple(2 ** n * 1024 for n in range(6, 16, 1))))  # 64 KB .. 32 MB
+PAGES_EXTRACTED = REGISTRY.register(Histogram(
+    "cof_pages_extracted", "Pages extracted per document.", (1, 5, 10, 25, 50, 100, 200, 400)))
+PROMPT_CHARS = REGISTRY.register(Histogram(
+    "cof_prompt_chars", "Characters sent to the model per document.",
+    (1000, 5000, 10000, 20000, 30000, 40000, 50000, 60000, 100000, 200000)))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "cof_stage_errors_total", "Stages that raised.", ("stage",)))
+
+
+# --- Stage tracing ---
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline step; usable around awaits (``with stage("auth"): await ...``)."""
+    began = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - began
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((name, elapsed))
+
+
+def start_trace(rid: str | None = None) -> str:
+    """Bind a request id (and an empty stage trace) to the current context, e.g. a job task."""
+    rid = rid or uuid.uuid4().hex
+    request_id.set(rid)
+    _trace.set([])
+    return rid
+
+
+def trace_summary() -> dict[str, float]:
+    summary: dict[str, float] = {}
+    for name, elapsed in _trace.get() or ():
+        summary[name] = round(summary.get(name, 0.0) + elapsed, 4)
+    return summary
+
+
+class RequestTracing:
+    """ASGI middleware: request id in/out (X-Request-ID), latency histogram and one JSON line per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or ())
+        rid = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        rid_token = request_id.set(rid)
+        trace_token = _trace.set([])
+        status = 500
+        began = time.perf_counter()
+        elapsed = None
+
+        async def send_with_id(message):
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - began
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = elapsed if elapsed is not None else time.perf_counter() - began
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_SECONDS.observe(elapsed, method=scope["method"], route=path, status=str(status))
+            if path not in QUIET_ROUTES:
+                log("request", method=scope["method"], route=path, status=status,
+                    seconds=round(elapsed, 4), stages=trace_summary())
+            request_id.reset(rid_token)
+            _trace.reset(trace_token)
+
+
+# Polled constantly; still measured, just not logged.
+QUIET_ROUTES = {"/health", "/metrics"}
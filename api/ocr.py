@@ -0,0 +1,112 @@
+import asyncio
+import os
+import shutil
+import time
+
+from executors import OCR_POOL_SIZE, run_ocr
+from extraction import ExtractionResult, PageText, _assemble
+from observability import log
+from util import env_flag
+
+# OCR for scanned (image-only) COFs. Runs only when PyPDF2 found (almost) no
+# text, and only on the pages that came back empty: each is rasterized with
+# pdfium and read by a local Tesseract, in batches on the dedicated OCR pool
+# (separate from the CPU pool and at lower priority, so text PDFs never queue
+# behind it). Stops at the extraction char budget or at OCR_TIMEOUT, whichever
+# comes first. The merged result is stored in the text cache by file hash like
+# any other extraction.
+#
+# Optional dependencies: pip install pytesseract pypdfium2, plus the tesseract
+# binary with Portuguese data (apt install tesseract-ocr tesseract-ocr-por).
+OCR_ENABLED = env_flag("OCR_ENABLED")
+OCR_LANG = os.environ.get("OCR_LANG", "por")
+OCR_DPI = int(os.environ.get("OCR_DPI", "200"))
+OCR_MAX_PAGES = int(os.environ.get("OCR_MAX_PAGES", "30"))
+OCR_BATCH_PAGES = int(os.environ.get("OCR_BATCH_PAGES", "2"))
+# Per page (enforced by killing tesseract) and per document.
+OCR_PAGE_TIMEOUT = float(os.environ.get("OCR_PAGE_TIMEOUT", "30"))
+OCR_TIMEOUT = float(os.environ.get("OCR_TIMEOUT", "180"))
+# A page with less text than this is treated as an image.
+MIN_PAGE_CHARS = 20
+
+_available: bool | None = None
+
+
+def ocr_available() -> bool:
+    global _available
+    if not OCR_ENABLED:
+        return False
+    if _available is None:
+        try:
+            import pypdfium2  # noqa: F401
+            import pytesseract  # noqa: F401
+            _available = shutil.which(os.environ.get("TESSERACT_CMD", "tesseract")) is not None
+        except ImportError:
+            _available = False
+        if not _available:
+            log("OCR unavailable: needs pytesseract, pypdfium2 and the tesseract binary.", level="warning")
+    return _available
+
+
+def ocr_page_range(source: bytes | str, indexes: list[int], dpi: int = OCR_DPI, lang: str = OCR_LANG,
+                   page_timeout: float = OCR_PAGE_TIMEOUT) -> list[PageText]:
+    """Rasterize and OCR the given pages. Runs on the OCR pool, so it stays a module-level function."""
+    import pypdfium2 as pdfium
+    import pytesseract
+
+    if cmd := os.environ.get("TESSERACT_CMD"):
+        pytesseract.pytesseract.tesseract_cmd = cmd
+    pages = []
+    document = pdfium.PdfDocument(source)
+    try:
+        for index in indexes:
+            began = time.perf_counter()
+            try:
+                image = document[index].render(scale=dpi / 72).to_pil()
+                text = pytesseract.image_to_string(image, lang=lang, timeout=page_timeout)
+            except Exception as ocr_err:
+                log(f"OCR error on page {index + 1}: {ocr_err}", level="error")
+                text = ""
+            pages.append(PageText(index, text.strip(), time.perf_counter() - began))
+    finally:
+        document.close()
+    return pages
+
+
+async def ocr_extraction(source: bytes | str, extraction: ExtractionResult, max_pages: int,
+                         max_chars: int) -> ExtractionResult:
+    """``extraction`` with its empty pages replaced by OCR text (pages PyPDF2 already read are kept)."""
+    began = time.perf_counter()
+    limit = min(extraction.page_count, max_pages, OCR_MAX_PAGES)
+    by_index = {page.index: page for page in extraction.pages}
+    missing = [i for i in range(limit) if i not in by_index or len(by_index[i].text.strip()) < MIN_PAGE_CHARS]
+    batches = [missing[i:i + OCR_BATCH_PAGES] for i in range(0, len(missing), OCR_BATCH_PAGES)]
+    deadline = began + OCR_TIMEOUT
+    chars = sum(len(page.text) + 1 for page in extraction.pages if page.text)
+    recognized = 0
+
+    # Pages in order, OCR_POOL_SIZE batches at a time, so the budget check stops rasterizing early.
+    for start in range(0, len(batches), OCR_POOL_SIZE):
+        remaining = deadline - time.perf_counter()
+        if chars > max_chars or remaining <= 0:
+            break
+        window = batches[start:start + OCR_POOL_SIZE]
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*(run_ocr(ocr_page_range, source, batch) for batch in window)), remaining)
+        except asyncio.TimeoutError:
+            log(f"OCR stopped after {OCR_TIMEOUT:g}s", level="warning")
+            break
+        for page in (page for batch in results for page in batch):
+            by_index[page.index] = page
+            if page.text:
+                chars += len(page.text) + 1
+                recognized += 1
+
+    pages = [by_index.get(i) or PageText(i, "", 0.0) for i in range(max(by_index, default=-1) + 1)]
+    result = _assemble(pages, extraction.page_count, max_chars, extraction.seconds + time.perf_counter() - began)
+    result.ocr_pages = recognized
+    result.ocr_attempted = True
+    log(f"OCR recognized {recognized}/{len(missing)} pages in {time.perf_counter() - began:.2f}s",
+        pages=recognized, seconds=round(time.perf_counter() - began, 4))
+    return result
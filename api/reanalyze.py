@@ -0,0 +1,181 @@
+"""Re-run stored analyses under the current prompt version and model.
+
+    python reanalyze.py --dry-run                    # how many documents are stale
+    python reanalyze.py --concurrency 2 --tpm 200000
+    python reanalyze.py --limit 50                   # canary: the first 50 documents only
+    python reanalyze.py --documents /backup/cofs     # original PDFs, for documents whose text is not cached
+    python reanalyze.py --checkpoint run.jsonl       # resume: documents finished in run.jsonl are skipped
+
+Completed analyses whose prompt_version differs from the API's current one, or
+whose model is neither its primary nor its fallback model, are grouped by
+file_hash, so every user's copy of a document shares one model call. Each
+document is re-analyzed from its cached extracted text (or the matching PDF
+under --documents) through the same pipeline as an upload, with at most
+--concurrency documents in flight and its own tokens-per-minute budget, so a
+rollout neither floods Gemini nor competes with the API for its limits. Each
+copy is then updated with the new result under its own filename and upload date
+(one write per copy, after the single model call). Every outcome is appended to
+the checkpoint as it happens: an interrupted run continues where it stopped,
+and documents without text are not retried unless --retry-skipped is given.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from pathlib import Path
+
+import main
+from executors import run_io, shutdown_pools
+from ingest import IngestedFile
+from jobs import JobFailed
+from llm import LLMClient
+
+
+def find_stale(client, prompt_version: str, models: list[str], batch_size: int = 500) -> dict[str, list[dict]]:
+    """file_hash -> its completed analyses not produced by this prompt version and one of ``models``, in id order."""
+    stale: dict[str, list[dict]] = {}
+    last_id = None
+    current = ",".join(f'"{model}"' for model in models)
+    while True:
+        query = client.table("analyses") \
+            .select("id, file_hash") \
+            .eq("status", "completed") \
+            .or_(f'prompt_version.is.null,prompt_version.neq."{prompt_version}",model.is.null,model.not.in.({current})')
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(batch_size).execute().data or []
+        if not rows:
+            return stale
+        last_id = rows[-1]["id"]
+        for row in rows:
+            if row.get("file_hash"):
+                stale.setdefault(row["file_hash"], []).append(row)
+
+
+def load_checkpoint(path: Path | None) -> dict[str, str]:
+    """file_hash -> last recorded status."""
+    if path is None or not path.exists():
+        return {}
+    statuses = {}
+    for line in path.read_text().splitlines():
+        if line.strip():
+            entry = json.loads(line)
+            statuses[entry["file_hash"]] = entry["status"]
+    return statuses
+
+
+def index_documents(directory: Path | None) -> dict[str, Path]:
+    """sha256 -> path for every PDF under ``directory``."""
+    if directory is None:
+        return {}
+    found = {}
+    for path in directory.rglob("*.pdf"):
+        digest = hashlib.sha256()
+        with open(path, "rb") as handle:
+            for block in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(block)
+        found[digest.hexdigest()] = path
+    return found
+
+
+async def _no_stage(name: str):
+    pass
+
+
+async def reanalyze_document(file_hash: str, document: Path | None) -> dict:
+    # Another copy may already be current (re-uploaded since, or a run stopped before its checkpoint line).
+    result = await run_io(main.fetch_completed_result, file_hash)
+    if not result:
+        upload = IngestedFile(document.name, file_hash, document.stat().st_size, path=document) if document else None
+        extraction = await main.load_extraction(file_hash, upload)
+        if extraction is None:
+            return {"status": "skipped", "reason": "no cached text or original PDF"}
+        try:
+            result = await main.analyze_extraction(file_hash, extraction, _no_stage)
+        except JobFailed as failed:
+            return {"status": "skipped", "reason": str(failed)}
+        if result is None:
+            return {"status": "failed", "reason": "AI analysis unavailable"}
+    updated = await run_io(main.save_reanalysis, file_hash, result)
+    return {"status": "done", "rows": updated}
+
+
+async def reanalyze(concurrency: int = 2, checkpoint: Path | None = None, documents: Path | None = None,
+                    limit: int | None = None, retry_skipped: bool = False, dry_run: bool = False,
+                    batch_size: int = 500) -> dict:
+    prompt_version, models = main.PROMPT_VERSION, main.llm.models
+    stale = await run_io(find_stale, main.supabase, prompt_version, models, batch_size)
+    finished = load_checkpoint(checkpoint)
+    skip = {"done", "skipped"} if not retry_skipped else {"done"}
+    pending = [file_hash for file_hash in stale if finished.get(file_hash) not in skip]
+    if limit is not None:
+        pending = pending[:limit]
+    totals = {"stale_documents": len(stale), "stale_rows": sum(len(rows) for rows in stale.values()),
+              "pending": len(pending), "done": 0, "rows": 0, "skipped": 0, "failed": 0}
+    print(f"prompt_version={prompt_version} models={','.join(models)}: {totals['stale_documents']} stale documents "
+          f"({totals['stale_rows']} analyses), {len(pending)} to process")
+    if dry_run or not pending:
+        return totals
+
+    paths = await run_io(index_documents, documents)
+    semaphore = asyncio.Semaphore(concurrency)
+    log_file = open(checkpoint, "a") if checkpoint else None
+    began = time.perf_counter()
+
+    async def process(file_hash: str):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                outcome = await reanalyze_document(file_hash, paths.get(file_hash))
+            except Exception as reanalysis_err:
+                outcome = {"status": "failed", "reason": str(reanalysis_err)}
+            outcome["seconds"] = round(time.perf_counter() - started, 3)
+        totals[outcome["status"]] += 1
+        totals["rows"] += outcome.get("rows", 0)
+        if log_file:
+            log_file.write(json.dumps({"file_hash": file_hash, "prompt_version": prompt_version, **outcome}) + "\n")
+            log_file.flush()
+        processed = totals["done"] + totals["skipped"] + totals["failed"]
+        print(f"[{processed}/{len(pending)}] {file_hash[:12]} {outcome['status']} "
+              f"{outcome.get('reason') or str(outcome.get('rows', 0)) + ' analyses'} ({outcome['seconds']}s)")
+
+    try:
+        await asyncio.gather(*(process(file_hash) for file_hash in pending))
+    finally:
+        if log_file:
+            log_file.close()
+    totals["seconds"] = round(time.perf_counter() - began, 3)
+    return totals
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=2, help="documents analyzed at once")
+    parser.add_argument("--tpm", type=int, default=200000, help="tokens per minute for this run")
+    parser.add_argument("--checkpoint", type=Path, default=Path("reanalyze.checkpoint.jsonl"))
+    parser.add_argument("--documents", type=Path, help="directory of original PDFs (matched by SHA-256)")
+    parser.add_argument("--limit", type=int, help="process at most this many documents")
+    parser.add_argument("--retry-skipped", action="store_true", help="retry documents skipped for lack of text")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if not main.supabase:
+        raise SystemExit("SUPABASE_URL and SUPABASE_SERVICE_KEY are required")
+    if not main.llm.available:
+        raise SystemExit("No model backend configured (GOOGLE_API_KEY or LLM_BACKEND=fake)")
+    # Own limits: the API's concurrency and token budget are left to live traffic.
+    main.llm = LLMClient(main.llm.backend, tpm_limit=args.tpm, max_concurrency=args.concurrency)
+    try:
+        totals = asyncio.run(reanalyze(args.concurrency, args.checkpoint, args.documents, args.limit,
+                                       args.retry_skipped, args.dry_run, args.batch_size))
+    finally:
+        shutdown_pools()
+    print(json.dumps(totals))
+    if totals["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,269 @@
+import os
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from util import env_flag, normalize_text
+
+# Local, deterministic pre-filter between PDF extraction and prompt building.
+# Repeated page headers/footers, page numbers and table-of-contents lines are
+# dropped; the rest is cut into passages that are tagged with the COF section
+# they belong to (via heading and keyword indexes) and packed into the prompt
+# budget: the best passage of every section first, then the rest by score,
+# emitted in document order.
+RELEVANCE_FILTER = env_flag("RELEVANCE_FILTER")
+PASSAGE_CHARS = int(os.environ.get("RELEVANCE_PASSAGE_CHARS", "1200"))
+# Passages after a section heading that are kept with it even without keywords.
+HEADING_REACH = int(os.environ.get("RELEVANCE_HEADING_REACH", "2"))
+
+# Section -> keywords (normalized: lowercase, no accents). The first five are the
+# items Lei 13.966/2019 requires; "clausulas" covers the contract terms behind most risks.
+SECTION_KEYWORDS = {
+    "balancos": ("balanco", "balancos", "demonstracoes financeiras", "demonstracao do resultado",
+                 "demonstracao financeira", "patrimonio liquido", "ativo circulante", "passivo circulante", "dre"),
+    "pendencias_judiciais": ("pendencias judiciais", "pendencia judicial", "acoes judiciais", "acao judicial",
+                             "processos judiciais", "processo judicial", "litigio", "recuperacao judicial", "falencia"),
+    "relacao_franqueados": ("relacao de franqueados", "relacao dos franqueados", "lista de franqueados",
+                            "franqueados ativos", "desligaram", "ex-franqueados", "unidades em operacao"),
+    "marca_inpi": ("inpi", "registro da marca", "pedido de registro", "propriedade industrial",
+                   "titularidade da marca", "marca registrada"),
+    "taxas": ("taxa de franquia", "taxa inicial", "royalties", "royalty", "fundo de propaganda",
+              "fundo de promocao", "fundo de marketing", "taxa de publicidade", "investimento inicial",
+              "investimento total", "capital de giro", "payback", "retorno do investimento", "faturamento",
+              "rentabilidade", "lucratividade"),
+    "clausulas": ("rescisao", "multa", "prazo contratual", "prazo de vigencia", "renovacao", "territorio",
+                  "exclusividade", "nao concorrencia", "concorrencia", "sucessao", "cessao", "transferencia",
+                  "penalidade", "obrigacoes do franqueado"),
+}
+SECTION_WEIGHTS = {"balancos": 3.0, "pendencias_judiciais": 3.0, "relacao_franqueados": 3.0,
+                   "marca_inpi": 3.0, "taxas": 3.0, "clausulas": 1.5}
+
+_KEYWORD_PATTERNS = {
+    section: re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")\b")
+    for section, keywords in SECTION_KEYWORDS.items()
+}
+_CNPJ = re.compile(r"\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2}")
+_MONEY = re.compile(r"r\$\s*\d|\d+(?:,\d+)?\s*%")
+_TOC_LINE = re.compile(r"(?:\.{3,}|…{2,}|_{3,})\s*\d{1,3}\s*$")
+_PAGE_NUMBER = re.compile(r"^(?:pagina|pag\.?|p\.)?\s*\d{1,3}(?:\s*(?:de|/)\s*\d{1,3})?$")
+_NUMBERED_HEADING = re.compile(
+    r"^(?:\d{1,2}(?:\.\d{1,2})+\.?|\d{1,2}\s*[.)\-–]|[ivxlc]{1,6}\s*[.)\-–]|(?:capitulo|clausula|secao|item)\s+\S+)\s+\S"
+)
+GAP_MARKER = "[...]"
+
+
+@dataclass
+class Passage:
+    index: int
+    text: str
+    section: str | None
+    score: float
+
+
+@dataclass
+class FilterResult:
+    text: str
+    chars_before: int
+    chars_after: int
+    passages_total: int
+    passages_kept: int
+    lines_dropped: int
+    sections: dict[str, int] = field(default_factory=dict)  # section -> passages kept
+    seconds: float = 0.0
+
+    @property
+    def missing_sections(self) -> list[str]:
+        return [s for s in SECTION_KEYWORDS if s != "clausulas" and not self.sections.get(s)]
+
+    def report(self, tokens_before: int, tokens_after: int) -> dict:
+        """Tokens-in before/after for one prompt, for logs and the stored analysis."""
+        return {
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "reduction": round(1 - tokens_after / tokens_before, 4) if tokens_before else 0.0,
+            "passages_kept": self.passages_kept,
+            "passages_total": self.passages_total,
+            "lines_dropped": self.lines_dropped,
+            "sections": self.sections,
+            "missing_sections": self.missing_sections,
+            "seconds": round(self.seconds, 4),
+        }
+
+
+def _line_signature(line: str) -> str:
+    # Page numbers and dates change from page to page; the rest of a running header does not.
+    return re.sub(r"\d+", "#", normalize_text(line))
+
+
+def _repeated_lines(pages: list[list[str]]) -> set[str]:
+    if len(pages) < 3:
+        return set()
+    seen = Counter()
+    for lines in pages:
+        # Only the top and bottom of a page can hold running headers/footers.
+        seen.update({_line_signature(l) for l in lines[:3] + lines[-3:] if len(l) <= 120})
+    threshold = max(3, len(pages) // 2)
+    return {signature for signature, count in seen.items() if count >= threshold}
+
+
+def _heading_section(line: str) -> str | None:
+    """Section of a heading line, or None if the line is not a heading."""
+    if len(line) > 100:
+        return None
+    normalized = normalize_text(line)
+    letters = [c for c in line if c.isalpha()]
+    is_heading = _NUMBERED_HEADING.match(normalized) is not None or (
+        letters and sum(c.isupper() for c in letters) / len(letters) > 0.8 and len(letters) >= 4
+    )
+    if not is_heading:
+        return None
+    for section, pattern in _KEYWORD_PATTERNS.items():
+        if pattern.search(normalized):
+            return section
+    return ""  # a heading of some other section: ends the current one
+
+
+def _score(text: str, section: str | None, near_heading: bool) -> tuple[float, str | None]:
+    normalized = normalize_text(text)
+    hits = {s: len(p.findall(normalized)) for s, p in _KEYWORD_PATTERNS.items()}
+    best = max(hits, key=lambda s: hits[s] * SECTION_WEIGHTS[s])
+    score = sum(count * SECTION_WEIGHTS[s] for s, count in hits.items())
+    score += 2.0 * len(_MONEY.findall(normalized))
+    if _CNPJ.search(text):
+        score += 5.0
+    # The section a heading opens only carries over to passages right after it, or to
+    # later ones that still say something of their own; long tails of prose do not.
+    if section and (near_heading or score > 0):
+        score += 2.0 * SECTION_WEIGHTS[section]
+    elif hits[best]:
+        section = best
+    else:
+        section = None
+    # Keyword density, so one long passage does not outrank several focused ones.
+    return score / (1 + len(text) / PASSAGE_CHARS), section
+
+
+def split_passages(pages: list[str]) -> tuple[list[Passage], int, int]:
+    """Clean pages and cut them into scored passages. Returns (passages, chars before, lines dropped)."""
+    page_lines = [[l.strip() for l in page.splitlines() if l.strip()] for page in pages]
+    repeated = _repeated_lines(page_lines)
+    chars_before = sum(len(p) + 1 for p in pages if p)
+
+    passages: list[Passage] = []
+    current: list[str] = []
+    current_len = 0
+    section: str | None = None
+    dropped = 0
+
+    since_heading = 0
+
+    def flush():
+        nonlocal current, current_len, since_heading
+        if current:
+            text = "\n".join(current)
+            score, tagged = _score(text, section, since_heading < HEADING_REACH)
+            passages.append(Passage(len(passages), text, tagged, score))
+            since_heading += 1
+        current, current_len = [], 0
+
+    for lines in page_lines:
+        for position, line in enumerate(lines):
+            normalized = normalize_text(line)
+            at_edge = position < 3 or position >= len(lines) - 3
+            if ((at_edge and _line_signature(line) in repeated) or _TOC_LINE.search(normalized)
+                    or _PAGE_NUMBER.match(normalized)):
+                dropped += 1
+                continue
+            heading = _heading_section(line)
+            if heading is not None:
+                flush()
+                section = heading or None
+                since_heading = 0
+            elif current_len + len(line) > PASSAGE_CHARS:
+                flush()
+            current.append(line)
+            current_len += len(line) + 1
+    flush()
+    return passages, chars_before, dropped
+
+
+def prefilter(pages: list[str], max_chars: int | None) -> FilterResult:
+    """Drop boilerplate and, if ``max_chars`` is set, pack the most relevant passages into it.
+
+    Pure function of its input, so it can run on the CPU pool.
+    """
+    began = time.perf_counter()
+    passages, chars_before, dropped = split_passages(pages)
+    if not passages:
+        # Everything looked like boilerplate; better to send the pages as they are than nothing.
+        passages = [Passage(i, page.strip(), None, 1.0) for i, page in enumerate(p for p in pages if p.strip())]
+        dropped = 0
+    total = sum(len(p.text) + 1 for p in passages)
+
+    if max_chars is None or total <= max_chars:
+        kept = passages
+    else:
+        chosen: set[int] = set()
+        used = 0
+
+        def take(passage: Passage) -> bool:
+            nonlocal used
+            cost = len(passage.text) + len(GAP_MARKER) + 2
+            if passage.index in chosen or used + cost > max_chars:
+                return False
+            chosen.add(passage.index)
+            used += cost
+            return True
+
+        # The opening passage identifies the franchisor (name, CNPJ).
+        if passages:
+            take(passages[0])
+        ranked = sorted(passages, key=lambda p: (-p.score, p.index))
+        # One passage per required section before anything else, so no section is crowded out.
+        for section in SECTION_KEYWORDS:
+            for passage in ranked:
+                if passage.section == section and take(passage):
+                    break
+        for passage in ranked:
+            if passage.score > 0:
+                take(passage)
+        kept = [p for p in passages if p.index in chosen]
+
+    parts = []
+    previous = -1
+    for passage in kept:
+        if previous != -1 and passage.index != previous + 1:
+            parts.append(GAP_MARKER)
+        parts.append(passage.text)
+        previous = passage.index
+    text = "\n".join(parts)
+    if max_chars is not None:
+        text = text[:max_chars]
+
+    sections = Counter(p.section for p in kept if p.section)
+    return FilterResult(
+        text=text,
+        chars_before=chars_before,
+        chars_after=len(text),
+        passages_total=len(passages),
+        passages_kept=len(kept),
+        lines_dropped=dropped,
+        sections=dict(sections),
+        seconds=time.perf_counter() - began,
+    )
+
+
+# Running totals for this process, exposed next to the cache stats.
+_totals = {"documents": 0, "tokens_before": 0, "tokens_after": 0}
+
+
+def record(report: dict):
+    _totals["documents"] += 1
+    _totals["tokens_before"] += report["tokens_before"]
+    _totals["tokens_after"] += report["tokens_after"]
+
+
+def stats() -> dict:
+    before, after = _totals["tokens_before"], _totals["tokens_after"]
+    return {**_totals, "reduction": round(1 - after / before, 4) if before else 0.0}
@@ -0,0 +1,61 @@
+import re
+
+from util import normalize_text
+
+# One risk_alerts row per risk of a completed analysis, written next to the
+# analysis itself so risk searches ("high-severity termination penalties") run
+# on the indexed table instead of scanning every risk_analysis blob. The type is
+# a fixed category derived from the risk's title/description by keywords.
+RISK_TYPES = {
+    "termination_penalty": ("rescisao", "rescisoria", "multa", "penalidade", "distrato", "resilicao"),
+    "non_compete": ("nao concorrencia", "concorrencia", "quarentena"),
+    "territory": ("territorio", "exclusividade", "raio de atuacao", "canibalizacao"),
+    "fees": ("taxa", "royalt", "fundo de propaganda", "fundo de marketing", "fundo de promocao", "reajuste"),
+    "investment": ("investimento", "capital de giro", "payback", "retorno", "rentabilidade", "faturamento"),
+    "term_renewal": ("prazo", "renovacao", "vigencia"),
+    "transfer": ("cessao", "transferencia", "sucessao", "venda da unidade"),
+    "supply": ("fornecedor", "fornecimento", "compra obrigatoria", "produtos homologados"),
+    "litigation": ("judicial", "judiciais", "processo", "litigio", "acao", "acoes", "recuperacao judicial"),
+    "financial_statements": ("balanco", "demonstracoes financeiras", "demonstracao financeira"),
+    "trademark": ("marca", "inpi", "propriedade industrial"),
+    "franchisee_list": ("relacao de franqueados", "lista de franqueados", "ex-franqueados"),
+    "disclosure": ("cof", "circular", "informacao", "omissao", "ausencia"),
+}
+OTHER = "other"
+SEVERITIES = ("critical", "high", "medium", "low")
+
+_PATTERNS = {
+    risk_type: re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")")
+    for risk_type, keywords in RISK_TYPES.items()
+}
+
+
+def classify(title: str, description: str = "") -> str:
+    """Risk type by keywords; the title decides, the description only breaks a miss."""
+    for text in (title, description):
+        normalized = normalize_text(text or "")
+        for risk_type, pattern in _PATTERNS.items():
+            if pattern.search(normalized):
+                return risk_type
+    return OTHER
+
+
+def build_alerts(analysis_id: str, user_id: str | None, analysis: dict) -> list[dict]:
+    """risk_alerts rows for one analysis (empty if it has no usable risks)."""
+    rows = []
+    for risk in (analysis or {}).get("risks") or []:
+        if not isinstance(risk, dict) or not risk.get("title"):
+            continue
+        title = str(risk["title"])
+        description = str(risk.get("description") or title)
+        severity = risk.get("severity") if risk.get("severity") in SEVERITIES else "medium"
+        rows.append({
+            "analysis_id": analysis_id,
+            "user_id": user_id,
+            "type": classify(title, description),
+            "severity": severity,
+            "description": description,
+            "recommendation": risk.get("recommendation"),
+            "metadata": {"title": title},
+        })
+    return rows
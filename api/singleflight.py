@@ -0,0 +1,44 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one in-flight execution.
+
+    Used per file_hash so N users uploading the same COF at once wait on a
+    single extraction + model call instead of paying for N of them.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """Run ``fn`` (or join the running call). Returns (result, shared)."""
+        future = self._calls.get(key)
+        if future is not None:
+            self.followers += 1
+            # shield: a cancelled follower must not cancel the leader's work
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        # Avoid "exception was never retrieved" warnings when nobody joined.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        self.leaders += 1
+        try:
+            result = await fn()
+        except BaseException as call_err:
+            future.set_exception(call_err)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
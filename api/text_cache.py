@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+from extraction import ExtractionResult
+from observability import log
+from util import env_flag
+
+# Content-addressed cache of extracted PDF text, keyed by the upload's SHA-256.
+# Retries, reprocessing after prompt changes and re-analysis with another model
+# read the text from here instead of re-running PyPDF2. Entries live on local
+# disk (optionally zlib-compressed) and are evicted LRU once TEXT_CACHE_MAX_BYTES
+# is exceeded.
+TEXT_CACHE_DIR = Path(os.environ.get("TEXT_CACHE_DIR", Path(tempfile.gettempdir()) / "expert-cof-text-cache"))
+TEXT_CACHE_MAX_BYTES = int(os.environ.get("TEXT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+TEXT_CACHE_COMPRESS = env_flag("TEXT_CACHE_COMPRESS")
+
+
+class TextCache:
+    def __init__(self, directory: Path = TEXT_CACHE_DIR, max_bytes: int = TEXT_CACHE_MAX_BYTES,
+                 compress: bool = TEXT_CACHE_COMPRESS):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._index: OrderedDict[str, int] | None = None  # file_hash -> size on disk, LRU order
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.seconds_saved = 0.0
+
+    def _path(self, file_hash: str, compressed: bool | None = None) -> Path:
+        compressed = self.compress if compressed is None else compressed
+        return self.directory / file_hash[:2] / f"{file_hash}.json{'.z' if compressed else ''}"
+
+    def _load_index(self):
+        # Rebuilt lazily from disk so the cache survives restarts; oldest mtime first.
+        if self._index is not None:
+            return
+        entries = []
+        if self.directory.exists():
+            for path in self.directory.glob("*/*.json*"):
+                if path.name.endswith(".tmp"):
+                    continue
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.name.split(".")[0], stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((file_hash, size) for _, file_hash, size in entries)
+        self._total_bytes = sum(self._index.values())
+
+    def _find(self, file_hash: str) -> Path | None:
+        for compressed in (self.compress, not self.compress):
+            path = self._path(file_hash, compressed)
+            if path.exists():
+                return path
+        return None
+
+    def get(self, file_hash: str, max_pages: int, max_chars: int) -> ExtractionResult | None:
+        with self._lock:
+            self._load_index()
+            path = self._find(file_hash) if file_hash in self._index else None
+            entry = None
+            if path is not None:
+                try:
+                    raw = path.read_bytes()
+                    entry = json.loads(zlib.decompress(raw) if path.suffix == ".z" else raw)
+                    os.utime(path)
+                    self._index.move_to_end(file_hash)
+                except (OSError, ValueError, zlib.error) as cache_err:
+                    log(f"Text cache entry for {file_hash} unreadable: {cache_err}", level="warning")
+                    entry = None
+            # An entry extracted under a smaller budget is only usable if it was not truncated.
+            if entry is None or (entry["extraction"]["truncated"] and (entry["max_pages"] < max_pages or entry["max_chars"] < max_chars)):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.seconds_saved += entry["extraction"]["seconds"]
+        return ExtractionResult.from_dict(entry["extraction"])
+
+    def put(self, file_hash: str, extraction: ExtractionResult, max_pages: int, max_chars: int):
+        entry = {
+            "file_hash": file_hash,
+            "max_pages": max_pages,
+            "max_chars": max_chars,
+            "created_at": time.time(),
+            "extraction": extraction.to_dict(),
+        }
+        raw = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        if self.compress:
+            raw = zlib.compress(raw, 6)
+        path = self._path(file_hash)
+        with self._lock:
+            self._load_index()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                tmp.write_bytes(raw)
+                os.replace(tmp, path)
+            except BaseException:
+                # A partial write (disk full) must not linger next to the entries.
+                tmp.unlink(missing_ok=True)
+                raise
+            self._total_bytes += len(raw) - self._index.pop(file_hash, 0)
+            self._index[file_hash] = len(raw)
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            file_hash, size = self._index.popitem(last=False)
+            path = self._find(file_hash)
+            if path is not None:
+                path.unlink(missing_ok=True)
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._index or ()),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "extraction_seconds_saved": round(self.seconds_saved, 3),
+            }
+
+
+text_cache = TextCache()
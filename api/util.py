@@ -0,0 +1,15 @@
+import os
+import unicodedata
+
+# Small helpers shared by the api modules.
+
+
+def env_flag(name: str, default: str = "1") -> bool:
+    """Boolean setting: anything but "0"/"false" (or unset with a truthy default) is on."""
+    return os.environ.get(name, default) not in ("0", "false", "False")
+
+
+def normalize_text(value: str) -> str:
+    """Lowercase, accents stripped and whitespace collapsed, for keyword and title matching."""
+    value = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode()
+    return " ".join(value.lower().split())
@@ -0,0 +1,238 @@
+import copy
+import difflib
+import hashlib
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+
+from chunking import FINANCIAL_FIELDS, REQUIRED_ITEMS
+from extraction import ExtractionResult
+from util import env_flag, normalize_text
+
+# Incremental re-analysis of a new revision of a COF already analyzed. Versions
+# of one franchise share a franchise_key (the franchisor CNPJ, or the franchise
+# name when the model found no CNPJ). Before the model is called, the CNPJ is
+# read from the extracted text; if a completed analysis with the same key and
+# its cached extraction exist, the two extractions are diffed page by page and,
+# when only a small part changed, the model sees just the changed pages (old and
+# new text) and reports what changed. The result is merged into the previous
+# analysis locally and carries a version_changes summary.
+INCREMENTAL_ANALYSIS = env_flag("INCREMENTAL_ANALYSIS")
+# Above this share of changed text the document is analyzed from scratch.
+INCREMENTAL_MAX_CHANGED = float(os.environ.get("INCREMENTAL_MAX_CHANGED", "0.5"))
+
+# Only the formatted XX.XXX.XXX/XXXX-XX shape: bare 14-digit runs are too often something else.
+_CNPJ = re.compile(r"\b\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}\b")
+# Running page numbers change on every page when one page is inserted; they are not content.
+_PAGE_LINE = re.compile(r"^(?:pagina|pag\.?|p\.)?\s*\d{1,4}(?:\s*(?:de|/)\s*\d{1,4})?$")
+# Metadata the pipeline adds to a stored analysis; never carried into the next version.
+_RUN_FIELDS = ("filename", "uploadDate", "from_cache", "tokens_in", "version_changes",
+               "sections_analyzed", "sections_failed")
+
+CHANGE_PROMPT_TEMPLATE = """
+Você é um advogado especialista em franchising brasileiro (Lei 13.966/2019) e analista financeiro sênior.
+A franquia {franchise_name} publicou uma nova versão da sua Circular de Oferta de Franquia (COF). A versão anterior
+já foi analisada (nota {score}). Abaixo estão SOMENTE os trechos que mudaram: o texto ANTERIOR e o texto NOVO de cada um.
+Informe apenas o que mudou; o restante da análise anterior continua válido.
+
+Riscos identificados na versão anterior:
+{risks}
+
+FORMATO DE SAÍDA (JSON):
+{{
+    "changes": ["Mudança relevante em uma frase (ex: 'Royalties passaram de 5% para 6% sobre o faturamento bruto')"],
+    "financials": {{
+        "initial_investment": "R$ X a R$ Y ou null se não mudou",
+        "franchise_fee": "R$ X ou null se não mudou",
+        "royalties": "X% sobre Faturamento Bruto ou null se não mudou",
+        "advertising_fund": "X% sobre Faturamento Bruto ou null se não mudou",
+        "payback_period": "X a Y meses ou null se não mudou",
+        "profitability": "X% a Y% a.m. ou null se não mudou"
+    }},
+    "risks_added": [
+        {{"severity": "high|medium|low", "title": "Título do Risco", "description": "Explicação"}}
+    ],
+    "risks_removed": ["Título exato, da lista acima, de um risco que deixou de existir no texto novo"],
+    "found_items": [<quais destes itens aparecem no texto NOVO: "balancos", "pendencias_judiciais", "relacao_franqueados", "marca_inpi">],
+    "missing_items": [<quais destes itens estavam no texto ANTERIOR e não aparecem mais no texto NOVO>],
+    "score": <inteiro 0-100 para a nova versão inteira, partindo da nota anterior>,
+    "summary": "Resumo executivo atualizado da nova versão, ou null se as mudanças não o alteram"
+}}
+
+Trechos alterados:
+{sections}
+"""
+
+
+def normalize_cnpj(value) -> str | None:
+    digits = re.sub(r"\D", "", value) if isinstance(value, str) else ""
+    return digits if len(digits) == 14 and digits != "0" * 14 else None
+
+
+def franchisor_cnpj(text: str) -> str | None:
+    """Digits of the CNPJ the COF cites most (the franchisor's), the earliest on a tie."""
+    found = Counter(normalize_cnpj(match) for match in _CNPJ.findall(text))
+    found.pop(None, None)
+    return found.most_common(1)[0][0] if found else None
+
+
+def franchise_key(cnpj, franchise_name) -> str | None:
+    """What versions of one franchise have in common: the CNPJ, else the trade name."""
+    digits = normalize_cnpj(cnpj)
+    if digits:
+        return f"cnpj:{digits}"
+    if not isinstance(franchise_name, str):
+        return None
+    # "Nome Fantasia (Razão Social)": the trade name is what survives a change of legal entity.
+    name = re.sub(r"[^a-z0-9]+", " ", normalize_text(franchise_name.split("(")[0])).strip()
+    if not name or name in ("desconhecida", "erro dados simulados"):
+        return None
+    return f"name:{name}"
+
+
+# Stored missingClauses are free text (single-prompt analyses word them as they like):
+# each is matched to the required item it is about by keyword.
+_ITEM_KEYWORDS = {
+    "balancos": ("balanc", "demonstracoes financeiras", "demonstrativos financeiros"),
+    "pendencias_judiciais": ("pendencia", "judic"),
+    "relacao_franqueados": ("relacao de franqueados", "lista de franqueados", "franqueados ativos",
+                            "ex-franqueados", "desligados"),
+    "marca_inpi": ("inpi", "registro da marca", "marca registrada"),
+}
+
+
+def _required_item(text: str) -> str | None:
+    """Which REQUIRED_ITEMS key a clause (or an item name the model returned) refers to."""
+    if text in REQUIRED_ITEMS:
+        return text
+    normalized = normalize_text(text)
+    return next((item for item, keywords in _ITEM_KEYWORDS.items()
+                 if any(keyword in normalized for keyword in keywords)), None)
+
+
+def _page_fingerprint(text: str) -> str:
+    lines = (normalize_text(line) for line in text.splitlines())
+    content = "\n".join(line for line in lines if line and not _PAGE_LINE.match(line))
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+@dataclass
+class ChangedSection:
+    old_pages: list[int]  # page indexes in the previous version
+    new_pages: list[int]  # page indexes in the new version
+
+
+@dataclass
+class PageDiff:
+    sections: list[ChangedSection] = field(default_factory=list)
+    changed_chars: int = 0
+    total_chars: int = 0
+    pages_total: int = 0
+
+    @property
+    def changed_ratio(self) -> float:
+        return self.changed_chars / self.total_chars if self.total_chars else 1.0
+
+    @property
+    def pages_changed(self) -> int:
+        return sum(len(section.new_pages) for section in self.sections)
+
+    @property
+    def pages_removed(self) -> int:
+        return sum(len(section.old_pages) for section in self.sections if not section.new_pages)
+
+
+def diff_pages(previous: ExtractionResult, current: ExtractionResult) -> PageDiff:
+    """Page-level diff; pages that only differ in whitespace or page numbering count as unchanged."""
+    old = [_page_fingerprint(page.text) for page in previous.pages]
+    new = [_page_fingerprint(page.text) for page in current.pages]
+    diff = PageDiff(total_chars=sum(len(page.text) for page in current.pages), pages_total=len(current.pages))
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        diff.sections.append(ChangedSection(list(range(i1, i2)), list(range(j1, j2))))
+        # Deleted pages count by their old size: dropping a clause is a change too.
+        changed = current.pages[j1:j2] if j2 > j1 else previous.pages[i1:i2]
+        diff.changed_chars += sum(len(page.text) for page in changed)
+    return diff
+
+
+def _pages_text(extraction: ExtractionResult, indexes: list[int]) -> str:
+    return "\n".join(extraction.pages[i].text for i in indexes if extraction.pages[i].text) or "(sem texto)"
+
+
+def _page_label(extraction: ExtractionResult, indexes: list[int]) -> str:
+    if not indexes:
+        return "removido"
+    first, last = extraction.pages[indexes[0]].index + 1, extraction.pages[indexes[-1]].index + 1
+    return f"página {first}" if first == last else f"páginas {first}-{last}"
+
+
+def build_change_prompt(previous_analysis: dict, previous: ExtractionResult, current: ExtractionResult,
+                        diff: PageDiff) -> str:
+    risks = "\n".join(f"- [{r.get('severity')}] {r.get('title')}" for r in previous_analysis.get("risks") or []
+                      if isinstance(r, dict)) or "(nenhum)"
+    sections = []
+    for n, section in enumerate(diff.sections, 1):
+        sections.append(
+            f"--- Trecho {n} (versão nova: {_page_label(current, section.new_pages)}; "
+            f"versão anterior: {_page_label(previous, section.old_pages)}) ---\n"
+            f"ANTERIOR:\n{_pages_text(previous, section.old_pages) if section.old_pages else '(não existia)'}\n\n"
+            f"NOVO:\n{_pages_text(current, section.new_pages) if section.new_pages else '(removido)'}\n")
+    return CHANGE_PROMPT_TEMPLATE.format(franchise_name=previous_analysis.get("franchise_name") or "analisada",
+                                         score=previous_analysis.get("score"), risks=risks,
+                                         sections="\n".join(sections))
+
+
+def merge_changes(previous_analysis: dict, changes: dict) -> tuple[dict, dict]:
+    """(new analysis, change summary): the previous analysis with the reported changes applied."""
+    analysis = {k: copy.deepcopy(v) for k, v in previous_analysis.items() if k not in _RUN_FIELDS}
+
+    financials = dict(analysis.get("financials") or {})
+    changed_fields = []
+    for name in FINANCIAL_FIELDS:
+        value = (changes.get("financials") or {}).get(name)
+        if value not in (None, "", "null") and value != financials.get(name):
+            financials[name] = str(value)
+            changed_fields.append(name)
+    analysis["financials"] = financials
+
+    removed = {normalize_text(title) for title in changes.get("risks_removed") or []}
+    risks = [r for r in analysis.get("risks") or [] if normalize_text(str(r.get("title", ""))) not in removed]
+    kept = {normalize_text(str(r.get("title", ""))) for r in risks}
+    added = []
+    for risk in changes.get("risks_added") or []:
+        key = normalize_text(risk["title"])
+        if key in kept:
+            # Same risk, reassessed: the new version's wording and severity win.
+            risks = [risk if normalize_text(str(r.get("title", ""))) == key else r for r in risks]
+        else:
+            risks.append(risk)
+            kept.add(key)
+        added.append(risk["title"])
+    analysis["risks"] = risks
+
+    # Items the changed text now has stop being missing; items it dropped become missing.
+    # Clauses about anything else are outside what the changes can tell and are kept.
+    found = {_required_item(item) for item in changes.get("found_items") or []} - {None}
+    dropped = {_required_item(item) for item in changes.get("missing_items") or []} - {None} - found
+    clauses = [clause for clause in analysis.get("missingClauses") or [] if _required_item(clause) not in found]
+    listed = {_required_item(clause) for clause in clauses}
+    analysis["missingClauses"] = clauses + [label for item, label in REQUIRED_ITEMS.items()
+                                            if item in dropped and item not in listed]
+    if changes.get("score") is not None:
+        analysis["score"] = changes["score"]
+    if changes.get("summary"):
+        analysis["summary"] = changes["summary"]
+
+    summary = {
+        "changes": changes.get("changes") or [],
+        "financials_changed": changed_fields,
+        "risks_added": added,
+        "risks_removed": [r.get("title") for r in previous_analysis.get("risks") or []
+                          if isinstance(r, dict) and normalize_text(str(r.get("title", ""))) in removed],
+        "score_before": previous_analysis.get("score"),
+    }
+    return analysis, summary
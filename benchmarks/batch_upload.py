@@ -0,0 +1,117 @@
+"""One POST /api/cof/batch vs. the same COFs as individual uploads.
+
+    python benchmarks/batch_upload.py --files 30
+
+The batch holds the PDFs (half of them inside a ZIP), one in-batch duplicate
+and one non-PDF. Reports wall time and Supabase round trips for both ways and
+exits non-zero if a batch line is missing or the batch is not cheaper in
+round trips.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+os.environ.setdefault("CPU_POOL_KIND", "thread")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from fakes import FakeSupabase, make_pdf  # noqa: E402
+from llm import FakeBackend, LLMClient  # noqa: E402
+
+
+def make_pdfs(count: int) -> list[tuple[str, bytes]]:
+    # Different page counts give different hashes.
+    return [(f"cof-{i:02d}.pdf", make_pdf(pages=2 + i, lines_per_page=10)) for i in range(count)]
+
+
+async def individual(client, pdfs, headers) -> float:
+    async def upload(name, pdf):
+        response = await client.post("/api/cof/upload", headers=headers,
+                                     files={"file": (name, pdf, "application/pdf")})
+        response.raise_for_status()
+        job = response.json()
+        job_id = job.get("analysis_id")
+        while job["status"] not in ("completed", "failed"):
+            await asyncio.sleep(0.02)
+            job = (await client.get(f"/api/cof/jobs/{job_id}", headers=headers)).json()
+        return job["status"]
+
+    began = time.perf_counter()
+    statuses = await asyncio.gather(*(upload(name, pdf) for name, pdf in pdfs))
+    assert statuses.count("completed") == len(pdfs), statuses
+    return time.perf_counter() - began
+
+
+async def batch(client, pdfs, headers) -> tuple[float, list[dict]]:
+    half = len(pdfs) // 2
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for name, pdf in pdfs[half:]:
+            zf.writestr(f"cofs/{name}", pdf)
+    files = [("files", (name, pdf, "application/pdf")) for name, pdf in pdfs[:half]]
+    files.append(("files", ("copia.pdf", pdfs[0][1], "application/pdf")))
+    files.append(("files", ("notas.txt", b"not a pdf", "text/plain")))
+    files.append(("files", ("lote.zip", archive.getvalue(), "application/zip")))
+
+    began = time.perf_counter()
+    lines = []
+    async with client.stream("POST", "/api/cof/batch", headers=headers, files=files) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line:
+                lines.append(json.loads(line))
+    return time.perf_counter() - began, lines
+
+
+async def run(args):
+    pdfs = make_pdfs(args.files)
+    transport = httpx.ASGITransport(app=main.app)
+    await main.job_queue.start()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        main.supabase = FakeSupabase(latency=args.db_latency)
+        main.llm = LLMClient(FakeBackend(latency=args.model_latency))
+        single_wall = await individual(client, pdfs, {"Authorization": "Bearer single"})
+        single_trips = main.supabase.requests
+
+        # Fresh database and user so nothing is served from the global dedup
+        main.supabase = FakeSupabase(latency=args.db_latency)
+        main.llm = LLMClient(FakeBackend(latency=args.model_latency))
+        batch_wall, lines = await batch(client, pdfs, {"Authorization": "Bearer batch"})
+        batch_trips = main.supabase.requests
+        model_calls = main.llm.backend.calls
+    await main.job_queue.stop()
+
+    summary = lines[-1]
+    per_file = lines[:-1]
+    print(f"files={args.files} model_latency={args.model_latency}s db_latency={args.db_latency}s")
+    print(f"individual  wall={single_wall:6.2f}s  db_round_trips={single_trips}")
+    print(f"batch       wall={batch_wall:6.2f}s  db_round_trips={batch_trips}  model_calls={model_calls}")
+    print(f"batch summary: {summary}")
+
+    expected = args.files + 2  # + in-batch duplicate + rejected non-PDF
+    if (not summary.get("done") or len(per_file) != expected or summary["completed"] != args.files + 1
+            or summary["rejected"] != 1 or model_calls != args.files or batch_trips >= single_trips):
+        sys.exit("FAIL: unexpected batch result")
+    print("OK")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--model-latency", type=float, default=0.2)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,161 @@
+"""Prompt-version rollout: cached results go stale, reanalyze.py refreshes them.
+
+    python benchmarks/bulk_reanalysis.py --documents 6 --copies 2
+
+Uploads N distinct COFs, each by several users, then changes PROMPT_VERSION the
+way a prompt edit would. A new upload of an analyzed document must miss the
+cache; api/reanalyze.py then runs in two parts (--limit, then a resume from the
+same checkpoint). Exits non-zero if a document is sent to the model more than
+once (or at all, when a current copy already exists), more documents than
+--concurrency are analyzed at once, a stale row is left behind, a user's copy
+shows another user's filename, or an upload after the rollout is not served
+from the cache.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+os.environ.setdefault("CPU_POOL_KIND", "thread")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+import reanalyze  # noqa: E402
+from fakes import FakeSupabase, make_cof_pages, pdf_from_pages  # noqa: E402
+from llm import FakeBackend, LLMClient  # noqa: E402
+from text_cache import TextCache  # noqa: E402
+
+
+class PeakBackend(FakeBackend):
+    """FakeBackend that records how many calls were in flight at once."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = self.peak = 0
+        self._flight_lock = threading.Lock()
+
+    def generate(self, model_name, prompt, timeout):
+        with self._flight_lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            return super().generate(model_name, prompt, timeout)
+        finally:
+            with self._flight_lock:
+                self.in_flight -= 1
+
+
+async def upload(client, user: str, name: str, pdf: bytes) -> dict:
+    headers = {"Authorization": f"Bearer {user}"}
+    response = await client.post("/api/cof/upload", headers=headers,
+                                 files={"file": (f"{name}.pdf", pdf, "application/pdf")})
+    response.raise_for_status()
+    job = response.json()
+    job_id = job.get("analysis_id")
+    while job["status"] not in ("completed", "failed"):
+        await asyncio.sleep(0.02)
+        job = (await client.get(f"/api/cof/jobs/{job_id}", headers=headers)).json()
+    return job
+
+
+def stale_rows() -> list[dict]:
+    return [row for row in main.supabase.tables["analyses"] if row.get("status") == "completed"
+            and (row.get("prompt_version") != main.PROMPT_VERSION or row.get("model") not in main.llm.models)]
+
+
+async def run(args) -> list[str]:
+    main.supabase = FakeSupabase(latency=args.db_latency)
+    backend = PeakBackend(latency=args.model_latency)
+    main.llm = LLMClient(backend)
+    main.text_cache = TextCache(Path(tempfile.mkdtemp(prefix="cof-reanalysis-")))
+    # Distinct franchises, so no upload is analyzed as a revision of another.
+    main.INCREMENTAL_ANALYSIS = False
+    pdfs = [pdf_from_pages([page.split("\n") for page in make_cof_pages(args.pages, variant)])
+            for variant in range(args.documents)]
+    failures = []
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await main.job_queue.start()
+        for copy in range(args.copies):
+            await asyncio.gather(*(upload(client, f"user{copy}-{n}", f"cof{n}-copy{copy}", pdf) for n, pdf in enumerate(pdfs)))
+        seeded = backend.calls
+        print(f"seeded {len(main.supabase.tables['analyses'])} analyses of {args.documents} documents "
+              f"({seeded} model calls) under prompt_version={main.PROMPT_VERSION}")
+
+        main.PROMPT_VERSION = "bench-rollout"
+        calls = backend.calls
+        await upload(client, "late-user", "cof0", pdfs[0])
+        if backend.calls == calls:
+            failures.append("an upload after the prompt change was served a stale cached result")
+        stale = len(stale_rows())
+        print(f"prompt_version -> {main.PROMPT_VERSION}: {stale} stale analyses")
+
+        # What reanalyze.cli() does: the run gets its own concurrency and token budget.
+        api_llm, main.llm = main.llm, LLMClient(backend, max_concurrency=args.concurrency)
+        backend.peak, calls = 0, backend.calls
+        checkpoint = Path(tempfile.mkdtemp(prefix="cof-reanalysis-")) / "checkpoint.jsonl"
+        began = time.perf_counter()
+        first = await reanalyze.reanalyze(args.concurrency, checkpoint, limit=args.documents // 2)
+        second = await reanalyze.reanalyze(args.concurrency, checkpoint)
+        elapsed = time.perf_counter() - began
+        reanalysis_calls = backend.calls - calls
+        main.llm = api_llm
+
+        calls = backend.calls
+        job = await upload(client, "after-rollout", "cof1", pdfs[1])
+        await main.job_queue.stop()
+
+    entries = [json.loads(line) for line in checkpoint.read_text().splitlines()]
+    print(f"first run: {first}")
+    print(f"resumed:   {second}")
+    print(f"re-analysis: {reanalysis_calls} model calls for {args.documents} documents in {elapsed:.2f}s, "
+          f"peak {backend.peak} in flight (limit {args.concurrency}), {len(stale_rows())} stale analyses left")
+
+    # cof0 already has a current copy (the late upload), so it needs no model call.
+    if reanalysis_calls != args.documents - 1:
+        failures.append(f"{reanalysis_calls} model calls, expected {args.documents - 1}")
+    if backend.peak > args.concurrency:
+        failures.append(f"{backend.peak} model calls in flight, limit was {args.concurrency}")
+    if len({entry["file_hash"] for entry in entries}) != len(entries) or len(entries) != args.documents:
+        failures.append(f"checkpoint has {len(entries)} entries for {args.documents} documents (resume repeated work?)")
+    if first["done"] + second["done"] != args.documents or first["failed"] or second["failed"]:
+        failures.append("not every document was re-analyzed")
+    if stale_rows():
+        failures.append(f"{len(stale_rows())} analyses still carry the old prompt version")
+    mixed = [row["id"] for row in main.supabase.tables["analyses"] if row.get("status") == "completed"
+             and (row.get("risk_analysis") or {}).get("filename") != row.get("file_path")]
+    if mixed:
+        failures.append(f"{len(mixed)} analyses show another copy's filename after re-analysis")
+    if backend.calls != calls or not job.get("from_cache"):
+        failures.append("an upload after the re-analysis was not served from the cache")
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=6)
+    parser.add_argument("--copies", type=int, default=2, help="users uploading each document")
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--model-latency", type=float, default=0.2)
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    found = asyncio.run(run(parse_args()))
+    for line in found:
+        print(f"FAIL {line}")
+    if found:
+        sys.exit(1)
+    print("OK")
@@ -0,0 +1,54 @@
+"""Synthetic COF corpus for the benchmark harness.
+
+    python benchmarks/corpus.py --sizes 10 60 200 --count 5 --out /tmp/cof-corpus
+
+Writes ``count`` PDFs per page count (``cof-<pages>p-<n>.pdf``). Every file has a
+different franchisor, so every file has a different hash; the layout (running
+header, TOC, filler, required sections) is the one in fakes.make_cof_pages.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fakes import make_cof_pdf  # noqa: E402
+
+DEFAULT_SIZES = (10, 60, 200)
+
+
+def generate(sizes=DEFAULT_SIZES, count: int = 5) -> list[tuple[str, bytes]]:
+    """(filename, PDF bytes), interleaving sizes so any prefix of the list has a size mix."""
+    corpus = []
+    variant = 0
+    for n in range(count):
+        for pages in sizes:
+            variant += 1
+            corpus.append((f"cof-{pages}p-{n:02d}.pdf", make_cof_pdf(pages, variant)))
+    return corpus
+
+
+def load_corpus(directory) -> list[tuple[str, bytes]]:
+    paths = sorted(Path(directory).glob("*.pdf"))
+    if not paths:
+        raise FileNotFoundError(f"No PDFs in {directory}")
+    return [(path.name, path.read_bytes()) for path in paths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="page counts")
+    parser.add_argument("--count", type=int, default=5, help="files per page count")
+    parser.add_argument("--out", type=Path, required=True)
+    args = parser.parse_args()
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    total = 0
+    for name, pdf in generate(args.sizes, args.count):
+        (args.out / name).write_bytes(pdf)
+        total += len(pdf)
+    print(f"wrote {len(args.sizes) * args.count} PDFs ({total / 1024:.0f} KB) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Serial vs. parallel PDF text extraction over generated multi-hundred-page COFs.
+
+    python benchmarks/extraction_throughput.py --pages 150 300 400
+
+The char/page budgets are lifted by default so every page is extracted; pass
+--max-chars 60000 to see the early-cutoff behaviour of the production budget.
+"""
+import argparse
+import asyncio
+import hashlib
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import executors  # noqa: E402
+from extraction import extract_text, extract_text_parallel  # noqa: E402
+from fakes import make_pdf  # noqa: E402
+
+
+async def run(args):
+    executors.CPU_POOL_KIND = args.pool
+    executors.CPU_POOL_SIZE = args.workers
+    # Warm the pool so process start-up is not billed to the first run.
+    await executors.run_cpu(sum, [0])
+
+    print(f"pool={args.pool} workers={args.workers} batch_pages={args.batch_pages}")
+    print(f"{'pages':>6} {'size':>8} {'serial':>9} {'parallel':>9} {'speedup':>8} {'pages/s':>9} {'slowest page':>13}")
+    for pages in args.pages:
+        pdf = make_pdf(pages=pages, lines_per_page=args.lines)
+
+        began = time.perf_counter()
+        serial = extract_text(pdf, max_pages=pages, max_chars=args.max_chars)
+        serial_s = time.perf_counter() - began
+
+        began = time.perf_counter()
+        parallel = await extract_text_parallel(pdf, max_pages=pages, max_chars=args.max_chars,
+                                               batch_pages=args.batch_pages, max_in_flight=args.workers,
+                                               key=hashlib.sha256(pdf).hexdigest())
+        parallel_s = time.perf_counter() - began
+
+        assert parallel.text == serial.text, "parallel extraction must match serial output"
+        slowest = max(parallel.timings(), key=lambda t: t["seconds"])
+        print(f"{pages:>6} {len(pdf) // 1024:>6}KB {serial_s:>8.2f}s {parallel_s:>8.2f}s "
+              f"{serial_s / parallel_s:>7.2f}x {parallel.pages_extracted / parallel_s:>9.1f} "
+              f"{slowest['seconds'] * 1000:>9.1f}ms p{slowest['page']}")
+    executors.shutdown_pools()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[150, 300, 400])
+    parser.add_argument("--lines", type=int, default=45, help="text lines per generated page")
+    parser.add_argument("--max-chars", type=int, default=10**9)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-pages", type=int, default=8)
+    parser.add_argument("--pool", choices=["process", "thread"], default="process")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,368 @@
+"""In-memory Supabase and Stripe stand-ins and synthetic PDFs used by the benchmarks.
+
+FakeSupabase and FakeStripe mimic only the slice of the supabase-py and stripe
+surfaces that api/main.py touches, and sleep (blocking, like the real SDKs) to
+simulate network latency.
+The model side uses llm.FakeBackend, which ships with the API.
+"""
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+
+_OPERATORS = {"eq": lambda a, b: a == b, "neq": lambda a, b: a != b, "lt": lambda a, b: a < b,
+              "lte": lambda a, b: a <= b, "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b}
+
+
+def _split_top_level(expr: str) -> list[str]:
+    parts, depth, quoted, current = [], 0, False, ""
+    for ch in expr:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and ch == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        current += ch
+    return parts + [current] if current else parts
+
+
+def _typed(raw: str, like):
+    raw = raw.strip('"')
+    return type(like)(raw) if isinstance(like, (int, float)) and not isinstance(like, bool) else raw
+
+
+def _postgrest_filter(expr: str):
+    """Predicate for a PostgREST logic tree such as ``a.lt.1,and(a.eq.1,id.lt.x)`` (OR at the top)."""
+    def term(text):
+        text = text.strip()
+        match = re.fullmatch(r"(and|or)\((.*)\)", text)
+        if match:
+            children = [term(t) for t in _split_top_level(match.group(2))]
+            combine = all if match.group(1) == "and" else any
+            return lambda row: combine(child(row) for child in children)
+        column, op, raw = text.split(".", 2)
+        if op == "not" and raw.startswith("in."):
+            values = {_typed(v, "") for v in _split_top_level(raw[len("in.("):-1])}
+            return lambda row: row.get(column) is not None and str(row.get(column)) not in values
+        if op == "is":
+            return lambda row: row.get(column) is None if raw == "null" else str(row.get(column)).lower() == raw
+
+        def check(row):
+            value = row.get(column)
+            return value is not None and _OPERATORS[op](value, _typed(raw, value))
+        return check
+
+    terms = [term(t) for t in _split_top_level(expr)]
+    return lambda row: any(t(row) for t in terms)
+
+
+def _project(row: dict, columns: str) -> dict:
+    """Apply a select list (``*``, plain columns, ``alias:col->key`` / ``->>`` JSON paths)."""
+    if columns.strip() in ("*", "count"):
+        return dict(row)
+    out = {}
+    for item in (c.strip() for c in columns.split(",")):
+        alias, _, path = item.rpartition(":")
+        keys = re.split(r"->>?", path)
+        value = row.get(keys[0])
+        for key in keys[1:]:
+            value = value.get(key) if isinstance(value, dict) else None
+        if "->>" in path and value is not None:
+            value = str(value)
+        out[alias or keys[-1]] = value
+    return out
+
+
+class _Query:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.filters = []
+        self.op = "select"
+        self.payload = None
+        self.count = None
+        self.single_row = False
+        self.row_limit = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.columns = "*"
+        self.ordering = []
+
+    def select(self, *columns, count=None):
+        self.op = "select"
+        self.count = count
+        self.columns = ",".join(columns) or "*"
+        return self
+
+    def insert(self, payload):
+        self.op = "insert"
+        self.payload = payload
+        return self
+
+    def upsert(self, payload, on_conflict="", ignore_duplicates=False):
+        self.op = "upsert"
+        self.payload = payload
+        self.on_conflict = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, payload):
+        self.op = "update"
+        self.payload = payload
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def or_(self, filters):
+        self.filters.append(_postgrest_filter(filters))
+        return self
+
+    def limit(self, n):
+        self.row_limit = n
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    def _matches(self, row):
+        return all(f(row) for f in self.filters)
+
+    def execute(self):
+        time.sleep(self.client.latency)
+        with self.client.lock:
+            self.client.requests += 1
+            rows = self.client.tables.setdefault(self.table, [])
+            if self.op in ("insert", "upsert"):
+                payloads = self.payload if isinstance(self.payload, list) else [self.payload]
+                written = []
+                for payload in payloads:
+                    existing = None
+                    if self.on_conflict:
+                        existing = next((row for row in rows if all(
+                            row.get(c) is not None and row.get(c) == payload.get(c) for c in self.on_conflict)), None)
+                    if existing is not None:
+                        if not self.ignore_duplicates:
+                            existing.update(payload)
+                            written.append(dict(existing))
+                        continue
+                    row = {"id": str(uuid.uuid4()), "created_at": time.time(), **payload}
+                    rows.append(row)
+                    written.append(dict(row))
+                return SimpleNamespace(data=written, count=None)
+            matched = [row for row in rows if self._matches(row)]
+            for column, desc in reversed(self.ordering):
+                matched.sort(key=lambda row: row.get(column), reverse=desc)
+            if self.row_limit is not None:
+                matched = matched[: self.row_limit]
+            if self.op == "update":
+                for row in matched:
+                    row.update(self.payload)
+            elif self.op == "delete":
+                self.client.tables[self.table] = [row for row in rows if not self._matches(row)]
+            data = [_project(row, self.columns) for row in matched]
+            if self.single_row:
+                data = data[0] if data else None
+            return SimpleNamespace(data=data, count=len(matched) if self.count else None)
+
+
+class FakeSupabase:
+    def __init__(self, latency: float = 0.02, plan: str = "premium"):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.plan = plan
+        self.requests = 0  # table round trips, for benchmarks that count them
+        self.auth = SimpleNamespace(get_user=self._get_user)
+
+    def _get_user(self, token):
+        time.sleep(self.latency)
+        user_id = f"user-{token}"
+        with self.lock:
+            users = self.tables.setdefault("users", [])
+            if not any(u["id"] == user_id for u in users):
+                users.append({"id": user_id, "email": f"{token}@example.com", "plan": self.plan})
+        return SimpleNamespace(user=SimpleNamespace(id=user_id))
+
+    def table(self, name):
+        return _Query(self, name)
+
+
+class FakeStripe:
+    """Stand-in for the stripe module (assign it to main.stripe); counts calls per method."""
+
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.customers = {}
+        self.sessions = {}
+        self._idempotent = {}
+        self.Customer = SimpleNamespace(create=self._customer_create)
+        self.checkout = SimpleNamespace(Session=SimpleNamespace(create=self._session_create,
+                                                                retrieve=self._session_retrieve))
+        self.billing_portal = SimpleNamespace(Session=SimpleNamespace(create=self._portal_create))
+        self.Subscription = SimpleNamespace(list=self._subscription_list, delete=self._subscription_delete)
+
+    def _call(self, name):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls[name] += 1
+
+    def _customer_create(self, email=None, metadata=None, idempotency_key=None):
+        self._call("Customer.create")
+        with self.lock:
+            if idempotency_key in self._idempotent:
+                return self._idempotent[idempotency_key]
+            customer = SimpleNamespace(id=f"cus_{len(self.customers) + 1:014d}", email=email, metadata=metadata or {})
+            self.customers[customer.id] = customer
+            if idempotency_key:
+                self._idempotent[idempotency_key] = customer
+            return customer
+
+    def _session_create(self, customer=None, client_reference_id=None, metadata=None, **_):
+        self._call("checkout.Session.create")
+        with self.lock:
+            session_id = f"cs_test_{len(self.sessions) + 1:020d}"
+            session = SimpleNamespace(id=session_id, url=f"https://checkout.stripe.test/{session_id}",
+                                      customer=customer, client_reference_id=client_reference_id,
+                                      metadata=metadata or {}, payment_status="unpaid")
+            self.sessions[session_id] = session
+            return session
+
+    def _session_retrieve(self, session_id):
+        self._call("checkout.Session.retrieve")
+        return self.sessions[session_id]
+
+    def _portal_create(self, customer=None, return_url=None):
+        self._call("billing_portal.Session.create")
+        return SimpleNamespace(url=f"https://billing.stripe.test/{customer}")
+
+    def _subscription_list(self, customer=None, status=None, limit=10):
+        self._call("Subscription.list")
+        return SimpleNamespace(data=[])
+
+    def _subscription_delete(self, subscription_id):
+        self._call("Subscription.delete")
+        return SimpleNamespace(id=subscription_id, status="canceled")
+
+
+def _pdf_string(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def pdf_from_pages(pages: list[list[str]]) -> bytes:
+    """Build a minimal text PDF (one line per string) with PyPDF2-readable content streams."""
+    objects = []
+    page_ids = []
+    font_id = 3
+    next_id = 4
+    for lines in pages:
+        body = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({_pdf_string(line)}) '" for line in lines) + " ET"
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects.append((content_id, f"<< /Length {len(body.encode('latin-1', 'replace'))} >>\nstream\n{body}\nendstream"))
+        objects.append((page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                                 f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"))
+        page_ids.append(page_id)
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects.append((1, "<< /Type /Catalog /Pages 2 0 R >>"))
+    objects.append((2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"))
+    objects.append((font_id, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"))
+    objects.sort()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id, body in objects:
+        offsets[obj_id] = len(out)
+        out += f"{obj_id} 0 obj\n{body}\nendobj\n".encode("latin-1", "replace")
+    xref = len(out)
+    size = max(offsets) + 1
+    out += f"xref\n0 {size}\n0000000000 65535 f \n".encode()
+    for obj_id in range(1, size):
+        out += f"{offsets.get(obj_id, 0):010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_pdf(pages: int = 5, lines_per_page: int = 30) -> bytes:
+    """Small uniform PDF: every line mentions the COF, so nothing is filtered out."""
+    return pdf_from_pages([
+        [f"Pagina {p + 1} linha {i} da Circular de Oferta de Franquia royalties taxa" for i in range(lines_per_page)]
+        for p in range(pages)
+    ])
+
+
+# Section text placed at a fraction of the document length.
+COF_SECTIONS = {
+    0.07: ("3. TAXA DE FRANQUIA, ROYALTIES E FUNDO DE PROPAGANDA",
+        "A taxa de franquia é de R$ 40.000,00. Royalties de 6% sobre o faturamento bruto mensal.",
+        "Fundo de propaganda de 2% sobre o faturamento. Investimento inicial de R$ 150.000 a R$ 250.000."),
+    0.2: ("6. BALANÇOS E DEMONSTRAÇÕES FINANCEIRAS",
+         "Balanço patrimonial dos exercícios de 2022 e 2023. Patrimônio líquido de R$ 1.200.000,00.",
+         "Demonstração do resultado com lucro líquido de R$ 310.000,00 em 2023."),
+    0.33: ("7. PENDÊNCIAS JUDICIAIS",
+         "A franqueadora responde a 3 ações judiciais trabalhistas e 1 ação cível movida por ex-franqueado.",),
+    0.47: ("8. RELAÇÃO DE FRANQUEADOS",
+         "Relação de franqueados ativos e dos que se desligaram nos últimos 24 meses, com telefones.",),
+    0.6: ("9. MARCA",
+         "Registro da marca no INPI sob o processo n. 912345678, concedido em 2019.",),
+    0.73: ("12. RESCISÃO E MULTA",
+         "Em caso de rescisão antecipada, multa de 20 vezes o valor dos royalties.",),
+}
+
+
+def make_cof_pages(pages: int = 60, variant: int = 0) -> list[str]:
+    """Page texts shaped like a real COF: running header/footer, TOC, institutional filler, sections.
+
+    ``variant`` changes the franchisor (and so the file hash) without changing the shape.
+    """
+    filler = ("A rede nasceu do sonho de oferecer produtos de qualidade com atendimento diferenciado "
+              "e hoje está presente em diversas cidades do país, sempre fiel aos seus valores. ")
+    at_page = {max(2, int(fraction * pages)): section for fraction, section in COF_SECTIONS.items()}
+    out = []
+    for p in range(pages):
+        lines = [f"EXEMPLO {variant} FRANCHISING LTDA - CIRCULAR DE OFERTA DE FRANQUIA"]
+        if p == 0:
+            lines.append(f"Exemplo {variant} Franchising Ltda., inscrita no CNPJ 12.345.678/{variant % 10000:04d}-90")
+        if p == 1:
+            lines += [f"{n}. Capítulo {n} {'.' * 20} {n * 4}" for n in range(1, 16)]
+        lines += at_page.get(p, ())
+        lines += [filler[i:i + 95] for i in range(0, len(filler), 95)] * 4
+        lines += [f"Página {p + 1} de {pages}", "Rubrica do franqueado: ____________"]
+        out.append("\n".join(lines))
+    return out
+
+
+def make_cof_pdf(pages: int = 60, variant: int = 0) -> bytes:
+    return pdf_from_pages([page.split("\n") for page in make_cof_pages(pages, variant)])
@@ -0,0 +1,260 @@
+"""Offline benchmark and replay harness for the whole analysis pipeline.
+
+Runs the FastAPI app in-process against FakeSupabase and llm.FakeBackend, over a
+synthetic COF corpus (benchmarks/corpus.py) or a directory of real PDFs, and
+reports p50/p95/p99 latency and throughput per scenario:
+
+    cold        every document uploaded once, empty database and text cache
+    cache_hit   the same documents uploaded by other users after they were analyzed
+    identical   many users uploading the same document at once
+    batch       POST /api/cof/batch from several users
+
+    python benchmarks/harness.py                                    # all scenarios
+    python benchmarks/harness.py --scenarios cold batch --rate 5    # Poisson arrivals, 5/s
+    python benchmarks/harness.py --json run.json                    # save the report
+    python benchmarks/harness.py --baseline run.json --tolerance 0.2
+
+With --baseline the run exits non-zero if any scenario's p95 latency grew, or its
+throughput dropped, by more than the tolerance. --record saves the arrival trace
+(JSONL: scenario, offset, user, documents) and --replay runs a saved trace again,
+optionally sped up with --speed. Upload latency is measured until the analysis
+job completes; batch latency until the NDJSON stream ends.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+os.environ.setdefault("CPU_POOL_KIND", "thread")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from auth_cache import plan_cache, quota_cache, token_cache  # noqa: E402
+from corpus import generate, load_corpus  # noqa: E402
+from fakes import FakeSupabase  # noqa: E402
+from llm import FakeBackend, LLMClient  # noqa: E402
+from text_cache import TextCache  # noqa: E402
+
+SCENARIOS = ("cold", "cache_hit", "identical", "batch")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def offsets(count: int, rate: float, rng: random.Random) -> list[float]:
+    """Arrival offsets in seconds: all at once for rate 0, else a Poisson process."""
+    if rate <= 0:
+        return [0.0] * count
+    at, out = 0.0, []
+    for _ in range(count):
+        out.append(round(at, 4))
+        at += rng.expovariate(rate)
+    return out
+
+
+def plan_arrivals(args, names: list[str]) -> list[dict]:
+    rng = random.Random(args.seed)
+    arrivals = []
+    for scenario in args.scenarios:
+        if scenario in ("cold", "cache_hit"):
+            docs = [[name] for name in names]
+        elif scenario == "identical":
+            docs = [[names[0]]] * args.identical
+        else:
+            docs = [[names[(b * args.batch_size + i) % len(names)] for i in range(args.batch_size)]
+                    for b in range(args.batches)]
+        for i, (at, doc_names) in enumerate(zip(offsets(len(docs), args.rate, rng), docs)):
+            arrivals.append({"scenario": scenario, "at": at, "user": f"{scenario}{i}", "docs": doc_names})
+    return arrivals
+
+
+def reset_state(args, cache_root: Path):
+    """Fresh database, model, text cache and auth caches, so scenarios do not leak into each other."""
+    main.supabase = FakeSupabase(latency=args.db_latency)
+    main.llm = LLMClient(FakeBackend(latency=args.model_latency, jitter=args.model_jitter,
+                                     distribution=args.model_distribution, error_rate=args.model_error_rate,
+                                     rate_limit_rate=args.model_rate_limit_rate,
+                                     malformed_rate=args.model_malformed_rate, seed=args.seed))
+    main.text_cache = TextCache(Path(tempfile.mkdtemp(dir=cache_root)))
+    for cache in (token_cache, plan_cache, quota_cache):
+        cache.clear()
+
+
+async def upload(client, user: str, name: str, pdf: bytes) -> bool:
+    headers = {"Authorization": f"Bearer {user}"}
+    response = await client.post("/api/cof/upload", headers=headers, files={"file": (name, pdf, "application/pdf")})
+    if response.status_code >= 400:
+        return False
+    job = response.json()
+    job_id = job.get("analysis_id")
+    while job["status"] not in ("completed", "failed"):
+        await asyncio.sleep(0.02)
+        job = (await client.get(f"/api/cof/jobs/{job_id}", headers=headers)).json()
+    return job["status"] == "completed"
+
+
+async def batch(client, user: str, docs: list[tuple[str, bytes]]) -> bool:
+    files = [("files", (name, pdf, "application/pdf")) for name, pdf in docs]
+    async with client.stream("POST", "/api/cof/batch", headers={"Authorization": f"Bearer {user}"},
+                             files=files) as response:
+        if response.status_code >= 400:
+            return False
+        lines = [json.loads(line) async for line in response.aiter_lines() if line]
+    summary = lines[-1] if lines else {}
+    return bool(summary.get("done")) and summary.get("completed") == len(docs)
+
+
+async def run_scenario(client, scenario: str, arrivals: list[dict], corpus: dict, speed: float) -> dict:
+    latencies, failures = [], 0
+    documents = 0
+
+    async def fire(arrival, began):
+        nonlocal failures, documents
+        await asyncio.sleep(max(0.0, began + arrival["at"] / speed - time.perf_counter()))
+        start = time.perf_counter()
+        try:
+            if scenario == "batch":
+                ok = await batch(client, arrival["user"], [(n, corpus[n]) for n in arrival["docs"]])
+            else:
+                ok = await upload(client, arrival["user"], arrival["docs"][0], corpus[arrival["docs"][0]])
+        except Exception:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+            documents += len(arrival["docs"])
+        else:
+            failures += 1
+
+    calls_before = main.llm.backend.calls
+    trips_before = main.supabase.requests
+    began = time.perf_counter()
+    await asyncio.gather(*(fire(a, began) for a in arrivals))
+    wall = time.perf_counter() - began
+
+    result = {"requests": len(arrivals), "failures": failures, "documents": documents, "wall": round(wall, 4),
+              "throughput": round(documents / wall, 3) if wall else 0.0,
+              "model_calls": main.llm.backend.calls - calls_before,
+              "db_round_trips": main.supabase.requests - trips_before}
+    if latencies:
+        result.update({f"p{p}": round(percentile(latencies, p), 4) for p in (50, 95, 99)})
+        result.update({"max": round(max(latencies), 4), "mean": round(statistics.mean(latencies), 4)})
+    return result
+
+
+async def run(args, arrivals: list[dict], corpus: dict) -> dict:
+    report = {}
+    transport = httpx.ASGITransport(app=main.app)
+    with tempfile.TemporaryDirectory(prefix="cof-harness-") as cache_root:
+        await main.job_queue.start()
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for scenario in dict.fromkeys(a["scenario"] for a in arrivals):
+                planned = [a for a in arrivals if a["scenario"] == scenario]
+                reset_state(args, Path(cache_root))
+                if scenario == "cache_hit":
+                    # Warm-up, not measured: analyze every document once.
+                    warm = {n for a in planned for n in a["docs"]}
+                    await asyncio.gather(*(upload(client, "warmup", n, corpus[n]) for n in warm))
+                report[scenario] = await run_scenario(client, scenario, planned, corpus, args.speed)
+        await main.job_queue.stop()
+    return report
+
+
+def print_report(report: dict):
+    print(f"{'scenario':<10} {'n':>4} {'fail':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} "
+          f"{'docs/s':>8} {'model':>6} {'db':>6}")
+    for scenario, r in report.items():
+        ms = {k: f"{r[k] * 1000:7.0f}ms" if k in r else f"{'-':>9}" for k in ("p50", "p95", "p99", "max")}
+        print(f"{scenario:<10} {r['requests']:>4} {r['failures']:>4} {ms['p50']:>8} {ms['p95']:>8} {ms['p99']:>8} "
+              f"{ms['max']:>8} {r['throughput']:>8.2f} {r['model_calls']:>6} {r['db_round_trips']:>6}")
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    found = []
+    for scenario, base in baseline.items():
+        current = report.get(scenario)
+        if current is None:
+            continue
+        if current["failures"] > base.get("failures", 0):
+            found.append(f"{scenario}: {current['failures']} failures (baseline {base.get('failures', 0)})")
+        if "p95" in base and current.get("p95", float("inf")) > base["p95"] * (1 + tolerance):
+            found.append(f"{scenario}: p95 {current.get('p95')}s vs baseline {base['p95']}s")
+        if current["throughput"] < base["throughput"] * (1 - tolerance):
+            found.append(f"{scenario}: throughput {current['throughput']}/s vs baseline {base['throughput']}/s")
+    return found
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--corpus", type=Path, help="directory of PDFs (default: synthetic corpus)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 60, 200], help="synthetic corpus page counts")
+    parser.add_argument("--count", type=int, default=3, help="synthetic files per page count")
+    parser.add_argument("--rate", type=float, default=0.0, help="arrivals per second per scenario (0 = burst)")
+    parser.add_argument("--identical", type=int, default=20, help="users in the identical scenario")
+    parser.add_argument("--batches", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--model-latency", type=float, default=0.3)
+    parser.add_argument("--model-jitter", type=float, default=0.5, help="± seconds (uniform) or sigma (lognormal)")
+    parser.add_argument("--model-distribution", choices=("uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--model-error-rate", type=float, default=0.0)
+    parser.add_argument("--model-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--model-malformed-rate", type=float, default=0.0)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--record", type=Path, help="write the arrival trace (JSONL)")
+    parser.add_argument("--replay", type=Path, help="run a recorded arrival trace instead of planning one")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up factor")
+    parser.add_argument("--json", type=Path, help="write the report as JSON")
+    parser.add_argument("--baseline", type=Path, help="report JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true", help="keep the API's log lines")
+    return parser.parse_args()
+
+
+def cli():
+    args = parse_args()
+    corpus = dict(load_corpus(args.corpus) if args.corpus else generate(args.sizes, args.count))
+    if args.replay:
+        arrivals = [json.loads(line) for line in args.replay.read_text().splitlines() if line.strip()]
+        missing = {n for a in arrivals for n in a["docs"]} - set(corpus)
+        if missing:
+            sys.exit(f"Trace needs documents not in the corpus: {sorted(missing)[:5]}")
+    else:
+        arrivals = plan_arrivals(args, list(corpus))
+    if args.record:
+        args.record.write_text("".join(json.dumps(a) + "\n" for a in arrivals))
+
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with logs:
+        report = asyncio.run(run(args, arrivals, corpus))
+
+    print(f"corpus={len(corpus)} docs model_latency={args.model_latency}s ({args.model_distribution}, "
+          f"jitter={args.model_jitter}) db_latency={args.db_latency}s rate={args.rate or 'burst'}")
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        found = regressions(report, json.loads(args.baseline.read_text()), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+        print(f"OK: within {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,73 @@
+"""N concurrent uploads of the same COF must cost exactly one model call.
+
+    python benchmarks/identical_uploads.py --uploads 20
+
+Each upload comes from a different user, so none of them hits the
+completed-analysis dedup at upload time; the per-file_hash singleflight in
+the analysis job (plus its completed-result check for jobs queued behind the
+first one) is what coalesces them. Exits non-zero if more than one model call was made.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+os.environ.setdefault("CPU_POOL_KIND", "thread")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from fakes import FakeSupabase, make_pdf  # noqa: E402
+from llm import FakeBackend, LLMClient  # noqa: E402
+
+
+async def run(args):
+    main.supabase = FakeSupabase(latency=args.db_latency)
+    main.llm = LLMClient(FakeBackend(latency=args.model_latency))
+
+    pdf = make_pdf(pages=args.pages)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def upload(i):
+            headers = {"Authorization": f"Bearer user{i}"}
+            response = await client.post("/api/cof/upload", headers=headers,
+                                         files={"file": ("same.pdf", pdf, "application/pdf")})
+            response.raise_for_status()
+            job = response.json()
+            job_id = job.get("analysis_id")
+            while job["status"] not in ("completed", "failed"):
+                await asyncio.sleep(0.02)
+                job = (await client.get(f"/api/cof/jobs/{job_id}", headers=headers)).json()
+            return job["status"]
+
+        await main.job_queue.start()
+        began = time.perf_counter()
+        statuses = await asyncio.gather(*(upload(i) for i in range(args.uploads)))
+        wall = time.perf_counter() - began
+        await main.job_queue.stop()
+
+    model_calls = main.llm.backend.calls
+    rows = main.supabase.tables.get("analyses", [])
+    print(f"uploads={args.uploads} completed={statuses.count('completed')} model_calls={model_calls} "
+          f"rows={len(rows)} wall={wall:.2f}s")
+    if model_calls != 1 or statuses.count("completed") != args.uploads or len(rows) != args.uploads:
+        sys.exit("FAIL: expected every upload to complete with exactly one model call")
+    print("OK")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--model-latency", type=float, default=0.5)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,71 @@
+"""Cold-start budget for the API module.
+
+    python benchmarks/import_time.py --budget-ms 700
+
+Imports api/main.py in fresh interpreters under ``python -X importtime`` and
+reports the best cumulative import time and the slowest direct imports. Exits
+non-zero if the import takes longer than the budget, or if any SDK that should
+only load on first use (Supabase, Stripe, Gemini, PyPDF2) is imported at
+startup.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+API_DIR = Path(__file__).resolve().parent.parent / "api"
+
+# Loaded lazily by clients.py / llm.py / extraction.py; must not show up at import.
+DEFERRED = ("supabase", "stripe", "google.generativeai", "google.api_core", "PyPDF2")
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure() -> tuple[float, list[tuple[str, float]], set[str]]:
+    """One cold import: (total ms, direct imports of main with their cumulative ms, every module imported)."""
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "0"}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=API_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    total, direct, modules = 0.0, [], set()
+    for _, cumulative, indent, name in _LINE.findall(result.stderr):
+        modules.add(name)
+        if name == "main" and not indent.strip(" "):
+            total = int(cumulative) / 1000
+        elif len(indent) == 3:
+            direct.append((name, int(cumulative) / 1000))
+    return total, direct, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=700)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args()
+
+    measure()  # compile .pyc files so every measured run is a warm-disk cold start
+    runs = [measure() for _ in range(args.runs)]
+    totals = [total for total, _, _ in runs]
+    best, direct, modules = min(runs, key=lambda run: run[0])
+
+    print(f"import main: best={best:.0f}ms median={statistics.median(totals):.0f}ms "
+          f"(runs={args.runs}, budget={args.budget_ms:.0f}ms)")
+    for name, ms in sorted(direct, key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<28} {ms:8.1f}ms")
+
+    loaded = sorted(m for m in modules if any(m == d or m.startswith(d + ".") for d in DEFERRED))
+    failures = []
+    if loaded:
+        failures.append(f"SDKs imported at startup: {', '.join(sorted({m.split('.')[0] for m in loaded}))}")
+    if best > args.budget_ms:
+        failures.append(f"import took {best:.0f}ms, budget is {args.budget_ms:.0f}ms")
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
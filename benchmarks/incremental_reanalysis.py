@@ -0,0 +1,140 @@
+"""Re-analysis of a new revision of an already analyzed COF.
+
+    python benchmarks/incremental_reanalysis.py --pages 30
+
+Uploads version 1 of a synthetic COF, then a revision with the same CNPJ where
+one clause changed and one page was added, then a heavy rewrite of it. The
+revision must be analyzed incrementally (only the changed pages reach the
+model, merged into version 1's analysis, with a change summary) and recorded as
+cof_version 2; the rewrite must fall back to a full analysis. The same revision
+is then analyzed with INCREMENTAL_ANALYSIS off for comparison. Exits non-zero if
+the revision was not incremental, its prompt was not smaller than a full
+analysis, or the versions were not recorded.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+os.environ.setdefault("CPU_POOL_KIND", "thread")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from fakes import FakeSupabase, make_cof_pages, pdf_from_pages  # noqa: E402
+from llm import FakeBackend, LLMClient  # noqa: E402
+from text_cache import TextCache  # noqa: E402
+
+
+class RecordingBackend(FakeBackend):
+    """FakeBackend that keeps the size of every prompt it is sent."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.prompt_chars = []
+
+    def generate(self, model_name, prompt, timeout):
+        self.prompt_chars.append(len(prompt))
+        return super().generate(model_name, prompt, timeout)
+
+
+def revisions(pages: int, variant: int) -> dict[str, bytes]:
+    original = make_cof_pages(pages, variant)
+    revised = list(original)
+    fees = next(i for i, page in enumerate(revised) if "Royalties de 6%" in page)
+    revised[fees] = revised[fees].replace("Royalties de 6%", "Royalties de 7%")
+    termination = next(i for i, page in enumerate(revised) if "RESCISÃO E MULTA" in page)
+    revised.insert(termination + 1, "\n".join([
+        "12.1 CESSÃO DA UNIDADE",
+        "A cessão ou transferência da unidade depende de aprovação prévia da franqueadora,",
+        "que cobrará taxa de transferência de R$ 15.000,00 e poderá exercer direito de preferência.",
+    ]))
+    rewritten = [page.replace("A rede nasceu do sonho", "Nossa trajetória começou com o objetivo")
+                 .replace("atendimento diferenciado", "excelência operacional") for page in revised]
+    return {name: pdf_from_pages([page.split("\n") for page in texts])
+            for name, texts in (("v1", original), ("v2", revised), ("rewrite", rewritten))}
+
+
+async def upload(client, user: str, name: str, pdf: bytes) -> dict:
+    headers = {"Authorization": f"Bearer {user}"}
+    response = await client.post("/api/cof/upload", headers=headers,
+                                 files={"file": (f"{name}.pdf", pdf, "application/pdf")})
+    response.raise_for_status()
+    job = response.json()
+    job_id = job.get("analysis_id")
+    while job["status"] not in ("completed", "failed"):
+        await asyncio.sleep(0.02)
+        job = (await client.get(f"/api/cof/jobs/{job_id}", headers=headers)).json()
+    return {"id": job_id, **job}
+
+
+async def run(args) -> list[str]:
+    main.supabase = FakeSupabase(latency=args.db_latency)
+    backend = RecordingBackend(latency=args.model_latency)
+    main.llm = LLMClient(backend)
+    main.text_cache = TextCache(Path(tempfile.mkdtemp(prefix="cof-incremental-")))
+    pdfs = revisions(args.pages, args.variant)
+    failures, report = [], {}
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await main.job_queue.start()
+        # The last run uploads the revision again as a different file (trailing bytes) with the mode off.
+        plan = [("v1", pdfs["v1"], True), ("v2", pdfs["v2"], True), ("rewrite", pdfs["rewrite"], True),
+                ("v2-full", pdfs["v2"] + b"\n%bench\n", False)]
+        for n, (name, pdf, incremental) in enumerate(plan):
+            main.INCREMENTAL_ANALYSIS = incremental
+            calls, began = len(backend.prompt_chars), time.perf_counter()
+            job = await upload(client, f"user{n}", name, pdf)
+            row = next(r for r in main.supabase.tables["analyses"] if r["id"] == job["id"])
+            result = job.get("result") or {}
+            report[name] = {"status": job["status"], "seconds": time.perf_counter() - began,
+                            "prompt_chars": sum(backend.prompt_chars[calls:]), "version": row.get("cof_version"),
+                            "changes": result.get("version_changes")}
+        await main.job_queue.stop()
+
+    for name, r in report.items():
+        changes = r["changes"]
+        detail = (f"incremental: {changes['pages_changed']}/{changes['pages_total']} pages changed"
+                  if changes else "full analysis")
+        print(f"{name:<8} {r['status']:<9} {r['seconds'] * 1000:7.0f}ms prompt={r['prompt_chars']:>6} chars "
+              f"cof_version={r['version']} ({detail})")
+
+    if any(r["status"] != "completed" for r in report.values()):
+        failures.append("not every upload completed")
+    if not report["v2"]["changes"]:
+        failures.append("the revision was analyzed in full")
+    elif report["v2"]["prompt_chars"] >= report["v2-full"]["prompt_chars"] * args.max_prompt_ratio:
+        failures.append(f"incremental prompt {report['v2']['prompt_chars']} chars is not under "
+                        f"{args.max_prompt_ratio:.0%} of the full one ({report['v2-full']['prompt_chars']})")
+    if report["rewrite"]["changes"]:
+        failures.append("the heavy rewrite was analyzed incrementally")
+    if [report[name]["version"] for name in ("v1", "v2", "rewrite")] != ["1", "2", "3"]:
+        failures.append("versions were not recorded as 1, 2, 3")
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--variant", type=int, default=1, help="synthetic franchisor; FakeBackend reports the CNPJ of variant 1")
+    parser.add_argument("--model-latency", type=float, default=0.3)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--max-prompt-ratio", type=float, default=0.5,
+                        help="incremental prompt must be under this share of the full one")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    found = asyncio.run(run(parse_args()))
+    for line in found:
+        print(f"FAIL {line}")
+    if found:
+        sys.exit(1)
+    print("OK")
@@ -0,0 +1,66 @@
+"""Model calls spent on malformed responses: local repair vs. the old strip + json.loads.
+
+    python benchmarks/malformed_output.py --requests 200 --malformed-rate 0.2
+
+The fake backend wraps a share of its responses in prose with a trailing comma,
+and cuts another share off mid-object. With strict parsing each of those is
+thrown away and re-asked from the fallback model; model_output repairs the
+first kind locally and rejects the second (required fields are missing). Exits
+non-zero if a truncated response is accepted or the repaired path saves no calls.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+
+import model_output  # noqa: E402
+from llm import FakeBackend, LLMClient  # noqa: E402
+
+
+def strict_parse(response_text: str) -> dict:
+    # What upload_cof used to do.
+    response_text = response_text.replace('```json', '').replace('```', '').strip()
+    return json.loads(response_text)
+
+
+async def measure(parse, args) -> tuple[int, int, int, float]:
+    client = LLMClient(FakeBackend(latency=args.model_latency, malformed_rate=args.malformed_rate, seed=7),
+                       max_concurrency=args.requests)
+    began = time.perf_counter()
+    results = await asyncio.gather(*(client.generate("prompt", parse=parse) for _ in range(args.requests)),
+                                   return_exceptions=True)
+    failed = sum(isinstance(r, Exception) for r in results)
+    # A truncated response cuts risks short and drops missingClauses/recommendations.
+    incomplete = sum(not isinstance(r, Exception) and len(r[0]["risks"]) < 2 for r in results)
+    return client.backend.calls, failed, incomplete, time.perf_counter() - began
+
+
+async def run(args):
+    print(f"requests={args.requests} malformed_rate={args.malformed_rate} model_latency={args.model_latency}s")
+    strict_calls, strict_failed, _, strict_wall = await measure(strict_parse, args)
+    print(f"strict    model_calls={strict_calls:5d} failed={strict_failed:3d} wall={strict_wall:.2f}s")
+    repaired_calls, repaired_failed, incomplete, repaired_wall = await measure(model_output.parse_analysis, args)
+    print(f"repaired  model_calls={repaired_calls:5d} failed={repaired_failed:3d} incomplete={incomplete:3d} "
+          f"wall={repaired_wall:.2f}s")
+    print(f"model_output stats: {model_output.stats()}")
+    if incomplete:
+        sys.exit(f"FAIL: {incomplete} truncated responses were accepted")
+    if repaired_calls >= strict_calls or repaired_failed > strict_failed:
+        sys.exit("FAIL: local repair saved no re-queries")
+    print("OK")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--malformed-rate", type=float, default=0.2)
+    parser.add_argument("--model-latency", type=float, default=0.01)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,54 @@
+"""Prompt tokens-in before/after the relevance pre-filter.
+
+    python benchmarks/prompt_tokens.py                 # synthetic COF
+    python benchmarks/prompt_tokens.py cof1.pdf cof2.pdf
+
+Real PDFs are extracted with the chunked-mode budget so the filter sees the
+whole document. Exits non-zero if the synthetic COF loses a required section.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from extraction import extract_text  # noqa: E402
+from fakes import make_cof_pages  # noqa: E402
+from llm import estimate_tokens  # noqa: E402
+from main import CHUNKED_MAX_CHARS, CHUNKED_MAX_PAGES, PROMPT_MAX_CHARS, build_prompt  # noqa: E402
+from relevance import prefilter  # noqa: E402
+
+
+def measure(name: str, pages: list[str], budget: int) -> dict:
+    raw = "".join(p + "\n" for p in pages if p)
+    filtered = prefilter(pages, budget)
+    report = filtered.report(estimate_tokens(build_prompt(raw)), estimate_tokens(build_prompt(filtered.text)))
+    print(f"{name[:30]:<30} {len(pages):>6} {report['tokens_before']:>9} {report['tokens_after']:>9} "
+          f"{report['reduction']:>7.1%} {report['passages_kept']:>4}/{report['passages_total']:<4} "
+          f"{report['seconds'] * 1000:>7.1f}ms  missing: {', '.join(report['missing_sections']) or '-'}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdfs", nargs="*", type=Path)
+    parser.add_argument("--budget", type=int, default=PROMPT_MAX_CHARS, help="prompt char budget")
+    parser.add_argument("--pages", type=int, default=120, help="pages of the synthetic COF")
+    args = parser.parse_args()
+
+    print(f"{'document':<30} {'pages':>6} {'before':>9} {'after':>9} {'saved':>7} {'passages':>9} {'filter':>9}")
+    if not args.pdfs:
+        report = measure(f"synthetic ({args.pages} pages)", make_cof_pages(args.pages), args.budget)
+        if report["missing_sections"] or report["tokens_after"] >= report["tokens_before"]:
+            print("FAIL: required sections dropped or no reduction")
+            sys.exit(1)
+        print("OK")
+        return
+    for path in args.pdfs:
+        extraction = extract_text(str(path), max_pages=CHUNKED_MAX_PAGES, max_chars=CHUNKED_MAX_CHARS)
+        measure(path.name, [p.text for p in extraction.pages], args.budget)
+
+
+if __name__ == "__main__":
+    main()
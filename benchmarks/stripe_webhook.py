@@ -0,0 +1,183 @@
+"""Stripe plan sync: webhook replay and checkout calls against local stubs.
+
+    python benchmarks/stripe_webhook.py
+    python benchmarks/stripe_webhook.py --events recorded.json --stripe-latency 0.3
+
+Replays recorded webhook payloads (benchmarks/fixtures/stripe_events.json by
+default), freshly signed with a test secret, at POST /api/stripe/webhook and
+checks the user's plan after each one; then redelivers every event (must be a
+no-op), sends bad, stale and unsigned deliveries (must be 400), and makes one
+delivery fail mid-way (must be 500, and succeed on retry). Finally it fires
+concurrent and repeated checkouts for a user without a Stripe customer through
+FakeStripe while probing /health. Exits non-zero if a plan is wrong, a
+duplicate is re-applied, more than one customer is created, or /health ever
+waits as long as a Stripe call (the event loop was blocked).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+SECRET = "whsec_benchmark"
+os.environ["STRIPE_WEBHOOK_SECRET"] = SECRET
+os.environ.setdefault("CPU_POOL_KIND", "thread")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from auth_cache import customer_cache, plan_cache  # noqa: E402
+from billing import sign_payload  # noqa: E402
+from fakes import FakeStripe, FakeSupabase  # noqa: E402
+
+FIXTURE = Path(__file__).resolve().parent / "fixtures" / "stripe_events.json"
+
+# Plan of the event's user after each recorded event (None: event ignored).
+EXPECTED = {
+    "evt_1So8AaL6KJkeKKprX1checkout": ("user-alice", "premium"),
+    "evt_1So8AbL6KJkeKKprX2subcreated": ("user-alice", "premium"),
+    "evt_1So8AcL6KJkeKKprX3invoice": None,
+    "evt_1SqPastDueL6KJkeKKprX4": ("user-alice", "premium"),
+    "evt_1SrDeletedL6KJkeKKprX5": ("user-alice", "free"),
+    "evt_1SqLateActiveL6KJkeKKprX6": ("user-alice", "free"),  # older than the deletion
+    "evt_1SsUnpaidCheckoutL6KJkeX7": ("user-bob", "free"),
+}
+
+
+def user_plan(user_id: str) -> str | None:
+    return next((u.get("plan") for u in main.supabase.tables["users"] if u["id"] == user_id), None)
+
+
+async def deliver(client, event: dict, secret: str = SECRET, timestamp: int | None = None, signed: bool = True):
+    payload = json.dumps(event).encode()
+    headers = {"Content-Type": "application/json"}
+    if signed:
+        headers["Stripe-Signature"] = sign_payload(payload, secret, timestamp)
+    return await client.post("/api/stripe/webhook", content=payload, headers=headers)
+
+
+async def replay(client, events: list[dict], failures: list[str]):
+    for event in events:
+        response = await deliver(client, event)
+        expected = EXPECTED.get(event["id"])
+        if response.status_code != 200:
+            failures.append(f"{event['id']}: HTTP {response.status_code} {response.text}")
+        elif expected and user_plan(expected[0]) != expected[1]:
+            failures.append(f"{event['id']}: {expected[0]} plan={user_plan(expected[0])}, expected {expected[1]}")
+        print(f"  {event['type']:<32} {response.status_code} {response.json()}")
+
+    before = [dict(u) for u in main.supabase.tables["users"]]
+    for event in events:
+        body = (await deliver(client, event)).json()
+        if main.plan_update(event) is not None and not body.get("duplicate"):
+            failures.append(f"{event['id']}: redelivery was applied again ({body})")
+    if main.supabase.tables["users"] != before:
+        failures.append("redelivering events changed users")
+
+    event = events[0]
+    for label, response in (
+        ("wrong secret", await deliver(client, event, secret="whsec_other")),
+        ("stale timestamp", await deliver(client, event, timestamp=int(time.time()) - 3600)),
+        ("unsigned", await deliver(client, event, signed=False)),
+    ):
+        if response.status_code != 400:
+            failures.append(f"{label}: HTTP {response.status_code}, expected 400")
+
+    # A delivery that fails after claiming the event must be retried, not deduplicated.
+    retry = {**event, "id": "evt_retry_after_failure", "created": int(time.time())}
+    set_user_plan = main.set_user_plan
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+    main.set_user_plan = broken
+    first = await deliver(client, retry)
+    main.set_user_plan = set_user_plan
+    second = await deliver(client, retry)
+    if first.status_code != 500 or second.status_code != 200 or not second.json().get("applied"):
+        failures.append(f"retry after failure: {first.status_code} then {second.status_code} {second.json()}")
+
+
+async def checkouts(client, args, failures: list[str]):
+    user = "user-carol"
+    body = {"user_id": user, "price_id": "price_1So74jL6KJkeKKprcQNcdnyi"}
+    health, latencies = [], []
+    done = asyncio.Event()
+
+    async def checkout():
+        start = time.perf_counter()
+        response = await client.post("/api/create-checkout-session", json=body)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            failures.append(f"checkout: HTTP {response.status_code} {response.text}")
+
+    async def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            (await client.get("/health")).raise_for_status()
+            health.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    prober = asyncio.create_task(probe())
+    await asyncio.gather(*(checkout() for _ in range(args.concurrent)))
+    for _ in range(args.repeat):
+        await checkout()
+    done.set()
+    await prober
+
+    created = main.stripe.calls["Customer.create"]
+    stored = next(u.get("stripe_customer_id") for u in main.supabase.tables["users"] if u["id"] == user)
+    print(f"checkouts={len(latencies)} p50={statistics.median(latencies) * 1000:.0f}ms "
+          f"customers_created={created} stripe_calls={dict(main.stripe.calls)}")
+    print(f"/health during checkouts: n={len(health)} max={max(health) * 1000:.1f}ms "
+          f"(stripe latency {args.stripe_latency * 1000:.0f}ms)")
+    if created != 1 or not stored:
+        failures.append(f"expected 1 Stripe customer stored for {user}, got {created} (stored={stored})")
+    if max(health) >= args.stripe_latency:
+        failures.append(f"/health took {max(health) * 1000:.0f}ms: a Stripe call blocked the event loop")
+
+
+async def run(args) -> list[str]:
+    main.supabase = FakeSupabase(latency=args.db_latency, plan="free")
+    main.stripe = FakeStripe(latency=args.stripe_latency)
+    customer_cache.clear()
+    plan_cache.clear()
+    for token in ("alice", "bob", "carol"):
+        main.supabase.auth.get_user(token)
+    for user in main.supabase.tables["users"]:
+        if user["id"] == "user-alice":
+            user["stripe_customer_id"] = "cus_RhAlice000001"
+
+    events = json.loads(args.events.read_text())
+    failures = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(f"replaying {len(events)} events from {args.events}")
+        await replay(client, events, failures)
+        await checkouts(client, args, failures)
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=Path, default=FIXTURE, help="recorded webhook events (JSON list)")
+    parser.add_argument("--concurrent", type=int, default=10, help="simultaneous checkouts for one user")
+    parser.add_argument("--repeat", type=int, default=5, help="sequential checkouts afterwards")
+    parser.add_argument("--stripe-latency", type=float, default=0.3)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    found = asyncio.run(run(parse_args()))
+    for line in found:
+        print(f"FAIL {line}")
+    if found:
+        sys.exit(1)
+    print("OK")
@@ -0,0 +1,129 @@
+"""Concurrent upload latency benchmark with stubbed Supabase and Gemini.
+
+Fires N concurrent uploads at /api/cof/upload, polls each analysis job to
+completion while probing /health, and reports latency for both. Run once as-is
+(blocking work on the pools) and once with --inline, which executes the blocking
+steps on the event loop the way upload_cof used to:
+
+    python benchmarks/upload_concurrency.py --uploads 20
+    python benchmarks/upload_concurrency.py --uploads 20 --inline
+
+/health probes follow a fixed schedule (every --probe-interval) and their
+latency is measured from the scheduled send time, so a probe held up behind a
+blocked event loop counts the whole wait instead of silently sending late. The
+largest gap between two probe responses is reported as well.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+os.environ.setdefault("CPU_POOL_KIND", "thread")
+
+import httpx  # noqa: E402
+
+import extraction  # noqa: E402
+import jobs  # noqa: E402
+import llm  # noqa: E402
+import main  # noqa: E402
+from fakes import FakeSupabase, make_pdf  # noqa: E402
+from llm import FakeBackend, LLMClient  # noqa: E402
+
+
+async def _inline(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(label, values):
+    if not values:
+        return f"{label:<8} n=0"
+    return (f"{label:<8} n={len(values):<4} p50={percentile(values, 50) * 1000:8.1f}ms "
+            f"p95={percentile(values, 95) * 1000:8.1f}ms p99={percentile(values, 99) * 1000:8.1f}ms max={max(values) * 1000:8.1f}ms "
+            f"mean={statistics.mean(values) * 1000:8.1f}ms")
+
+
+async def run(args):
+    main.supabase = FakeSupabase(latency=args.db_latency)
+    main.llm = LLMClient(FakeBackend(latency=args.model_latency))
+    if args.inline:
+        for module in (main, jobs, llm, extraction):
+            for name in ("run_io", "run_cpu"):
+                if hasattr(module, name):
+                    setattr(module, name, _inline)
+
+    pdfs = [make_pdf(pages=args.pages, lines_per_page=20 + i) for i in range(args.uploads)]
+    upload_latencies, health_latencies, health_gaps = [], [], []
+    done = asyncio.Event()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def upload(i):
+            start = time.perf_counter()
+            response = await client.post(
+                "/api/cof/upload",
+                files={"file": (f"bench-{i}.pdf", pdfs[i], "application/pdf")},
+                headers={"Authorization": f"Bearer bench{i}"},
+            )
+            response.raise_for_status()
+            job = response.json()
+            job_id = job.get("analysis_id")
+            while job["status"] not in ("completed", "failed"):
+                await asyncio.sleep(0.05)
+                job = (await client.get(f"/api/cof/jobs/{job_id}",
+                                        headers={"Authorization": f"Bearer bench{i}"})).json()
+            upload_latencies.append(time.perf_counter() - start)
+
+        async def probe():
+            scheduled = last = time.perf_counter()
+            while not done.is_set():
+                (await client.get("/health")).raise_for_status()
+                now = time.perf_counter()
+                health_latencies.append(now - scheduled)
+                health_gaps.append(now - last)
+                last = now
+                # Next send is due one interval after the previous was due, not after it returned.
+                scheduled += args.probe_interval
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+
+        await main.job_queue.start()
+        wall = time.perf_counter()
+        prober = asyncio.create_task(probe())
+        await asyncio.gather(*(upload(i) for i in range(args.uploads)))
+        wall = time.perf_counter() - wall
+        done.set()
+        await prober
+        await main.job_queue.stop()
+
+    mode = "inline (event loop blocked)" if args.inline else "pooled"
+    print(f"mode={mode} uploads={args.uploads} model_latency={args.model_latency}s wall={wall:.2f}s "
+          f"throughput={args.uploads / wall:.2f} uploads/s")
+    print(summarize("upload", upload_latencies))
+    print(summarize("/health", health_latencies))
+    print(f"/health  largest gap between responses={max(health_gaps, default=0) * 1000:.1f}ms "
+          f"(schedule every {args.probe_interval * 1000:.0f}ms)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--model-latency", type=float, default=0.5)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="seconds between scheduled /health probes")
+    parser.add_argument("--inline", action="store_true", help="run blocking steps on the event loop (old behaviour)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
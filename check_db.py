@@ -23,7 +23,7 @@ try:
 
     # Check Analyses
     print("\nChecking Analyses...")
-    analyses = supabase.table("analyses").select("*").execute()
+    analyses = supabase.table("analyses").select("id, user_id, franchise_name, created_at").execute()
     print(f"Analyses found: {len(analyses.data)}")
     for a in analyses.data:
         print(f" - Analysis: {a['id']}")
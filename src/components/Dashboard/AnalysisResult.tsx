@@ -2,7 +2,7 @@ import React from 'react';
 import { AnalysisResult } from '@/types/analysis';
 import { Card } from '@/components/ui/Card';
 import { Button } from '@/components/ui/Button';
-import { AlertTriangle, CheckCircle, FileText, ArrowLeft, Download, FileSpreadsheet } from 'lucide-react';
+import { AlertTriangle, CheckCircle, FileText, ArrowLeft, Download, FileSpreadsheet, GitCompare } from 'lucide-react';
 import { generateAnalysisPDF } from '@/lib/pdfGenerator';
 import { generateExcel } from '@/lib/excelGenerator';
 
@@ -123,6 +123,50 @@ export function AnalysisResultView({ result, onBack }: AnalysisResultProps) {
           )}
       </Card>
 
+      {/* Changes since the previous version of this franchise's COF */}
+      {result.version_changes && (
+        <Card className="p-6">
+          <h3 className="text-lg font-semibold text-gray-900 dark:text-white mb-2 flex items-center gap-2">
+            <GitCompare className="h-5 w-5 text-indigo-600 dark:text-indigo-400" />
+            Mudanças em relação à versão anterior
+            {result.cof_version && <span className="text-sm font-normal text-gray-500 dark:text-gray-400">(versão {result.cof_version})</span>}
+          </h3>
+          <p className="text-sm text-gray-500 dark:text-gray-400 mb-4">
+            {result.version_changes.pages_changed} de {result.version_changes.pages_total} páginas alteradas
+            {result.version_changes.pages_removed > 0 && `, ${result.version_changes.pages_removed} removidas`}
+            {result.version_changes.score_before != null && ` · pontuação anterior: ${result.version_changes.score_before}`}
+          </p>
+          {result.version_changes.changes.length > 0 ? (
+            <ul className="space-y-2">
+              {result.version_changes.changes.map((change, index) => (
+                <li key={index} className="flex items-start gap-2 text-sm text-gray-600 dark:text-gray-300">
+                  <span className="block w-1.5 h-1.5 mt-1.5 rounded-full bg-indigo-400 flex-shrink-0" />
+                  {change}
+                </li>
+              ))}
+            </ul>
+          ) : (
+            <p className="text-sm text-gray-600 dark:text-gray-300">Nenhuma mudança relevante no texto.</p>
+          )}
+          {(result.version_changes.risks_added.length > 0 || result.version_changes.risks_removed.length > 0) && (
+            <div className="grid gap-4 md:grid-cols-2 mt-4 pt-4 border-t border-gray-100 dark:border-gray-700 text-sm">
+              <div>
+                <p className="text-xs text-gray-500 dark:text-gray-400 uppercase font-semibold mb-1">Novos riscos</p>
+                {result.version_changes.risks_added.map((title, index) => (
+                  <p key={index} className="text-red-600 dark:text-red-400">{title}</p>
+                ))}
+              </div>
+              <div>
+                <p className="text-xs text-gray-500 dark:text-gray-400 uppercase font-semibold mb-1">Riscos eliminados</p>
+                {result.version_changes.risks_removed.map((title, index) => (
+                  <p key={index} className="text-green-600 dark:text-green-400">{title}</p>
+                ))}
+              </div>
+            </div>
+          )}
+        </Card>
+      )}
+
       {/* Third Row: Risk Points (3 columns or more) */}
        <div className="space-y-4">
           <h3 className="text-lg font-semibold text-gray-900 dark:text-white flex items-center gap-2">
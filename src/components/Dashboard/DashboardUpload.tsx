@@ -5,6 +5,38 @@ import { Card } from '@/components/ui/Card';
 import { AnalysisResult } from '@/types/analysis';
 import { supabase } from '@/lib/supabase';
 
+const JOB_POLL_INTERVAL_MS = 2000;
+
+interface JobStatus {
+  id: string;
+  status: 'queued' | 'processing' | 'completed' | 'failed';
+  stage: string;
+  result: AnalysisResult | null;
+  error: string | null;
+}
+
+async function waitForJob(jobId: string, token: string): Promise<AnalysisResult> {
+  // The upload returns immediately; poll the job until the analysis finishes.
+  for (;;) {
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    const response = await fetch(`/api/cof/jobs/${jobId}`, {
+      headers: { 'Authorization': `Bearer ${token}` },
+    });
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.detail || 'Falha ao consultar o status da análise.');
+    }
+    const job: JobStatus = await response.json();
+    if (job.status === 'completed' && job.result) {
+      return { ...job.result, id: job.id };
+    }
+    if (job.status === 'failed') {
+      if (job.result) return job.result;
+      throw new Error(job.error || 'Falha na análise do arquivo.');
+    }
+  }
+}
+
 interface DashboardUploadProps {
   onUploadSuccess: (data: AnalysisResult) => void;
 }
@@ -50,7 +82,10 @@ export function DashboardUpload({ onUploadSuccess }: DashboardUploadProps) {
         throw new Error(errorData.detail || 'Falha no upload do arquivo.');
       }
 
-      const data = await response.json();
+      let data = await response.json();
+      if (data.status === 'processing' && data.analysis_id) {
+        data = await waitForJob(data.analysis_id, token);
+      }
       console.log('Upload success:', data);
       onUploadSuccess(data);
       
@@ -9,6 +9,7 @@ interface ComparisonData {
   id: string;
   franchise_name: string;
   analysis: AnalysisResult;
+  ranks: { score: number | null; investment: number | null; payback: number | null; risks: number | null };
 }
 
 export default function Compare() {
@@ -28,18 +29,29 @@ export default function Compare() {
 
   const fetchComparisonData = async (ids: string[]) => {
     try {
-      const { data: analyses, error } = await supabase
-        .from('analyses')
-        .select('*')
-        .in('id', ids);
+      const { data: { session } } = await supabase.auth.getSession();
+      if (!session?.access_token) throw new Error('Usuário não autenticado.');
 
-      if (error) throw error;
+      // Ranked server-side from the numeric financials stored with each analysis.
+      const response = await fetch('/api/compare', {
+        method: 'POST',
+        headers: {
+          'Authorization': `Bearer ${session.access_token}`,
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ ids, sort_by: 'score', include_analysis: true }),
+      });
+      if (!response.ok) throw new Error('Falha ao carregar a comparação.');
+      const result = await response.json();
 
-      const formattedData = analyses?.map(item => ({
-        id: item.id,
-        franchise_name: item.franchise_name,
-        analysis: item.risk_analysis
-      })) || [];
+      const formattedData = result.items
+        .filter((item: any) => item.analysis)
+        .map((item: any) => ({
+          id: item.id,
+          franchise_name: item.franchise_name,
+          analysis: item.analysis,
+          ranks: item.ranks,
+        }));
 
       setData(formattedData);
     } catch (err) {
@@ -120,6 +132,9 @@ export default function Compare() {
                                 <div className={`inline-flex items-center px-3 py-1 rounded-full text-sm font-bold ${getScoreColor(item.analysis.score)}`}>
                                     {item.analysis.score}/100
                                 </div>
+                                {item.ranks?.score && (
+                                    <span className="ml-2 text-xs text-gray-400">{item.ranks.score}º</span>
+                                )}
                             </td>
                         ))}
                     </tr>
@@ -132,11 +147,11 @@ export default function Compare() {
                     </tr>
                     
                     {[
-                        { label: 'Investimento Inicial', key: 'initial_investment' },
+                        { label: 'Investimento Inicial', key: 'initial_investment', rank: 'investment' as const },
                         { label: 'Taxa de Franquia', key: 'franchise_fee' },
                         { label: 'Royalties', key: 'royalties' },
                         { label: 'Fundo Propaganda', key: 'advertising_fund' },
-                        { label: 'Payback', key: 'payback_period', highlight: true },
+                        { label: 'Payback', key: 'payback_period', highlight: true, rank: 'payback' as const },
                         { label: 'Rentabilidade', key: 'profitability', highlight: true },
                     ].map(row => (
                         <tr key={row.key} className="hover:bg-gray-50 dark:hover:bg-gray-700/50 transition-colors">
@@ -144,6 +159,9 @@ export default function Compare() {
                             {data.map(item => (
                                 <td key={item.id} className={`p-4 text-sm border-l border-gray-100 dark:border-gray-700 ${row.highlight ? 'font-semibold text-blue-700 dark:text-blue-400' : 'text-gray-800 dark:text-gray-200'}`}>
                                     {item.analysis.financials?.[row.key as keyof typeof item.analysis.financials] || '-'}
+                                    {row.rank && item.ranks?.[row.rank] && (
+                                        <span className="ml-2 text-xs font-normal text-gray-400">{item.ranks[row.rank]}º</span>
+                                    )}
                                 </td>
                             ))}
                         </tr>
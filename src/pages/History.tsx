@@ -8,10 +8,30 @@ import { AnalysisResult } from '@/types/analysis';
 import { AnalysisResultView } from '@/components/Dashboard/AnalysisResult';
 import { useNavigate } from 'react-router-dom';
 
+const PAGE_SIZE = 50;
+
+interface AnalysisSummary {
+  id: string;
+  franchise_name: string;
+  status: string;
+  created_at: string;
+  score: number | null;
+  cnpj: string | null;
+  high_risks: number | null;
+}
+
+async function authHeaders() {
+  const { data: { session } } = await supabase.auth.getSession();
+  if (!session?.access_token) throw new Error('Usuário não autenticado.');
+  return { 'Authorization': `Bearer ${session.access_token}` };
+}
+
 export default function History() {
   const { user } = useAuth();
-  const [analyses, setAnalyses] = useState<AnalysisResult[]>([]);
+  const [analyses, setAnalyses] = useState<AnalysisSummary[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedAnalysis, setSelectedAnalysis] = useState<AnalysisResult | null>(null);
   const [searchTerm, setSearchTerm] = useState('');
   
@@ -36,19 +56,39 @@ export default function History() {
     navigate(`/compare?ids=${selectedForComparison.join(',')}`);
   };
 
-  const fetchAnalyses = async () => {
+  // The list only carries summaries; the full analysis is fetched when one is opened.
+  const fetchAnalyses = async (cursor: string | null = null) => {
     try {
       if (!user) return;
-      
-      const { data, error } = await supabase
-        .from('analyses')
-        .select('*')
-        .eq('user_id', user.id)
-        .order('created_at', { ascending: false });
 
-      if (error) throw error;
+      const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+      if (cursor) params.set('cursor', cursor);
+      const response = await fetch(`/api/analyses?${params}`, { headers: await authHeaders() });
+      if (!response.ok) throw new Error('Falha ao carregar o histórico.');
+      const page: { items: AnalysisSummary[]; next_cursor: string | null } = await response.json();
+
+      setAnalyses(prev => cursor ? [...prev, ...page.items] : page.items);
+      setNextCursor(page.next_cursor);
+    } catch (error) {
+      console.error('Error fetching history:', error);
+    } finally {
+      setLoading(false);
+      setLoadingMore(false);
+    }
+  };
+
+  const loadMore = () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    fetchAnalyses(nextCursor);
+  };
 
-      const formattedData = data.map((item: any) => ({
+  const openAnalysis = async (id: string) => {
+    try {
+      const response = await fetch(`/api/analyses/${id}`, { headers: await authHeaders() });
+      if (!response.ok) throw new Error('Falha ao carregar a análise.');
+      const item = await response.json();
+      setSelectedAnalysis({
         id: item.id,
         filename: item.franchise_name || 'Sem nome', // Using franchise_name as filename fallback
         franchise_name: item.franchise_name,
@@ -59,20 +99,18 @@ export default function History() {
         missingClauses: item.risk_analysis?.missingClauses || [],
         recommendations: item.risk_analysis?.recommendations || [],
         uploadDate: item.created_at,
-        extracted_data: item.extracted_data
-      }));
-
-      setAnalyses(formattedData);
+        extracted_data: item.extracted_data,
+        cof_version: item.cof_version,
+        version_changes: item.risk_analysis?.version_changes
+      });
     } catch (error) {
-      console.error('Error fetching history:', error);
-    } finally {
-      setLoading(false);
+      console.error('Error fetching analysis:', error);
     }
   };
 
   const filteredAnalyses = analyses.filter(analysis => 
-    analysis.franchise_name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    analysis.extracted_data?.cnpj?.includes(searchTerm)
+    (analysis.franchise_name || '').toLowerCase().includes(searchTerm.toLowerCase()) ||
+    analysis.cnpj?.includes(searchTerm)
   );
 
   const getScoreColor = (score: number) => {
@@ -142,28 +180,28 @@ export default function History() {
         ) : (
             <div className="grid gap-4">
                 {filteredAnalyses.map((analysis, index) => (
-                    <Card key={index} className={`p-4 flex flex-col md:flex-row items-center justify-between gap-4 hover:shadow-md transition-shadow cursor-pointer bg-white dark:bg-dark-surface border-gray-200 dark:border-dark-border ${selectedForComparison.includes(analysis.id!) ? 'ring-2 ring-blue-500 dark:ring-brand-blue border-blue-500' : ''}`} onClick={() => setSelectedAnalysis(analysis)}>
+                    <Card key={index} className={`p-4 flex flex-col md:flex-row items-center justify-between gap-4 hover:shadow-md transition-shadow cursor-pointer bg-white dark:bg-dark-surface border-gray-200 dark:border-dark-border ${selectedForComparison.includes(analysis.id) ? 'ring-2 ring-blue-500 dark:ring-brand-blue border-blue-500' : ''}`} onClick={() => openAnalysis(analysis.id)}>
                         <div className="flex items-center gap-4 w-full md:w-auto">
-                             <div onClick={(e) => toggleComparison(analysis.id!, e)} className="cursor-pointer text-gray-400 hover:text-blue-600 dark:hover:text-brand-blue transition-colors">
-                                {selectedForComparison.includes(analysis.id!) ? (
+                             <div onClick={(e) => toggleComparison(analysis.id, e)} className="cursor-pointer text-gray-400 hover:text-blue-600 dark:hover:text-brand-blue transition-colors">
+                                {selectedForComparison.includes(analysis.id) ? (
                                     <CheckSquare className="h-6 w-6 text-blue-600 dark:text-brand-blue" />
                                 ) : (
                                     <Square className="h-6 w-6" />
                                 )}
                              </div>
 
-                            <div className={`flex items-center justify-center w-12 h-12 rounded-full border-2 font-bold text-sm ${getScoreColor(analysis.score)}`}>
-                                {analysis.score}
+                            <div className={`flex items-center justify-center w-12 h-12 rounded-full border-2 font-bold text-sm ${getScoreColor(analysis.score ?? 0)}`}>
+                                {analysis.score ?? 0}
                             </div>
                             <div>
                                 <h3 className="font-semibold text-gray-900 dark:text-white">{analysis.franchise_name}</h3>
                                 <div className="flex items-center gap-4 text-xs text-gray-500 dark:text-gray-400 mt-1">
                                     <span className="flex items-center gap-1">
                                         <Calendar className="h-3 w-3" />
-                                        {new Date(analysis.uploadDate).toLocaleDateString()}
+                                        {new Date(analysis.created_at).toLocaleDateString()}
                                     </span>
-                                    {analysis.extracted_data?.cnpj && (
-                                        <span>CNPJ: {analysis.extracted_data.cnpj}</span>
+                                    {analysis.cnpj && (
+                                        <span>CNPJ: {analysis.cnpj}</span>
                                     )}
                                 </div>
                             </div>
@@ -171,10 +209,10 @@ export default function History() {
 
                         <div className="flex items-center gap-6 w-full md:w-auto justify-between md:justify-end">
                             <div className="flex gap-2">
-                                {analysis.risks.filter(r => r.severity === 'high').length > 0 && (
+                                {(analysis.high_risks ?? 0) > 0 && (
                                     <span className="inline-flex items-center gap-1 px-2 py-1 rounded-full bg-red-100 text-red-700 text-xs font-medium dark:bg-red-900/30 dark:text-red-400">
                                         <AlertTriangle className="h-3 w-3" />
-                                        {analysis.risks.filter(r => r.severity === 'high').length} Críticos
+                                        {analysis.high_risks} Críticos
                                     </span>
                                 )}
                             </div>
@@ -184,6 +222,13 @@ export default function History() {
                         </div>
                     </Card>
                 ))}
+                {nextCursor && (
+                    <div className="flex justify-center">
+                        <Button variant="ghost" onClick={loadMore} disabled={loadingMore}>
+                            {loadingMore ? <Loader2 className="h-4 w-4 animate-spin" /> : 'Carregar mais'}
+                        </Button>
+                    </div>
+                )}
             </div>
         )}
       </div>
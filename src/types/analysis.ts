@@ -7,6 +7,18 @@ export interface FinancialData {
   profitability: string;
 }
 
+export interface VersionChanges {
+  previous_version?: string | null;
+  pages_changed: number;
+  pages_removed: number;
+  pages_total: number;
+  changes: string[];
+  financials_changed: string[];
+  risks_added: string[];
+  risks_removed: string[];
+  score_before?: number;
+}
+
 export interface AnalysisResult {
   filename: string;
   franchise_name?: string;
@@ -23,6 +35,8 @@ export interface AnalysisResult {
   missingClauses: string[];
   recommendations: string[];
   from_cache?: boolean;
+  cof_version?: string | null;
+  version_changes?: VersionChanges;
   extracted_data?: {
     cnpj?: string;
   };
@@ -0,0 +1,22 @@
+-- One analysis row per (user, document). Lets the upload path link a cached
+-- analysis to a user with a single upsert instead of a lookup + insert.
+
+-- Remove duplicate copies of the same document for the same user, keeping a completed one (oldest first)
+DELETE FROM analyses
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id,
+               row_number() OVER (
+                   PARTITION BY user_id, file_hash
+                   ORDER BY (status = 'completed') DESC, created_at
+               ) AS rn
+        FROM analyses
+        WHERE file_hash IS NOT NULL
+    ) ranked
+    WHERE ranked.rn > 1
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_analyses_user_file_hash ON analyses(user_id, file_hash);
+
+-- Dedup lookup: completed analyses by hash
+CREATE INDEX IF NOT EXISTS idx_analyses_file_hash_status ON analyses(file_hash, status);
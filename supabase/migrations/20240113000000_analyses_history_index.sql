@@ -0,0 +1,4 @@
+-- History listing: GET /api/analyses pages through one user's analyses by
+-- (created_at, id) descending. The composite index serves both the user filter
+-- and the keyset condition, so every page is an index range scan.
+CREATE INDEX IF NOT EXISTS idx_analyses_user_created_at ON analyses(user_id, created_at DESC, id DESC);
@@ -0,0 +1,11 @@
+-- risk_alerts are written by the API when an analysis is saved. user_id is
+-- denormalized from analyses so a user's risk search is a single index scan
+-- on (user_id, severity, type) instead of a join through analyses.
+ALTER TABLE risk_alerts ADD COLUMN IF NOT EXISTS user_id UUID REFERENCES users(id) ON DELETE CASCADE;
+
+UPDATE risk_alerts
+SET user_id = analyses.user_id
+FROM analyses
+WHERE analyses.id = risk_alerts.analysis_id AND risk_alerts.user_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_risk_alerts_user_severity_type ON risk_alerts(user_id, severity, type);
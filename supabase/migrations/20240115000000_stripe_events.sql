@@ -0,0 +1,15 @@
+-- Stripe webhook deliveries are at-least-once and unordered. Each processed
+-- event id is claimed here (insert-or-ignore on the primary key) so a redelivery
+-- is a no-op, and users.plan_event_at keeps the Stripe "created" time of the
+-- event that last set the plan so an older event arriving late cannot undo it.
+CREATE TABLE IF NOT EXISTS stripe_events (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    processed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE stripe_events ENABLE ROW LEVEL SECURITY;
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS plan_event_at BIGINT;
+
+CREATE INDEX IF NOT EXISTS idx_users_stripe_customer_id ON public.users(stripe_customer_id);
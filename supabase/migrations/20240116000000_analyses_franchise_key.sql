@@ -0,0 +1,14 @@
+-- Versions of the same franchise's COF share a franchise_key ("cnpj:<14 digits>",
+-- or "name:<normalized trade name>" when the analysis has no CNPJ). The API looks
+-- up the latest completed analysis of a key to re-analyze only what changed in
+-- a new revision, and numbers the versions in analyses.cof_version.
+ALTER TABLE analyses ADD COLUMN IF NOT EXISTS franchise_key TEXT;
+
+UPDATE analyses
+SET franchise_key = 'cnpj:' || regexp_replace(extracted_data->>'cnpj', '\D', '', 'g')
+WHERE franchise_key IS NULL
+  AND length(regexp_replace(extracted_data->>'cnpj', '\D', '', 'g')) = 14
+  AND regexp_replace(extracted_data->>'cnpj', '\D', '', 'g') <> '00000000000000';
+
+CREATE INDEX IF NOT EXISTS idx_analyses_franchise_key ON analyses(franchise_key, created_at DESC)
+    WHERE status = 'completed';
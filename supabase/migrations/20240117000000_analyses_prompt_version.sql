@@ -0,0 +1,9 @@
+-- A stored analysis is reused (global dedup, completed-result lookups) only for
+-- the same file_hash, prompt_version (hash of the prompt templates) and model.
+-- Rows written before these columns existed have NULLs, never match, and are
+-- refreshed by api/reanalyze.py.
+ALTER TABLE analyses ADD COLUMN IF NOT EXISTS prompt_version VARCHAR(20);
+ALTER TABLE analyses ADD COLUMN IF NOT EXISTS model VARCHAR(100);
+
+CREATE INDEX IF NOT EXISTS idx_analyses_result_cache ON analyses(file_hash, prompt_version, model)
+    WHERE status = 'completed';
@@ -0,0 +1,13 @@
+-- The history list reads the high-risk count from extracted_data.high_risks
+-- (written at save time) instead of the risk_analysis blob. Fill it in for
+-- analyses saved before it was written, so their badge does not disappear.
+UPDATE analyses
+SET extracted_data = COALESCE(extracted_data, '{}'::jsonb) || jsonb_build_object(
+    'high_risks',
+    (SELECT count(*)
+     FROM jsonb_array_elements(risk_analysis->'risks') AS risk
+     WHERE jsonb_typeof(risk) = 'object' AND risk->>'severity' IN ('high', 'critical'))
+)
+WHERE status = 'completed'
+  AND jsonb_typeof(risk_analysis->'risks') = 'array'
+  AND (extracted_data IS NULL OR NOT extracted_data ? 'high_risks');
@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+# The api modules import each other by bare name (as on Vercel and in the
+# benchmarks), and the app-level tests reuse the benchmark stubs.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+os.environ.setdefault("CPU_POOL_KIND", "thread")
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from billing import InvalidSignature, plan_update, sign_payload, verify_event
+
+SECRET = "whsec_test"
+NOW = 1_700_000_000
+EVENT = {"id": "evt_1", "type": "customer.subscription.updated", "created": NOW,
+         "data": {"object": {"customer": "cus_1", "status": "active", "metadata": {"user_id": "user-1"}}}}
+PAYLOAD = json.dumps(EVENT).encode()
+
+
+def test_valid_signature():
+    assert verify_event(PAYLOAD, sign_payload(PAYLOAD, SECRET, NOW), SECRET, now=NOW) == EVENT
+
+
+@pytest.mark.parametrize("age", [-300, 299, 300])
+def test_timestamp_within_tolerance(age):
+    assert verify_event(PAYLOAD, sign_payload(PAYLOAD, SECRET, NOW - age), SECRET, tolerance=300, now=NOW)
+
+
+@pytest.mark.parametrize("age", [301, -301, 86400])
+def test_replayed_delivery_outside_tolerance(age):
+    # A captured delivery re-sent later still has a valid signature, but an old timestamp.
+    with pytest.raises(InvalidSignature, match="tolerance"):
+        verify_event(PAYLOAD, sign_payload(PAYLOAD, SECRET, NOW - age), SECRET, tolerance=300, now=NOW)
+
+
+def test_timestamp_cannot_be_moved_forward():
+    # Replaying with a fresh t= and the old v1= fails: the timestamp is part of what is signed.
+    old = sign_payload(PAYLOAD, SECRET, NOW - 3600)
+    forged = f"t={NOW}," + old.split(",", 1)[1]
+    with pytest.raises(InvalidSignature, match="does not match"):
+        verify_event(PAYLOAD, forged, SECRET, now=NOW)
+
+
+def test_zero_tolerance_skips_the_age_check():
+    assert verify_event(PAYLOAD, sign_payload(PAYLOAD, SECRET, 1), SECRET, tolerance=0, now=NOW)
+
+
+def test_any_matching_v1_signature_is_accepted():
+    # During a secret rotation Stripe signs with both secrets.
+    header = sign_payload(PAYLOAD, "whsec_old", NOW) + ",v1=" + sign_payload(PAYLOAD, SECRET, NOW).split("v1=")[1]
+    assert verify_event(PAYLOAD, header, SECRET, now=NOW) == EVENT
+
+
+@pytest.mark.parametrize("header, message", [
+    (None, "Missing"),
+    ("", "Missing"),
+    ("v1=abc", "Malformed"),
+    (f"t={NOW}", "Malformed"),
+    ("t=soon,v1=abc", "Malformed"),
+    (f"t={NOW},v1=abc", "does not match"),
+])
+def test_bad_headers(header, message):
+    with pytest.raises(InvalidSignature, match=message):
+        verify_event(PAYLOAD, header, SECRET, now=NOW)
+
+
+def test_wrong_secret_or_altered_payload():
+    header = sign_payload(PAYLOAD, SECRET, NOW)
+    with pytest.raises(InvalidSignature):
+        verify_event(PAYLOAD, header, "whsec_other", now=NOW)
+    with pytest.raises(InvalidSignature):
+        verify_event(PAYLOAD.replace(b"active", b"canceled"), header, SECRET, now=NOW)
+
+
+@pytest.mark.parametrize("payload", [b"not json", b'{"id": "evt_1"}', b"[]"])
+def test_signed_payload_that_is_not_an_event(payload):
+    with pytest.raises(InvalidSignature):
+        verify_event(payload, sign_payload(payload, SECRET, NOW), SECRET, now=NOW)
+
+
+def test_plan_update():
+    assert plan_update(EVENT) == {"plan": "premium", "user_id": "user-1", "customer_id": "cus_1", "created": NOW}
+    deleted = {**EVENT, "type": "customer.subscription.deleted"}
+    assert plan_update(deleted)["plan"] == "free"
+    assert plan_update({**EVENT, "type": "invoice.paid"}) is None
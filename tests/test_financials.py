@@ -0,0 +1,53 @@
+import pytest
+
+from financials import normalize_financials, parse_money, parse_months, parse_percent
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("R$ 150.000 a R$ 250.000", (150000.0, 250000.0)),
+    ("R$ 1,2 milhão", (1200000.0, 1200000.0)),
+    ("R$ 80 mil", (80000.0, 80000.0)),
+    ("6% do faturamento", None),
+    ("Não informado", None),
+    (None, None),
+])
+def test_parse_money(text, expected):
+    assert parse_money(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("6% sobre faturamento", (6.0, 6.0)),
+    ("4,5% a 5%", (4.5, 5.0)),
+    ("Não informado", None),
+])
+def test_parse_percent(text, expected):
+    assert parse_percent(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("18 a 24 meses", (18.0, 24.0)),
+    ("De 24 a 36 meses", (24.0, 36.0)),
+    ("2 anos", (24.0, 24.0)),
+    ("Não informado", None),
+])
+def test_parse_months(text, expected):
+    assert parse_months(text) == expected
+
+
+def test_normalize_financials():
+    numbers = normalize_financials({
+        "financials": {"initial_investment": "R$ 150.000 a R$ 250.000", "royalties": "6%",
+                       "payback_period": "18 a 24 meses", "franchise_fee": "Não informado"},
+        "risks": [{"severity": "high"}, {"severity": "low"}, {"severity": "unknown"}, "Multa"],
+    })
+    assert (numbers["initial_investment_min"], numbers["initial_investment_max"]) == (150000.0, 250000.0)
+    assert (numbers["franchise_fee_min"], numbers["franchise_fee_max"]) == (None, None)
+    assert numbers["royalties_pct_min"] == 6.0
+    assert (numbers["payback_months_min"], numbers["payback_months_max"]) == (18.0, 24.0)
+    assert numbers["risk_counts"] == {"critical": 0, "high": 1, "medium": 0, "low": 1}
+
+
+def test_normalize_financials_without_financials():
+    numbers = normalize_financials({"financials": "Não informado"})
+    assert numbers["initial_investment_min"] is None
+    assert numbers["risk_counts"] == {"critical": 0, "high": 0, "medium": 0, "low": 0}
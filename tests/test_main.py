@@ -0,0 +1,95 @@
+import base64
+import json
+import time
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import fakes
+import main
+from billing import sign_payload
+from fakes import FakeSupabase
+
+AUTH = {"Authorization": "Bearer tester"}
+
+
+def b64(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # PostgREST answers a malformed UUID in an id filter with an error (a 500 here); so does the stub.
+    for name in ("eq", "in_"):
+        original = getattr(fakes._Query, name)
+
+        def strict(query, column, value, _original=original):
+            for item in (value if isinstance(value, (list, tuple, set)) else [value]):
+                if column == "id" and query.table == "analyses":
+                    uuid.UUID(str(item))
+            return _original(query, column, value)
+        monkeypatch.setattr(fakes._Query, name, strict)
+    monkeypatch.setattr(main, "supabase", FakeSupabase(latency=0))
+    return TestClient(main.app)
+
+
+def test_cursor_round_trip():
+    row = {"created_at": "2024-01-17T12:00:00.123456+00:00", "id": str(uuid.uuid4())}
+    assert main.decode_cursor(main.encode_cursor(row)) == (row["created_at"], row["id"])
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor",
+    b64(["2024-01-17T12:00:00+00:00"]),
+    b64(["2024-01-17T12:00:00+00:00", "x,id.gt.0"]),
+    b64(["yesterday", str(uuid.uuid4())]),
+    b64([20240117, str(uuid.uuid4())]),
+    b64({"created_at": "2024-01-17", "id": str(uuid.uuid4())}),
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as raised:
+        main.decode_cursor(cursor)
+    assert raised.value.status_code == 400
+
+
+def test_history_rejects_invalid_cursor(client):
+    response = client.get("/api/analyses", params={"cursor": b64(["2024-01-17", "1 or 1=1"])}, headers=AUTH)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/api/analyses/{}", "/api/cof/jobs/{}"])
+@pytest.mark.parametrize("analysis_id", ["not-a-uuid", "1", str(uuid.uuid4())])
+def test_unknown_or_malformed_id_is_404(client, path, analysis_id):
+    assert client.get(path.format(analysis_id), headers=AUTH).status_code == 404
+
+
+def test_compare_rejects_malformed_ids(client):
+    response = client.post("/api/compare", json={"ids": [str(uuid.uuid4()), "not-a-uuid"]}, headers=AUTH)
+    assert response.status_code == 422
+
+
+def test_compare_accepts_uuids(client):
+    response = client.post("/api/compare", json={"ids": [str(uuid.uuid4())]}, headers=AUTH)
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+
+
+def test_webhook_redelivery_is_applied_once(client, monkeypatch):
+    monkeypatch.setattr(main, "STRIPE_WEBHOOK_SECRET", "whsec_test")
+    event = {"id": "evt_1", "type": "customer.subscription.updated", "created": int(time.time()),
+             "data": {"object": {"customer": "cus_1", "status": "active", "metadata": {"user_id": "user-tester"}}}}
+    payload = json.dumps(event).encode()
+
+    def deliver():
+        return client.post("/api/stripe/webhook", content=payload,
+                           headers={"Stripe-Signature": sign_payload(payload, "whsec_test")})
+
+    first, second = deliver(), deliver()
+    assert first.status_code == second.status_code == 200
+    assert first.json()["handled"] is True
+    assert second.json()["duplicate"] is True
+    assert client.post("/api/stripe/webhook", content=payload,
+                       headers={"Stripe-Signature": sign_payload(payload, "whsec_test", int(time.time()) - 3600)}
+                       ).status_code == 400
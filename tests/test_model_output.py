@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from llm import FAKE_ANALYSIS
+from model_output import InvalidModelOutput, extract_json, parse_analysis, parse_changes
+
+
+def test_fenced_json_is_not_a_repair():
+    assert extract_json('```json\n{"a": 1}\n```') == ({"a": 1}, False)
+
+
+def test_prose_and_trailing_commas_are_repaired():
+    value, repaired = extract_json('Segue a análise:\n{"a": 1, "b": [1, 2,],}\nEspero ter ajudado.')
+    assert value == {"a": 1, "b": [1, 2]}
+    assert repaired
+
+
+def test_truncated_json_is_cut_back_to_the_last_complete_element():
+    assert extract_json('{"a": [1, 2, 3') == ({"a": [1, 2]}, True)
+
+
+def test_commas_inside_strings_are_not_cut_points():
+    with pytest.raises(InvalidModelOutput):
+        extract_json('{"a": "x, y')
+
+
+def test_no_json_object():
+    with pytest.raises(InvalidModelOutput):
+        extract_json("Não foi possível analisar o documento.")
+
+
+def test_clean_analysis():
+    result = parse_analysis(json.dumps(FAKE_ANALYSIS, ensure_ascii=False))
+    assert result["cnpj"] == FAKE_ANALYSIS["cnpj"]
+    assert [risk["severity"] for risk in result["risks"]] == ["high", "low"]
+
+
+def test_analysis_truncated_before_required_fields_is_rejected():
+    # What a response that hit max tokens mid-"risks" looks like: the repair would
+    # drop missingClauses and recommendations, which must not default to [].
+    text = json.dumps(FAKE_ANALYSIS, ensure_ascii=False)
+    with pytest.raises(InvalidModelOutput):
+        parse_analysis("Segue a análise solicitada:\n" + text[: len(text) * 3 // 4])
+
+
+def test_analysis_truncated_inside_the_last_list_keeps_what_is_complete():
+    analysis = {**FAKE_ANALYSIS, "recommendations": ["Negociar a multa.", "Pedir os balanços."]}
+    text = json.dumps(analysis, ensure_ascii=False)
+    result = parse_analysis(text[: text.index("Pedir") + 3])
+    assert result["recommendations"] == ["Negociar a multa."]
+    assert result["missingClauses"] == FAKE_ANALYSIS["missingClauses"]
+
+
+def test_analysis_fields_are_coerced():
+    result = parse_analysis(json.dumps([{
+        **FAKE_ANALYSIS,
+        "score": "85/100",
+        "financials": {"royalties": None},
+        "risks": [{"severity": "Alta", "title": "Multa"}, "Taxa de renovação", {"severity": "high"}],
+        "missingClauses": None,
+    }]))
+    assert result["score"] == 85
+    assert result["financials"]["royalties"] == "Não informado"
+    assert [(risk["severity"], risk["title"]) for risk in result["risks"]] == [
+        ("high", "Multa"), ("medium", "Taxa de renovação")]
+    assert result["missingClauses"] == []
+
+
+def test_analysis_without_risks_is_rejected():
+    analysis = {key: value for key, value in FAKE_ANALYSIS.items() if key != "risks"}
+    with pytest.raises(InvalidModelOutput):
+        parse_analysis(json.dumps(analysis))
+
+
+def test_changes_default_to_nothing_changed():
+    assert parse_changes('{"changes": ["Nova taxa"]}')["risks_added"] == []
@@ -0,0 +1,49 @@
+from relevance import GAP_MARKER, prefilter
+
+HEADER = "FRANQUIA EXEMPLO - CIRCULAR DE OFERTA"
+PAGES = {
+    0: ("APRESENTAÇÃO", "Franqueadora Exemplo Ltda., CNPJ 12.345.678/0001-90, com sede em São Paulo."),
+    1: ("NOSSA ORIGEM", "A rede começou com uma pequena loja no interior e cresceu com o apoio das famílias fundadoras."),
+    2: ("VALORES", "Nossos valores são a transparência, o respeito ao cliente e a busca constante por qualidade."),
+    3: ("TAXAS", "Taxa de franquia de R$ 50.000 e royalties de 6% sobre o faturamento bruto."),
+    4: ("EXPANSÃO", "A equipe de expansão visita cada cidade antes de aprovar a abertura de uma nova unidade."),
+    5: ("CARDÁPIO", "O cardápio é revisado duas vezes por ano pela equipe de produto junto com os chefs parceiros."),
+    6: ("PENDÊNCIAS JUDICIAIS", "A franqueadora não possui ações judiciais em andamento."),
+    7: ("UNIFORMES", "Os uniformes seguem o manual de identidade visual entregue no treinamento inicial."),
+}
+
+
+def cof_pages() -> list[str]:
+    return ["\n".join([HEADER, *PAGES[i], f"Página {i + 1} de {len(PAGES)}"]) for i in range(len(PAGES))]
+
+
+def test_running_headers_and_page_numbers_are_dropped():
+    result = prefilter(cof_pages(), None)
+    assert HEADER not in result.text
+    assert "Página" not in result.text
+    assert result.lines_dropped == 2 * len(PAGES)
+    # No budget: every passage is kept, in order.
+    assert result.passages_kept == result.passages_total == len(PAGES)
+    assert result.text.index("TAXAS") < result.text.index("PENDÊNCIAS JUDICIAIS")
+
+
+def test_budget_keeps_the_opening_and_required_sections():
+    result = prefilter(cof_pages(), 300)
+    assert len(result.text) <= 300
+    assert result.text.startswith("APRESENTAÇÃO")
+    assert "CNPJ 12.345.678/0001-90" in result.text
+    assert "royalties de 6%" in result.text
+    assert "ações judiciais" in result.text
+    assert "cardápio" not in result.text
+    assert result.sections == {"taxas": 1, "pendencias_judiciais": 1}
+    assert result.missing_sections == ["balancos", "relacao_franqueados", "marca_inpi"]
+
+
+def test_gaps_between_kept_passages_are_marked():
+    passages = prefilter(cof_pages(), 300).text.split("\n" + GAP_MARKER + "\n")
+    assert [passage.splitlines()[0] for passage in passages] == ["APRESENTAÇÃO", "TAXAS", "PENDÊNCIAS JUDICIAIS"]
+
+
+def test_pages_that_are_all_boilerplate_are_sent_as_they_are():
+    result = prefilter(["1", "2"], 100)
+    assert result.text == "1\n2"
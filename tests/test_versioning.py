@@ -0,0 +1,74 @@
+from chunking import REQUIRED_ITEMS
+from versioning import merge_changes
+
+PREVIOUS = {
+    "franchise_name": "Franquia Exemplo",
+    "score": 70,
+    "summary": "Versão anterior.",
+    "financials": {"initial_investment": "R$ 150.000", "royalties": "5%"},
+    "risks": [
+        {"severity": "high", "title": "Multa Rescisória", "description": "Multa elevada."},
+        {"severity": "low", "title": "Taxa de Renovação", "description": "Valor não fixado."},
+    ],
+    "missingClauses": [REQUIRED_ITEMS["balancos"], "Prazo de vigência do contrato"],
+    "recommendations": ["Negociar a multa."],
+    "filename": "cof-2023.pdf",
+    "from_cache": True,
+}
+
+
+def test_nothing_changed():
+    analysis, summary = merge_changes(PREVIOUS, {})
+    assert analysis["risks"] == PREVIOUS["risks"]
+    assert analysis["missingClauses"] == PREVIOUS["missingClauses"]
+    assert analysis["score"] == 70
+    assert summary == {"changes": [], "financials_changed": [], "risks_added": [], "risks_removed": [],
+                       "score_before": 70}
+
+
+def test_per_upload_fields_are_not_carried_over():
+    analysis, _ = merge_changes(PREVIOUS, {})
+    assert "filename" not in analysis and "from_cache" not in analysis
+
+
+def test_financials():
+    analysis, summary = merge_changes(PREVIOUS, {"financials": {"royalties": "6%", "franchise_fee": None,
+                                                                "initial_investment": "R$ 150.000"}})
+    assert analysis["financials"] == {"initial_investment": "R$ 150.000", "royalties": "6%"}
+    assert summary["financials_changed"] == ["royalties"]
+
+
+def test_risks_are_matched_by_normalized_title():
+    analysis, summary = merge_changes(PREVIOUS, {
+        "risks_removed": ["taxa de renovacao"],
+        "risks_added": [{"severity": "critical", "title": "MULTA RESCISÓRIA", "description": "Multa dobrou."},
+                        {"severity": "medium", "title": "Território", "description": "Sem exclusividade."}],
+    })
+    assert [(risk["severity"], risk["title"]) for risk in analysis["risks"]] == [
+        ("critical", "MULTA RESCISÓRIA"), ("medium", "Território")]
+    assert summary["risks_removed"] == ["Taxa de Renovação"]
+    assert summary["risks_added"] == ["MULTA RESCISÓRIA", "Território"]
+
+
+def test_required_items_found_and_dropped():
+    analysis, _ = merge_changes(PREVIOUS, {"found_items": ["Balanços patrimoniais de 2022 e 2023"],
+                                           "missing_items": ["marca_inpi", "pendencias_judiciais"]})
+    assert analysis["missingClauses"] == ["Prazo de vigência do contrato", REQUIRED_ITEMS["pendencias_judiciais"],
+                                          REQUIRED_ITEMS["marca_inpi"]]
+
+
+def test_an_item_reported_both_found_and_missing_counts_as_found():
+    analysis, _ = merge_changes(PREVIOUS, {"found_items": ["marca_inpi"], "missing_items": ["marca_inpi"]})
+    assert REQUIRED_ITEMS["marca_inpi"] not in analysis["missingClauses"]
+
+
+def test_score_and_summary():
+    analysis, summary = merge_changes(PREVIOUS, {"score": 55, "summary": "Nova versão com multa maior."})
+    assert (analysis["score"], analysis["summary"]) == (55, "Nova versão com multa maior.")
+    assert summary["score_before"] == 70
+
+
+def test_previous_analysis_is_not_modified():
+    merge_changes(PREVIOUS, {"risks_added": [{"severity": "high", "title": "Multa Rescisória"}],
+                             "financials": {"royalties": "7%"}})
+    assert PREVIOUS["risks"][0]["severity"] == "high" and PREVIOUS["financials"]["royalties"] == "5%"